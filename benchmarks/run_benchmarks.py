@@ -0,0 +1,222 @@
+"""Throughput benchmarks of the loaders over a synthetic tree.
+
+Run from the repository root (settings in ``conf/benchmarks/config.yaml``)::
+
+    python -m benchmarks.run_benchmarks n_nodes=30000 windows=[7,30,90] num_workers=[0,4,8]
+
+Each (loader, window, num_workers) case runs in a fresh spawned process so its
+peak RSS is its own, and reports samples/sec (overall, and after the first
+batch so worker start-up is excluded), the peak RSS of the process and the
+peak summed RSS of its DataLoader workers (sampled from ``/proc``, Linux only),
+and the files and bytes read (``profiling.StageStats``).
+Results go to ``output`` as JSON together with the commit and settings, so runs
+on two commits can be compared case by case.
+"""
+
+import json
+import logging
+import os
+import platform
+import resource
+import subprocess
+import tempfile
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import get_context
+
+import hydra
+import numpy as np
+import torch
+from omegaconf import DictConfig, OmegaConf
+from torch.utils.data import DataLoader
+
+from benchmarks.synthetic_tree import (
+    get_synthetic_nodes,
+    get_synthetic_var_dicts,
+    write_covars_tree,
+    write_health_tree,
+)
+from legoloaderx import HealthDataset, HealthXDataset, StageStats, XDataset
+from legoloaderx.utils import compute_summary
+
+LOGGER = logging.getLogger(__name__)
+
+
+def write_tree(cfg, data_dir):
+    """Write the synthetic tree under data_dir/covars and data_dir/health."""
+    nodes = get_synthetic_nodes(cfg.n_nodes)
+    var_dict, health_var_dict = get_synthetic_var_dicts(cfg.daily_vars, cfg.yearly_vars, cfg.health_vars)
+    write_covars_tree(
+        f"{data_dir}/covars", nodes, var_dict, cfg.min_year, cfg.max_year,
+        row_group_size=cfg.row_group_size, seed=cfg.seed,
+    )
+    write_health_tree(f"{data_dir}/health", nodes, health_var_dict, cfg.min_year, cfg.max_year, list(cfg.horizons), seed=cfg.seed)
+
+
+def make_dataset(loader, settings, data_dir, window, stats):
+    nodes = get_synthetic_nodes(settings["n_nodes"])
+    var_dict, health_var_dict = get_synthetic_var_dicts(settings["daily_vars"], settings["yearly_vars"], settings["health_vars"])
+    years = dict(min_year=settings["min_year"], max_year=settings["max_year"])
+    if loader in ("XDataset", "compute_summary"):
+        return XDataset(root_dir=f"{data_dir}/covars", var_dict=var_dict, nodes=nodes, window=window, stats=stats, **years)
+    if loader == "HealthDataset":
+        return HealthDataset(
+            root_dir=f"{data_dir}/health", var_dict=health_var_dict, nodes=nodes, window=window,
+            horizons=settings["horizons"], stats=stats, **years,
+        )
+    if loader == "HealthXDataset":
+        # the daily group is the treatment, the yearly one the confounders
+        groups = list(var_dict.items())
+        return HealthXDataset(
+            root_dir=data_dir,
+            var_dict={"confounders": dict(groups[1:]), "treatments": dict(groups[:1]), "outcomes": health_var_dict},
+            nodes=nodes, window=window, horizons=settings["horizons"], stats=stats, **years,
+        )
+    raise ValueError(f"Unknown loader '{loader}'.")
+
+
+def read_status_mb(pid, field):
+    """A memory field (VmRSS, VmHWM) of /proc/{pid}/status in MB, None where unavailable."""
+    try:
+        with open(f"/proc/{pid}/status") as f:
+            for line in f:
+                if line.startswith(f"{field}:"):
+                    return int(line.split()[1]) / 1024
+    except OSError:
+        pass
+    return None
+
+
+class ChildRssSampler(threading.Thread):
+    """Peak summed RSS of this process's children (the DataLoader workers), polled from /proc."""
+
+    def __init__(self, interval=0.05):
+        super().__init__(daemon=True)
+        self.interval = interval
+        self.peak_mb = 0.0
+        self._stop_event = threading.Event()
+
+    def _children(self):
+        pid = str(os.getpid())
+        for entry in os.listdir("/proc"):
+            if entry.isdigit():
+                try:
+                    with open(f"/proc/{entry}/stat") as f:
+                        # the ppid follows the parenthesized command name
+                        if f.read().rsplit(")", 1)[1].split()[1] == pid:
+                            yield entry
+                except (OSError, IndexError):
+                    continue
+
+    def run(self):
+        while not self._stop_event.wait(self.interval):
+            rss = [read_status_mb(child, "VmRSS") for child in self._children()]
+            self.peak_mb = max(self.peak_mb, sum(mb for mb in rss if mb is not None))
+
+    def stop(self):
+        self._stop_event.set()
+        self.join()
+
+
+def run_case(loader, window, num_workers, settings, data_dir):
+    """One benchmark case; runs in its own process."""
+    stats = StageStats(max_workers=max(num_workers, 1))
+    start = time.perf_counter()
+    dataset = make_dataset(loader, settings, data_dir, window, stats)
+    init_seconds = time.perf_counter() - start
+
+    rng = np.random.default_rng(settings["seed"])
+    indices = rng.choice(len(dataset), size=min(settings["n_samples"], len(dataset)), replace=False).tolist()
+    dataloader = DataLoader(
+        dataset, batch_size=settings["batch_size"], sampler=indices, num_workers=num_workers,
+        multiprocessing_context=settings["worker_start_method"] if num_workers else None,
+    )
+
+    sampler = ChildRssSampler() if os.path.exists("/proc") else None
+    if sampler is not None:
+        sampler.start()
+    start = time.perf_counter()
+    if loader == "compute_summary":
+        compute_summary(dataloader)
+        first_batch_seconds = None
+    else:
+        batches = iter(dataloader)
+        next(batches)
+        first_batch_seconds = time.perf_counter() - start
+        for _ in batches:
+            pass
+    seconds = time.perf_counter() - start
+    if sampler is not None:
+        sampler.stop()
+
+    total = stats.summary()["total"]
+    n_after_first = len(indices) - settings["batch_size"]
+    return {
+        "loader": loader,
+        "window": window,
+        "num_workers": num_workers,
+        "samples": len(indices),
+        "init_seconds": init_seconds,
+        "seconds": seconds,
+        "samples_per_sec": len(indices) / seconds,
+        "first_batch_seconds": first_batch_seconds,
+        "steady_samples_per_sec": (
+            n_after_first / (seconds - first_batch_seconds) if first_batch_seconds is not None and n_after_first > 0 else None
+        ),
+        # VmHWM is this process's own high-water mark; ru_maxrss would include the parent's from before exec
+        "peak_rss_mb": read_status_mb("self", "VmHWM") or resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024,
+        "peak_worker_rss_mb": sampler.peak_mb if sampler is not None and num_workers else None,
+        "files_opened": total["files"],
+        "bytes_read": total["bytes_read"],
+        "stages": total["stages"],
+        "streams": total["streams"],
+    }
+
+
+def get_commit():
+    try:
+        return subprocess.run(["git", "rev-parse", "HEAD"], capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def run_benchmarks(cfg, data_dir):
+    settings = OmegaConf.to_container(cfg, resolve=True)
+    results = []
+    for loader in cfg.loaders:
+        for window in cfg.windows:
+            for num_workers in cfg.num_workers:
+                with ProcessPoolExecutor(max_workers=1, mp_context=get_context("spawn")) as pool:
+                    result = pool.submit(run_case, loader, window, num_workers, settings, data_dir).result()
+                LOGGER.info(
+                    f"{loader} window={window} num_workers={num_workers}: "
+                    f"{result['samples_per_sec']:.1f} samples/s, {result['peak_rss_mb']:.0f} MB, {result['files_opened']} files"
+                )
+                results.append(result)
+    return {
+        "commit": get_commit(),
+        "python": platform.python_version(),
+        "torch": torch.__version__,
+        "config": settings,
+        "results": results,
+    }
+
+
+@hydra.main(config_path="../conf/benchmarks", config_name="config", version_base=None)
+def main(cfg: DictConfig):
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        data_dir = cfg.data_dir or tmp_dir
+        if not os.path.exists(f"{data_dir}/covars"):
+            LOGGER.info(f"Writing synthetic tree to {data_dir}")
+            write_tree(cfg, data_dir)
+        report = run_benchmarks(cfg, data_dir)
+
+    os.makedirs(os.path.dirname(cfg.output) or ".", exist_ok=True)
+    with open(cfg.output, "w") as f:
+        json.dump(report, f, indent=2)
+    LOGGER.info(f"Saved benchmark results to {cfg.output}")
+
+
+if __name__ == "__main__":
+    main()
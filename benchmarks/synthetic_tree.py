@@ -0,0 +1,88 @@
+"""Synthetic covariate and health trees in the layout the preprocessing scripts write.
+
+Covariates follow ``src/preprocessing.py``: ``{var_group}/{var}/{var}__{timestr}.parquet``
+with one row per canonical node (sorted, NaN where a node has no data),
+``row_group_size`` rows per row group and a ``_nodes.json`` manifest per group.
+Health follows ``src/preprocessing_health.py``: ``{var_group}/{var}/{var}__{day}.parquet``
+with nonzero ``(zcta, horizon, n)`` rows sorted by ``(zcta, horizon)``, plus
+``denom/denom__{year}.parquet`` with ``(zcta, n_bene)``.
+"""
+
+import os
+
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+from legoloaderx.utils import write_node_manifest
+
+
+def get_synthetic_nodes(n_nodes):
+    """Sorted 5-digit zcta strings."""
+    return [f"{i:05d}" for i in range(1, n_nodes + 1)]
+
+
+def get_synthetic_var_dicts(n_daily_vars, n_yearly_vars, n_health_vars):
+    """(covariate var_dict, health var_dict) naming the vars the writers below produce."""
+    var_dict = {}
+    if n_daily_vars:
+        var_dict["synth_daily"] = {"vars": [f"daily_{i}" for i in range(n_daily_vars)], "temporal_res": "daily"}
+    if n_yearly_vars:
+        var_dict["synth_yearly"] = {"vars": [f"yearly_{i}" for i in range(n_yearly_vars)], "temporal_res": "yearly"}
+    health_var_dict = {"synth_ccw": {"vars": [f"outcome_{i}" for i in range(n_health_vars)], "temporal_res": "daily"}}
+    return var_dict, health_var_dict
+
+
+def _timesteps(temporal_res, min_year, max_year):
+    if temporal_res == "yearly":
+        return [str(year) for year in range(min_year, max_year + 1)]
+    dates = pd.date_range(f"{min_year}-01-01", f"{max_year}-12-31", freq="D")
+    return [f"{d.year}{d.month:02d}{d.day:02d}" for d in dates]
+
+
+def write_covars_tree(root_dir, nodes, var_dict, min_year, max_year, nan_frac=0.02, row_group_size=2048, seed=0):
+    """Write every var of ``var_dict`` for every timestep of [min_year, max_year]."""
+    rng = np.random.default_rng(seed)
+    zcta = pa.array(nodes)
+    for var_group_name, var_group in var_dict.items():
+        write_node_manifest(os.path.join(root_dir, var_group_name), nodes)
+        for var in var_group["vars"]:
+            var_dir = os.path.join(root_dir, var_group_name, var)
+            os.makedirs(var_dir, exist_ok=True)
+            for timestr in _timesteps(var_group["temporal_res"], min_year, max_year):
+                values = rng.normal(size=len(nodes)).astype("float32")
+                values[rng.random(len(nodes)) < nan_frac] = np.nan
+                table = pa.table({"zcta": zcta, var: values})
+                pq.write_table(table, os.path.join(var_dir, f"{var}__{timestr}.parquet"), row_group_size=row_group_size)
+
+
+def write_health_tree(root_dir, nodes, health_var_dict, min_year, max_year, horizons, rate=0.3, seed=0):
+    """Write horizon-summed day files of Poisson daily counts and yearly denominators."""
+    rng = np.random.default_rng(seed)
+    horizons = sorted(set(horizons) | {0})
+    days = _timesteps("daily", min_year, max_year)
+    zcta = np.array(nodes)
+    for var_group_name, var_group in health_var_dict.items():
+        for var in var_group["vars"]:
+            var_dir = os.path.join(root_dir, var_group_name, var)
+            os.makedirs(var_dir, exist_ok=True)
+            daily = rng.poisson(rate, size=(len(nodes), len(days) + max(horizons)))
+            cumsum = np.concatenate([np.zeros((len(nodes), 1), dtype=np.int64), daily.cumsum(axis=1)], axis=1)
+            for t, day in enumerate(days):
+                # n for horizon h sums days t .. t + h, as in preprocessing_health.py
+                n = np.stack([cumsum[:, t + h + 1] - cumsum[:, t] for h in horizons], axis=1)  # (nodes, horizons)
+                keep = n > 0
+                node_rows, horizon_cols = np.nonzero(keep)  # row-major: sorted by (zcta, horizon)
+                table = pa.table({
+                    "zcta": zcta[node_rows],
+                    "horizon": np.array(horizons, dtype=np.int32)[horizon_cols],
+                    "n": n[keep],
+                })
+                pq.write_table(table, os.path.join(var_dir, f"{var}__{day}.parquet"))
+
+    denom_dir = os.path.join(root_dir, "denom")
+    os.makedirs(denom_dir, exist_ok=True)
+    for year in range(min_year, max_year + 1):
+        table = pa.table({"zcta": zcta, "n_bene": rng.integers(0, 500, size=len(nodes))})
+        pq.write_table(table, os.path.join(denom_dir, f"denom__{year}.parquet"))
@@ -1,4 +1,8 @@
 from .health_x_dataloader import HealthXDataset
 from .health_dataloader import HealthDataset
 from .x_dataloader import XDataset
+from .x_stream_dataloader import XStreamDataset
+from .cube_store import CubeStore, build_cube_store
+from .node_blocks import NodeBlockSampler
+from .profiling import StageStats
 from .feature_embeddings import FeatureEmbeddings, FeatureEmbeddingsConfig
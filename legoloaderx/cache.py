@@ -0,0 +1,163 @@
+"""Byte-bounded LRU cache for decoded column vectors.
+
+Each DataLoader worker gets its own copy of the dataset, and with it its own
+cache, so no locking is needed. Entries are tensors, tuples of tensors (an
+encoded column and its validity mask, see dtypes.py) or ``None`` to remember
+that a file is missing; the byte budget counts tensor storage only.
+
+``SharedColumnCache`` is the one exception: an ``LRUCache`` that several
+XDatasets of one process read through (``HealthXDataset``'s confounders and
+treatments), so it takes a lock.
+"""
+
+import threading
+from collections import OrderedDict
+from concurrent.futures import Future
+
+
+class LRUCache:
+    def __init__(self, max_bytes):
+        self.max_bytes = int(max_bytes)
+        self.nbytes = 0
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+
+    @staticmethod
+    def _sizeof(value):
+        if value is None:
+            return 0
+        if isinstance(value, tuple):
+            return sum(LRUCache._sizeof(item) for item in value)
+        return value.element_size() * value.nelement()
+
+    def __contains__(self, key):
+        return key in self._entries
+
+    def __len__(self):
+        return len(self._entries)
+
+    def get(self, key, default=None):
+        """Return the cached value (marking it most recently used) or ``default``."""
+        if key in self._entries:
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return self._entries[key]
+        self.misses += 1
+        return default
+
+    def put(self, key, value):
+        size = self._sizeof(value)
+        if size > self.max_bytes:
+            return  # never cache something that would evict everything else
+        if key in self._entries:
+            self.nbytes -= self._sizeof(self._entries.pop(key))
+        self._entries[key] = value
+        self.nbytes += size
+        while self.nbytes > self.max_bytes:
+            _, evicted = self._entries.popitem(last=False)
+            self.nbytes -= self._sizeof(evicted)
+
+    def clear(self):
+        self._entries.clear()
+        self.nbytes = 0
+
+    def info(self):
+        total = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / total if total else 0.0,
+            "entries": len(self._entries),
+            "nbytes": self.nbytes,
+            "max_bytes": self.max_bytes,
+        }
+
+
+class SharedColumnCache(LRUCache):
+    """Column cache shared by several XDatasets over the same root_dir and nodes.
+
+    Entries keep XDataset's (var_group, var, timestep) keys, so a group listed in
+    more than one dataset is decoded once per process. The zcta row assignments
+    of groups without a node manifest, and reads in flight, are shared even with
+    ``max_bytes=0``, which keeps no columns. Operations are guarded by a lock, as
+    ``HealthXDataset(concurrent_streams=True)`` reads the datasets on separate
+    threads, and a key being read by one thread is waited for by the others
+    (:meth:`reserve`) instead of being read twice.
+    """
+
+    def __init__(self, max_bytes, nodes):
+        super().__init__(max_bytes)
+        self.nodes = list(nodes)
+        self.storage = {}  # var_group -> (dtype, scale) its entries are encoded with
+        self.zcta_assignments = {}  # var_group -> (zcta_index, row_filter), see XDataset
+        self._pending = {}  # key -> Future of the entry another thread is reading
+        self._lock = threading.Lock()
+        self._zcta_lock = threading.Lock()
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        for name in ("_lock", "_zcta_lock"):
+            del state[name]
+        state["_pending"] = {}  # reads in flight belong to this process's threads
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._lock = threading.Lock()
+        self._zcta_lock = threading.Lock()
+
+    def register(self, nodes, storage):
+        """Check that a dataset's nodes and per-group storage agree with what the cache already holds."""
+        if list(nodes) != self.nodes:
+            raise ValueError("Datasets sharing a column cache must use the same nodes.")
+        for var_group_name, spec in storage.items():
+            if self.storage.setdefault(var_group_name, spec) != spec:
+                raise ValueError(
+                    f"Var group '{var_group_name}' is stored as {self.storage[var_group_name]} and {spec} by datasets sharing a cache."
+                )
+
+    def zcta_assignment(self, var_group_name, load):
+        """The zcta row assignment of a group, computed once by ``load()`` while other callers wait."""
+        with self._zcta_lock:
+            if var_group_name not in self.zcta_assignments:
+                self.zcta_assignments[var_group_name] = load()
+            return self.zcta_assignments[var_group_name]
+
+    def reserve(self, key):
+        """(future, owner): the caller reads key and calls put (or release) when owner, else waits on future."""
+        with self._lock:
+            if key in self._entries:  # put since the caller's get
+                future = Future()
+                future.set_result(self._entries[key])
+                return future, False
+            if key in self._pending:
+                return self._pending[key], False
+            future = self._pending[key] = Future()
+            return future, True
+
+    def release(self, key, exc):
+        """Fail a reserved key, so waiting callers raise exc instead of waiting forever."""
+        with self._lock:
+            future = self._pending.pop(key, None)
+        if future is not None:
+            future.set_exception(exc)
+
+    def __contains__(self, key):
+        with self._lock:
+            return super().__contains__(key)
+
+    def get(self, key, default=None):
+        with self._lock:
+            return super().get(key, default)
+
+    def put(self, key, value):
+        with self._lock:
+            super().put(key, value)
+            future = self._pending.pop(key, None)
+        if future is not None:
+            future.set_result(value)  # waiters get the entry even when it is too large to cache
+
+    def clear(self):
+        with self._lock:
+            super().clear()
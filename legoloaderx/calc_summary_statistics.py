@@ -4,6 +4,7 @@ import yaml
 from omegaconf import DictConfig
 from torch.utils.data import DataLoader
 from x_dataloader import XDataset
+from x_stream_dataloader import XStreamDataset
 from utils import get_unique_ids, compute_summary
 
 @hydra.main(config_path="../conf/dataloader", config_name="config", version_base=None)
@@ -39,16 +40,18 @@ def main(cfg: DictConfig):
         var_dict=var_dict,
         nodes=unique_zctas,
         normalize = False,
+        return_mask="packed",  # zeros plus valid counts, no NaN scans in compute_summary
         window=1,
         min_year = cfg.min_year, 
-        max_year = cfg.max_year
+        max_year = cfg.max_year,
+        prefetch_threads=cfg.prefetch_threads if hasattr(cfg, 'prefetch_threads') else 0,
+        prefetch_ahead=cfg.prefetch_ahead if hasattr(cfg, 'prefetch_ahead') else 0
     )
 
-    # adapt to dataloader
+    # adapt to dataloader: stream the days in order, each file read once
     dataloader = DataLoader(
-        dataset,
+        XStreamDataset(dataset, batch_size=1),
         batch_size=1,
-        shuffle=True,
         num_workers=0,
     )
 
@@ -0,0 +1,43 @@
+"""Batching of sparse outcome tensors.
+
+Daily outcome counts are mostly zeros, so ``HealthDataset(sparse=True)``
+returns ``outcomes`` (and ``lead_outcomes``) as torch sparse COO tensors:
+only the nonzero (and NaN) slots travel from the workers to the main process.
+The DataLoader's default collate cannot stack sparse tensors in a worker, so
+pass :func:`sparse_collate` as ``collate_fn``; it stacks sparse tensors into a
+sparse ``(batch, ...)`` tensor and leaves everything else to
+``default_collate``. :func:`densify` turns a batch dense again, after moving
+it to the device that needs it::
+
+    loader = DataLoader(dataset, batch_size=32, num_workers=4, collate_fn=sparse_collate)
+    for batch in loader:
+        batch = densify(batch, device="cuda")
+"""
+
+import torch
+from torch.utils.data import default_collate
+
+
+def sparse_collate(batch):
+    """default_collate, stacking sparse tensors (by key or position) into a sparse batch."""
+    elem = batch[0]
+    if isinstance(elem, torch.Tensor) and elem.is_sparse:
+        return torch.stack(batch).coalesce()
+    if isinstance(elem, dict):
+        return {key: sparse_collate([sample[key] for sample in batch]) for key in elem}
+    if isinstance(elem, tuple):
+        return tuple(sparse_collate(list(samples)) for samples in zip(*batch))
+    return default_collate(batch)
+
+
+def densify(batch, device=None, non_blocking=False):
+    """The batch with every tensor moved to device (if given) and sparse ones made dense there."""
+    if isinstance(batch, torch.Tensor):
+        if device is not None:
+            batch = batch.to(device, non_blocking=non_blocking)
+        return batch.to_dense() if batch.is_sparse else batch
+    if isinstance(batch, dict):
+        return {key: densify(value, device, non_blocking) for key, value in batch.items()}
+    if isinstance(batch, (tuple, list)):
+        return type(batch)(densify(value, device, non_blocking) for value in batch)
+    return batch
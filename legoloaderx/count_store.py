@@ -0,0 +1,231 @@
+"""Sparse daily count store for health outcomes.
+
+``src/preprocessing_health.py`` writes one file per day with a row per
+(zcta, horizon), so every horizon is materialised on disk and a new horizon
+needs a pipeline rerun. A count store keeps the daily counts once instead,
+as two sparse arrays per (var, year):
+
+- a CSR over ``(days, nodes)``: ``indptr`` (days + 1,), ``indices`` (nnz,)
+  node positions and ``data`` (nnz,) counts;
+- the same nonzeros ordered by node, with each node's running count within
+  the year at its nonzero days: ``indptr`` (nodes + 1,), ``days`` (nnz,) day
+  of year, ``cum`` (nnz,) and ``base`` (nodes,), the node's count over all
+  earlier years of the store.
+
+The count of a node over days before day ``t`` is ``base`` plus ``cum`` at
+its last nonzero day before ``t``, found with one ``searchsorted`` over the
+year's nonzeros; the count over days ``t .. t + h`` is the difference of two
+such prefixes, for any horizon, including horizons that were never
+preprocessed. Both arrays are as large as the nonzeros, so a store is about
+the size of the horizon-0 rows of the day files. Sums are cut at the end of
+the store's period, as the day files are at the end of the input data.
+
+Layout on disk::
+
+    {root_dir}/{var_group}/_counts/{var}/counts__{year}.npz  # CSR of one year
+    {root_dir}/{var_group}/_counts/{var}/prefix__{year}.npz  # running counts of one year, by node
+    {root_dir}/{var_group}/_counts/{var}/meta.json           # nodes, min_year, max_year
+
+``meta.json`` is written last, so a store without it is an interrupted build.
+``HealthDataset(backend="counts")`` reads from it.
+"""
+
+import json
+import os
+
+import duckdb
+import numpy as np
+import pandas as pd
+
+COUNTS_DIRNAME = "_counts"
+_DAY_STRIDE = 367  # more than the days of a year: node * _DAY_STRIDE + day sorts by (node, day)
+
+
+def count_store_dir(root_dir, var_group_name, var):
+    return os.path.join(root_dir, var_group_name, COUNTS_DIRNAME, var)
+
+
+def get_period_days(min_year, max_year):
+    dates = pd.date_range(f"{min_year}-01-01", f"{max_year}-12-31", freq="D")
+    return [f"{d.year}{d.month:02d}{d.day:02d}" for d in dates]
+
+
+def write_count_year(out_dir, year, n_nodes, day_idx, node_idx, n):
+    """Write the CSR of one year from (day of year, node position, count) triplets; zero counts are dropped."""
+    n_days = len(get_period_days(year, year))
+    day_idx, node_idx, n = np.asarray(day_idx), np.asarray(node_idx), np.asarray(n)
+    keep = n > 0
+    order = np.lexsort((node_idx[keep], day_idx[keep]))
+    day_idx, node_idx, n = day_idx[keep][order], node_idx[keep][order], n[keep][order]
+    if len(node_idx) and (node_idx.max() >= n_nodes or day_idx.max() >= n_days):
+        raise ValueError(f"Count triplets of {year} fall outside ({n_days} days, {n_nodes} nodes).")
+    indptr = np.zeros(n_days + 1, dtype=np.int64)
+    np.cumsum(np.bincount(day_idx, minlength=n_days), out=indptr[1:])
+    np.savez(
+        os.path.join(out_dir, f"counts__{year}.npz"),
+        indptr=indptr, indices=node_idx.astype(np.int32), data=n.astype(np.int32),
+    )
+
+
+def read_count_year(out_dir, year):
+    """(indptr, indices, data) of one year."""
+    with np.load(os.path.join(out_dir, f"counts__{year}.npz")) as f:
+        return f["indptr"], f["indices"], f["data"]
+
+
+def build_count_store(root_dir, var_group_name, var, nodes, source, min_year=2000, max_year=2020):
+    """Build the store of one var from long-format daily counts.
+
+    ``source`` is a parquet path or glob with ``zcta``, ``date`` and ``n`` columns
+    and, optionally, a ``var`` column (the lego ``sparse_counts`` files). Counts of
+    zctas not in ``nodes`` are dropped. Returns the store directory.
+    """
+    out_dir = count_store_dir(root_dir, var_group_name, var)
+    os.makedirs(out_dir, exist_ok=True)
+    meta_path = os.path.join(out_dir, "meta.json")
+    if os.path.exists(meta_path):
+        os.remove(meta_path)  # invalidate any previous store while rebuilding
+
+    conn = duckdb.connect()
+    columns = conn.execute(f"DESCRIBE SELECT * FROM read_parquet('{source}')").df()["column_name"].tolist()
+    var_filter = f"AND var = '{var}'" if "var" in columns else ""
+    node_index = pd.Index(nodes)
+    for year in range(min_year, max_year + 1):
+        df = conn.execute(f"""
+            SELECT zcta, dayofyear(date) - 1 AS day_idx, SUM(n) AS n
+            FROM read_parquet('{source}')
+            WHERE year(date) = {year} {var_filter}
+            GROUP BY zcta, day_idx
+        """).df()
+        node_idx = node_index.get_indexer(df["zcta"])
+        found = node_idx != -1
+        write_count_year(out_dir, year, len(nodes), df["day_idx"].values[found], node_idx[found], df["n"].values[found])
+    conn.close()
+
+    build_count_prefix(out_dir, len(nodes), min_year, max_year)
+
+    with open(meta_path, "w") as f:
+        json.dump({"var_group": var_group_name, "var": var, "nodes": list(nodes), "min_year": min_year, "max_year": max_year}, f)
+    return out_dir
+
+
+def build_count_prefix(out_dir, n_nodes, min_year, max_year):
+    """Write prefix__{year}.npz of every year of [min_year, max_year] from its CSR."""
+    base = np.zeros(n_nodes, dtype=np.int64)
+    for year in range(min_year, max_year + 1):
+        indptr, indices, data = read_count_year(out_dir, year)
+        days = np.repeat(np.arange(len(indptr) - 1), np.diff(indptr))
+        order = np.lexsort((days, indices))  # by node, then day
+        nodes, days, data = indices[order], days[order], data[order].astype(np.int64)
+        node_indptr = np.zeros(n_nodes + 1, dtype=np.int64)
+        np.cumsum(np.bincount(nodes, minlength=n_nodes), out=node_indptr[1:])
+
+        # running count of each node within the year: cumsum minus the node's start
+        cum = np.cumsum(data)
+        starts = np.repeat(node_indptr[:-1], np.diff(node_indptr))
+        cum = cum - np.concatenate([[0], np.cumsum(data)])[starts]
+        if len(cum) and cum.max() > np.iinfo(np.int32).max:
+            raise ValueError(f"Yearly counts of {out_dir} overflow int32 in {year}.")
+        np.savez(
+            os.path.join(out_dir, f"prefix__{year}.npz"),
+            indptr=node_indptr, days=days.astype(np.int32), cum=cum.astype(np.int32), base=base,
+        )
+        year_totals = np.zeros(n_nodes, dtype=np.int64)
+        np.add.at(year_totals, nodes, data)
+        base = base + year_totals
+
+
+def read_prefix_year(out_dir, year):
+    """(indptr, days, cum, base) of one year."""
+    with np.load(os.path.join(out_dir, f"prefix__{year}.npz")) as f:
+        return f["indptr"], f["days"], f["cum"], f["base"]
+
+
+class CountStore:
+    """Read-only view over the store of one var written by :func:`build_count_store`."""
+
+    def __init__(self, root_dir, var_group_name, var):
+        path = count_store_dir(root_dir, var_group_name, var)
+        meta_path = os.path.join(path, "meta.json")
+        if not os.path.exists(meta_path):
+            raise FileNotFoundError(
+                f"No count store for '{var_group_name}/{var}' at {path}. Run src/build_count_store.py first."
+            )
+        with open(meta_path, "r") as f:
+            meta = json.load(f)
+
+        self.path = path
+        self.var_group_name = var_group_name
+        self.var = var
+        self.nodes = meta["nodes"]
+        self.min_year = meta["min_year"]
+        self.max_year = meta["max_year"]
+        self.days = get_period_days(self.min_year, self.max_year)
+        self.day_to_idx = {day: i for i, day in enumerate(self.days)}
+        self._years = {}  # year -> CSR, loaded on first use
+        self._prefix_years = {}  # year -> (indptr, sort keys, cum, base), loaded on first use
+        self.year_starts = {}  # year -> store index of its first day
+        for year in range(self.min_year, self.max_year + 1):
+            self.year_starts[year] = self.day_to_idx[f"{year}0101"]
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state["_years"], state["_prefix_years"] = {}, {}  # reloaded in the worker
+        return state
+
+    def node_rows(self, nodes):
+        """Store column of each node in ``nodes`` (-1 if the node is not in the store)."""
+        return pd.Index(self.nodes).get_indexer(nodes)
+
+    def day_indices(self, days):
+        """Store day index of each yyyymmdd in ``days``; ValueError outside the store's period."""
+        try:
+            return np.array([self.day_to_idx[day] for day in days], dtype=np.int64)
+        except KeyError as e:
+            raise ValueError(f"Day {e.args[0]} is outside the {self.min_year}-{self.max_year} count store of '{self.var}'.")
+
+    def horizon_sums(self, days, horizons):
+        """(days, horizons, nodes) int64 counts over ``day .. day + h``, cut at the end of the period."""
+        t = self.day_indices(days)
+        ends = np.minimum(t[:, None] + np.asarray(horizons)[None, :] + 1, len(self.days))  # (days, horizons)
+        rows, inverse = np.unique(np.concatenate([t, ends.ravel()]), return_inverse=True)
+        block = np.stack([self.prefix(row) for row in rows]) if len(rows) else np.zeros((0, len(self.nodes)), dtype=np.int64)
+        start, end = block[inverse[:len(t)]], block[inverse[len(t):]].reshape(ends.shape + (-1,))
+        return end - start[:, None, :]
+
+    def prefix(self, t):
+        """(nodes,) int64 counts over the store days before day index t (0 <= t <= number of days)."""
+        if t == len(self.days):
+            year, day_of_year = self.max_year, len(self.days) - self.year_starts[self.max_year]
+        else:
+            year = int(self.days[t][:4])
+            day_of_year = t - self.year_starts[year]
+        indptr, keys, cum, base = self.__prefix_year(year)
+        # last nonzero day of each node before day_of_year, if any
+        pos = np.searchsorted(keys, np.arange(len(self.nodes), dtype=np.int64) * _DAY_STRIDE + day_of_year) - 1
+        found = pos >= indptr[:-1]
+        out = base.copy()
+        out[found] += cum[pos[found]]
+        return out
+
+    def __prefix_year(self, year):
+        if year not in self._prefix_years:
+            indptr, days, cum, base = read_prefix_year(self.path, year)
+            nodes = np.repeat(np.arange(len(indptr) - 1, dtype=np.int64), np.diff(indptr))
+            self._prefix_years[year] = (indptr, nodes * _DAY_STRIDE + days, cum, base)
+        return self._prefix_years[year]
+
+    def daily(self, days):
+        """(days, nodes) int64 daily counts, from the CSRs."""
+        out = np.zeros((len(days), len(self.nodes)), dtype=np.int64)
+        for i, day in enumerate(days):
+            year = int(day[:4])
+            if year not in self._years:
+                if year < self.min_year or year > self.max_year:
+                    raise ValueError(f"Day {day} is outside the {self.min_year}-{self.max_year} count store of '{self.var}'.")
+                self._years[year] = read_count_year(self.path, year)
+            indptr, indices, data = self._years[year]
+            day_of_year = self.day_to_idx[day] - self.day_to_idx[f"{year}0101"]
+            lo, hi = indptr[day_of_year], indptr[day_of_year + 1]
+            out[i, indices[lo:hi]] = data[lo:hi]
+        return out
@@ -0,0 +1,215 @@
+"""Dense memory-mapped cube store for covariate var groups.
+
+A cube consolidates every ``{var_group}/{var}/{var}__{timestr}.parquet`` file
+(or, in the wide layout, ``{var_group}/{var_group}__{timestr}.parquet``) of a
+var group into a single ``(timesteps, nodes, vars)`` float32 array that
+is aligned to a fixed node list. ``XDataset(backend="cube")`` then serves a
+window as a slice of that array instead of opening one parquet file per
+(var, day), and DataLoader workers share the OS page cache of the memmap.
+
+Layout on disk::
+
+    {root_dir}/{var_group}/_cube/cube.npy    # (timesteps, nodes, vars) float32
+    {root_dir}/{var_group}/_cube/meta.json   # timesteps, nodes, vars, temporal_res
+
+``meta.json`` is written last, so a cube without it is an interrupted build.
+
+``CubeStore.share_memory`` copies a cube into torch shared memory, and
+``CubeStore.from_array`` wraps a cube assembled in memory (XDataset's
+``shared_memory`` mode does either in the parent process). A shared cube is
+pickled to DataLoader workers as a handle to the same memory, so resident
+memory stays flat as workers scale; a disk cube is pickled by path and
+re-mapped in the worker.
+"""
+
+import json
+import logging
+import os
+
+import numpy as np
+import pandas as pd
+import pyarrow.parquet as pq
+import torch
+
+from legoloaderx.utils import get_group_timesteps
+
+CUBE_DIRNAME = "_cube"
+
+
+def cube_dir(root_dir, var_group_name):
+    return os.path.join(root_dir, var_group_name, CUBE_DIRNAME)
+
+
+def build_cube_store(
+    root_dir,
+    var_group_name,
+    vars,
+    temporal_res,
+    nodes,
+    min_year=2000,
+    max_year=2020,
+    layout="long",
+):
+    """Consolidate the parquet files of one var group into a memory-mapped cube.
+
+    ``layout`` is the tree's file layout, "long" (one file per var and timestep)
+    or "wide" (one file per timestep holding every var of the group).
+    Missing files and nodes absent from a file are stored as NaN.
+    Returns the path of the cube directory.
+    """
+    assert layout in ("long", "wide"), f"Unknown layout '{layout}'."
+    group_dir = os.path.join(root_dir, var_group_name)
+    if layout == "long" and os.path.isdir(group_dir) \
+            and not any(os.path.isdir(os.path.join(group_dir, var)) for var in vars) \
+            and any(name.startswith(f"{var_group_name}__") for name in os.listdir(group_dir)):
+        raise ValueError(f"{group_dir} is in the wide layout, pass layout='wide'.")
+
+    out_dir = cube_dir(root_dir, var_group_name)
+    os.makedirs(out_dir, exist_ok=True)
+    meta_path = os.path.join(out_dir, "meta.json")
+    if os.path.exists(meta_path):
+        os.remove(meta_path)  # invalidate any previous cube while rebuilding
+
+    timesteps = get_group_timesteps(temporal_res, min_year, max_year)
+    node_index = pd.Index(nodes)
+
+    cube = np.lib.format.open_memmap(
+        os.path.join(out_dir, "cube.npy"),
+        mode="w+",
+        dtype=np.float32,
+        shape=(len(timesteps), len(nodes), len(vars)),
+    )
+
+    n_missing, n_files = 0, 0
+    for t, timestr in enumerate(timesteps):
+        block = np.full((len(nodes), len(vars)), np.nan, dtype=np.float32)
+        if layout == "wide":
+            files = [(f"{group_dir}/{var_group_name}__{timestr}.parquet", list(vars), list(range(len(vars))))]
+        else:
+            files = [(f"{group_dir}/{var}/{var}__{timestr}.parquet", [var], [v]) for v, var in enumerate(vars)]
+        n_files += len(files)
+        for filename, file_vars, var_idx in files:
+            if not os.path.exists(filename):
+                n_missing += 1
+                continue
+            table = pq.read_table(filename, columns=["zcta", *file_vars])
+            rows = node_index.get_indexer(table.column("zcta").to_numpy(zero_copy_only=False))
+            keep = rows != -1
+            values = np.stack(
+                [table.column(var).to_numpy(zero_copy_only=False).astype(np.float32) for var in file_vars], axis=1
+            )
+            block[np.ix_(rows[keep], var_idx)] = values[keep]
+        cube[t] = block
+
+    cube.flush()
+    del cube
+
+    if n_missing:
+        logging.warning(
+            f"{var_group_name}: {n_missing} of {n_files} files missing, stored as NaN."
+        )
+
+    meta = {
+        "var_group": var_group_name,
+        "temporal_res": temporal_res,
+        "vars": list(vars),
+        "timesteps": timesteps,
+        "nodes": list(nodes),
+    }
+    with open(meta_path, "w") as f:
+        json.dump(meta, f)
+
+    return out_dir
+
+
+class CubeStore:
+    """Read-only view over a cube written by :func:`build_cube_store`."""
+
+    def __init__(self, root_dir, var_group_name):
+        path = cube_dir(root_dir, var_group_name)
+        meta_path = os.path.join(path, "meta.json")
+        if not os.path.exists(meta_path):
+            raise FileNotFoundError(
+                f"No cube for var group '{var_group_name}' at {path}. Run src/build_cube_store.py first."
+            )
+        with open(meta_path, "r") as f:
+            meta = json.load(f)
+
+        self.path = path
+        self.shared = None  # torch tensor in shared memory, see share_memory
+        self._set_meta(var_group_name, meta["temporal_res"], meta["vars"], meta["timesteps"], meta["nodes"])
+
+        self.data = np.load(os.path.join(path, "cube.npy"), mmap_mode="r")
+        assert self.data.shape == (len(self.timesteps), len(self.nodes), len(self.vars)), \
+            f"Cube shape {self.data.shape} does not match meta.json for '{var_group_name}'."
+
+    def _set_meta(self, var_group_name, temporal_res, vars, timesteps, nodes):
+        self.var_group_name = var_group_name
+        self.temporal_res = temporal_res
+        self.vars = list(vars)
+        self.timesteps = list(timesteps)
+        self.nodes = list(nodes)
+        self.var_to_idx = {var: i for i, var in enumerate(self.vars)}
+        self.timestep_to_idx = {t: i for i, t in enumerate(self.timesteps)}
+
+    @classmethod
+    def from_array(cls, var_group_name, temporal_res, vars, timesteps, nodes, data):
+        """Wrap a ``(timesteps, nodes, vars)`` float32 tensor assembled in memory."""
+        assert tuple(data.shape) == (len(timesteps), len(nodes), len(vars)), \
+            f"Cube shape {tuple(data.shape)} does not match its {len(timesteps)} timesteps, {len(nodes)} nodes and {len(vars)} vars."
+        cube = cls.__new__(cls)
+        cube.path = None
+        cube._set_meta(var_group_name, temporal_res, vars, timesteps, nodes)
+        cube.shared = data
+        cube.data = data.numpy()
+        return cube
+
+    def share_memory(self):
+        """Move the cube into torch shared memory (a copy for disk cubes); returns self."""
+        if self.shared is None:
+            shared = torch.empty(self.data.shape, dtype=torch.float32).share_memory_()
+            out = shared.numpy()
+            for t in range(len(self.timesteps)):  # one timestep at a time, no second full copy
+                out[t] = self.data[t]
+            self.shared = shared
+        elif not self.shared.is_shared():
+            self.shared.share_memory_()
+        self.data = self.shared.numpy()
+        return self
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state["data"] = None  # the memmap is reopened, the shared tensor is pickled as a handle
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        if self.shared is not None:
+            self.data = self.shared.numpy()
+        else:
+            self.data = np.load(os.path.join(self.path, "cube.npy"), mmap_mode="r")
+
+    def node_rows(self, nodes):
+        """Cube row of each node in ``nodes`` (-1 if the node is not in the cube)."""
+        return pd.Index(self.nodes).get_indexer(nodes)
+
+    def timestep_indices(self, timesteps):
+        """Cube time index of each file timestring (-1 if outside the cube)."""
+        return np.array([self.timestep_to_idx.get(t, -1) for t in timesteps], dtype=np.int64)
+
+    def read_window(self, time_idx, rows=None):
+        """Return a ``(len(time_idx), nodes, vars)`` array for the given time indices.
+
+        Contiguous runs (daily groups) are served as a single slice of the memmap;
+        indices of -1 come back as NaN. With ``rows`` only those cube rows are read.
+        """
+        valid = time_idx != -1
+        if valid.all() and np.all(np.diff(time_idx) == 1):
+            window = self.data[time_idx[0]:time_idx[-1] + 1]
+            return np.asarray(window if rows is None else window[:, rows])
+
+        n_rows = self.data.shape[1] if rows is None else len(rows)
+        out = np.full((len(time_idx), n_rows, self.data.shape[2]), np.nan, dtype=self.data.dtype)
+        if valid.any():
+            out[valid] = self.data[time_idx[valid]] if rows is None else self.data[np.ix_(time_idx[valid], rows)]
+        return out
@@ -0,0 +1,97 @@
+"""Storage and output dtypes of var groups.
+
+A var group may declare a ``dtype`` in its var_dict entry, and for integer
+dtypes a ``scale``, e.g. ``{"vars": [...], "temporal_res": "yearly",
+"dtype": "uint8", "scale": 255}`` for fractional climate types. The dtype sets
+how the group's decoded columns are held in the column cache and, when every
+group of a dataset agrees, the dataset's output dtype.
+
+Float dtypes keep NaN for missing values. Integer dtypes hold
+``round(value * scale)`` (clamped to the dtype's range) with missing values
+stored as 0, and NaN is carried by a separate boolean validity mask.
+
+Datasets with ``return_mask`` zero the missing slots of every dtype and return
+the mask as bools or, with ``return_mask="packed"``, packed eight slots to a
+byte along the time axis (:func:`pack_mask`) together with per-var counts of
+valid slots (:func:`count_valid`), so consumers never scan for NaN.
+"""
+
+import logging
+
+import torch
+
+DTYPES = {
+    "float32": torch.float32,
+    "float16": torch.float16,
+    "bfloat16": torch.bfloat16,
+    "int32": torch.int32,
+    "int16": torch.int16,
+    "uint8": torch.uint8,
+}
+
+
+def get_dtype(dtype):
+    """torch dtype for a name in DTYPES (or one of those torch dtypes)."""
+    if isinstance(dtype, torch.dtype) and dtype in DTYPES.values():
+        return dtype
+    if dtype not in DTYPES:
+        raise ValueError(f"Unsupported dtype '{dtype}', expected one of {list(DTYPES)}.")
+    return DTYPES[dtype]
+
+
+def get_var_dict_dtype(var_dict):
+    """The dtype every var group of a var_dict declares; float32 if none do or they differ."""
+    dtypes = {get_dtype(var_group.get("dtype", "float32")) for var_group in var_dict.values()}
+    if len(dtypes) > 1:
+        logging.info(f"Var groups declare different dtypes {sorted(map(str, dtypes))}, output is float32.")
+        return torch.float32
+    return dtypes.pop()
+
+
+def encode(values, dtype, scale=1):
+    """Cast float32 ``values`` to ``dtype``; returns (encoded, valid), valid None for float dtypes.
+
+    ``scale`` (a number or a tensor broadcasting against ``values``) only applies to integer dtypes.
+    """
+    if dtype.is_floating_point:
+        return values.to(dtype), None
+    valid = ~torch.isnan(values)
+    info = torch.iinfo(dtype)
+    encoded = torch.nan_to_num(values * scale, nan=0.0).round_().clamp_(info.min, info.max).to(dtype)
+    return encoded, valid
+
+
+def decode(encoded, valid=None, scale=1):
+    """Inverse of :func:`encode`: float32 values with NaN where ``valid`` is False."""
+    values = encoded.to(torch.float32)
+    if valid is None:
+        return values
+    values = values / scale
+    values[~valid] = torch.nan
+    return values
+
+
+MASK_MODES = (False, True, "packed")
+
+_BIT_WEIGHTS = torch.tensor([1, 2, 4, 8, 16, 32, 64, 128], dtype=torch.uint8)
+
+
+def pack_mask(valid):
+    """Pack a bool mask along its last dim into uint8: bit i of byte j is slot 8 * j + i."""
+    n = valid.shape[-1]
+    if n % 8:
+        valid = torch.cat([valid, valid.new_zeros(valid.shape[:-1] + (8 - n % 8,))], dim=-1)
+    bits = valid.reshape(valid.shape[:-1] + (-1, 8)).to(torch.uint8)
+    return (bits * _BIT_WEIGHTS).sum(dim=-1, dtype=torch.uint8)
+
+
+def unpack_mask(packed, n):
+    """Inverse of :func:`pack_mask` for a last dim of ``n`` slots."""
+    bits = (packed.unsqueeze(-1) >> torch.arange(8, dtype=torch.uint8)) & 1
+    return bits.reshape(packed.shape[:-1] + (-1,))[..., :n].bool()
+
+
+def count_valid(valid, batched=False):
+    """Valid slots per var of a (nodes, vars, ...) mask, or per sample and var of a (batch, nodes, vars, ...) one."""
+    var_dim = 2 if batched else 1
+    return valid.sum(dim=[d for d in range(var_dim - 1, valid.dim()) if d != var_dim])
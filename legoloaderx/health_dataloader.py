@@ -2,7 +2,16 @@ import pandas as pd
 import torch
 from torch.utils.data import DataLoader, Dataset
 import duckdb
+import numpy as np
+import pyarrow as pa
+import pyarrow.compute as pc
 import pyarrow.parquet as pq
+from legoloaderx.utils import get_node_alignment, get_window_spans, split_sample_index
+from legoloaderx.count_store import CountStore
+from legoloaderx.manifest import get_file_manifest
+from legoloaderx.node_blocks import NodeValidity
+from legoloaderx.dtypes import MASK_MODES, count_valid, get_dtype, get_var_dict_dtype, pack_mask
+from legoloaderx.profiling import NULL_STATS
 
 class HealthDataset(Dataset):
     def __init__(
@@ -16,10 +25,25 @@ class HealthDataset(Dataset):
         min_year: int = 2000,
         max_year: int = 2020,
         min_bene: int = 10,
+        file_manifest=None,  # None (scan once), path of a JSON cache, or a shared FileManifest
+        dtype=None,  # Dtype of the counts; None uses the dtype every var group declares (float32 if they differ)
+        denom_dtype=None,  # Dtype of the denominators; None is int32 for integer counts, else the counts' dtype
+        return_mask=False,  # Add a "valid" mask of the counts (bools, or "packed" plus "valid_count"); counts are 0 where invalid
+        stats=None,  # profiling.StageStats recording per-stage time and I/O across workers; None records nothing
+        backend="parquet",  # "parquet": day files of preprocessing_health.py; "counts": count stores, any horizon
+        targets="window",  # "window": every horizon of every day; "lead": horizon 0 per day plus the horizons of the lead day
+        sparse=False,  # Return outcomes as sparse COO tensors; batch them with collate.sparse_collate
+        node_years=None,  # {year: [nodes]} (node_lst_dict of get_unique_ids): adds "node_mask" and "node_index" per item
+        compact_nodes=False,  # Only read and return the nodes valid in some year of the sample (or batch)
     ):
+        assert backend in ("parquet", "counts"), f"Unknown backend '{backend}'."
+        assert targets in ("window", "lead"), f"Unknown targets '{targets}'."
         assert horizons is not None or delta_t is not None, "Either horizons or delta_t must be provided."
         assert horizons is None or delta_t is None, "Only one of horizons or delta_t can be provided."
+        if targets == "lead" and not horizons:
+            raise ValueError('targets="lead" needs horizons.')
         self.root_dir = root_dir
+        self.stats = stats if stats is not None else NULL_STATS
 
         self.var_dict = var_dict
         # Pull the vars for each var_group in var_dict
@@ -33,6 +57,7 @@ class HealthDataset(Dataset):
         self.nodes = nodes
         self.node_string = ",".join(f"'{node}'" for node in self.nodes)  # For SQL queries
         self.node_to_idx = {node: i for i, node in enumerate(self.nodes)}
+        self.node_array = pa.array(self.nodes, type=pa.string())  # value set for pc.index_in
 
         all_dates = pd.date_range(f"{min_year}-01-01", f"{max_year}-12-31", freq="D")
         self.yyyymmdd = [f"{d.year}{d.month:02d}{d.day:02d}"  for d in all_dates]
@@ -43,7 +68,7 @@ class HealthDataset(Dataset):
             if 0 not in self.horizons:
                 self.horizons.insert(0, 0)
             self.horizon_string = ",".join(map(str, self.horizons))  # For SQL queries
-            self.horizon_to_idx = {h: i for i, h in enumerate(horizons)}
+            self.horizon_to_idx = {h: i for i, h in enumerate(self.horizons)}
             self.lead_dates = self.yyyymmdd[window-1:]  # Dates for which we have window history
             self.delta_t = None
         else:
@@ -54,107 +79,360 @@ class HealthDataset(Dataset):
             self.horizon_string = None
             self.horizon_to_idx = None
 
+        # value sets for pc.index_in of the horizons a day file is read for (horizon 0, or all of them)
+        self.horizon_value_sets = {(0,): pa.array([0], type=pa.int64())}
+        if self.horizons is not None:
+            self.horizon_value_sets[tuple(self.horizons)] = pa.array(self.horizons, type=pa.int64())
+
         self.window = window
         self.min_bene = min_bene
+        # With targets="lead" "outcomes" is (nodes, vars, window) of horizon-0 counts and only the
+        # lead (last) day is read for every horizon, as "lead_outcomes" (nodes, vars, horizons)
+        self.targets = targets
+        self.sparse = sparse
+
+        # Counts are masked (NaN) where the denominator is zero: integer dtypes store 0 there
+        # and carry the mask separately (see dtypes.py)
+        self.dtype = get_dtype(dtype) if dtype is not None else get_var_dict_dtype(var_dict)
+        if denom_dtype is not None:
+            self.denom_dtype = get_dtype(denom_dtype)
+        else:
+            self.denom_dtype = self.dtype if self.dtype.is_floating_point else torch.int32
+        assert return_mask in MASK_MODES, f"Unknown return_mask '{return_mask}'."
+        self.return_mask = return_mask
+        if not self.dtype.is_floating_point and not return_mask:
+            raise ValueError(f"Integer count dtype {self.dtype} cannot hold NaN, pass return_mask=True.")
+        # Days covered by one sample: the window, plus the future days in delta_t mode
+        self.n_days = window + (self.delta_t or 0)
+
+        # With backend="counts" outcomes come from one count store per var (see count_store.py),
+        # aligned to self.nodes once, and only the denominators are read from files
+        self.backend = backend
+        self.count_stores = {}
+        if backend == "counts":
+            for var_group_name, var_group in var_dict.items():
+                for var in var_group["vars"]:
+                    store = CountStore(root_dir, var_group_name, var)
+                    node_sel, rows = get_node_alignment(store.nodes, self.nodes)
+                    self.count_stores[f"{var_group_name}_{var}"] = (store, node_sel, rows)
+            expected = {}
+        else:
+            expected = {
+                f"{var_group_name}/{var}": [f"{var}__{day}.parquet" for day in self.yyyymmdd]
+                for var_group_name, var_group in var_dict.items()
+                for var in var_group["vars"]
+            }
+        expected["denom"] = [f"denom__{year}.parquet" for year in range(min_year, max_year + 1)]
+        # Which files exist, listed once per directory instead of os.path.exists per (var, day)
+        self.files = get_file_manifest(root_dir, list(expected), file_manifest)
+        self.files.report(expected)
+
+        # Nodes present in each year, over every day a sample covers (window plus delta_t); with
+        # compact_nodes, plain indices become node blocks of the nodes valid in some sample of the batch
+        self.node_validity = NodeValidity(self.nodes, node_years, min_year, max_year) if node_years is not None else None
+        if compact_nodes and self.node_validity is None:
+            raise ValueError("compact_nodes needs node_years.")
+        self.compact_nodes = compact_nodes
+
+        # Denominators of every year, read once: (years, nodes) with min_bene applied, and where
+        # counts are masked (nodes listed with a zero denominator; absent nodes keep their counts)
+        self.min_year = min_year
+        self.denoms, self.denom_masked = self.__load_denoms(min_year, max_year)
 
     def __len__(self):
         return len(self.lead_dates)
 
-    def __getcounts_with_horizons(self, idx):
-        counts = torch.zeros((len(self.nodes), len(self.vars), len(self.horizons), self.window), dtype=torch.float32)
+    def __getcounts_with_horizons(self, dates, horizons):
+        counts = torch.zeros((len(self.nodes), len(self.vars), len(horizons), len(dates)), dtype=torch.float32)
 
         # for var in self.var_to_idx:
         for var_group_name, var_group in self.var_dict.items():
-            # Like this start_date[idx] == self.yyyymmdd[idx + window - 1]
-            dates = self.yyyymmdd[idx:idx + self.window]
-
             for var in var_group["vars"]:
                 # Get the index for the variable
                 var_index = self.var_to_idx[f"{var_group_name}_{var}"]
 
                 for date_idx, day in enumerate(dates):
-                    file = f"{self.root_dir}/{var_group_name}/{var}/{var}__{day}.parquet"
-                    
-                    if not os.path.exists(file):
-                        continue  # Skip if file doesn't exist
-                        
-                    table = pq.read_table(file).to_pandas()
-
-                    table["zcta_index"] = table["zcta"].apply(lambda z: self.node_to_idx.get(z, -1))
-                    table["horizon_index"] = table["horizon"].apply(lambda h: self.horizon_to_idx.get(h, -1))
-                    table = table[(table["zcta_index"] != -1) & (table["horizon_index"] != -1)]  # Filter out nodes not in self.node_to_idx
-                    zcta_index = torch.LongTensor(table["zcta_index"].values)
-                    horizon_index = torch.LongTensor(table["horizon_index"].values)
-                    n = torch.FloatTensor(table["n"].values)
-
-                    # Update the counts tensor
-                    counts[zcta_index, var_index, horizon_index, date_idx] = n
-
-        return counts
-
-    def __getcounts_with_delta_t(self, idx):
-        counts = torch.zeros((len(self.nodes), len(self.vars), self.window + self.delta_t), dtype=torch.float32)
-
-        for var_group_name, var_group in self.var_dict.items():
-            # Like this start_date[idx] == self.yyyymmdd[idx + window - 1]
-            dates = self.yyyymmdd[idx:idx + self.window + self.delta_t]
-
-            for var in var_group["vars"]:
-                # Get the index for the variable
-                var_index = self.var_to_idx[f"{var_group_name}_{var}"]
+                    if not self.files.exists(f"{var_group_name}/{var}", f"{var}__{day}.parquet"):
+                        continue  # Skip if file doesn't exist (reported once at init)
 
-                for date_idx, day in enumerate(dates):
                     file = f"{self.root_dir}/{var_group_name}/{var}/{var}__{day}.parquet"
+                    zcta_index, horizon_index, n = self.__read_counts(file, horizons)
 
-                    table = pq.read_table(file).to_pandas()
-                    table = table[table["horizon"] == 0]
-
-                    if not table.empty:
-                        table["zcta_index"] = table["zcta"].apply(lambda z: self.node_to_idx.get(z, -1))
-                        table = table[table["zcta_index"] != -1]  # Filter out nodes not in self.node_to_idx
-
-                        zcta_index = torch.LongTensor(table["zcta_index"].values)
-                        n = torch.FloatTensor(table["n"].values)
-
-                        counts[zcta_index, var_index, date_idx] = n
+                    with self.stats.time("scatter"):
+                        counts[zcta_index, var_index, horizon_index, date_idx] = n
 
         return counts
 
-    def __getdenom_and_mask_counts(self, idx, counts):
-        dates = self.yyyymmdd[idx:idx + self.window + self.delta_t]
-
-        _denom_cache = {}
-        denom = torch.zeros((len(self.nodes), self.window + self.delta_t), dtype=torch.float32)
-        for date_idx, day in enumerate(dates):
-            year = day[:4]
-
-            if year not in _denom_cache:
-                df = pq.read_table(f"{self.root_dir}/denom/denom__{year}.parquet").to_pandas()
-                df.loc[df.n_bene < self.min_bene, "n_bene"] = 0  # Mask out small counts
-                df["zcta_index"] = df["zcta"].map(lambda z: self.node_to_idx.get(z, -1))
-                df = df[df["zcta_index"] != -1]  # Filter out nodes not in self.node_to_idx
-                _denom_cache[year] = df
+    def __getcounts_daily(self, dates):
+        """(nodes, vars, days) horizon-0 counts: the daily CSRs of the count stores, or the horizon-0 rows of the day files."""
+        if self.count_stores:
+            return self.__getcounts_from_stores(dates)
+        # same Arrow read and missing-file check as horizon mode, keeping only horizon 0
+        return self.__getcounts_with_horizons(dates, [0])[:, :, 0]
+
+    def __getcounts_from_stores(self, dates, horizons=None):
+        """Counts from the count stores: sums over horizons from prefix sums, or daily counts from the CSRs (horizons=None)."""
+        if horizons is not None:
+            counts = torch.zeros((len(self.nodes), len(self.vars), len(horizons), len(dates)), dtype=torch.float32)
+        else:
+            counts = torch.zeros((len(self.nodes), len(self.vars), len(dates)), dtype=torch.float32)
+
+        for var, (store, node_sel, rows) in self.count_stores.items():
+            with self.stats.time("decode"):
+                if horizons is not None:
+                    values = store.horizon_sums(dates, horizons)  # (days, horizons, store nodes)
+                else:
+                    values = store.daily(dates)  # (days, store nodes)
+            self.stats.add("bytes_read", values.nbytes)
+            with self.stats.time("scatter"):
+                values = torch.from_numpy(values).movedim(-1, 0).movedim(1, -1)  # (store nodes, [horizons,] days)
+                counts[node_sel, self.var_to_idx[var]] = values[rows].to(torch.float32)
 
-            denom_df = _denom_cache[year]
-            denom_counts = torch.FloatTensor(denom_df.n_bene.values)
-            idxs = torch.LongTensor(denom_df.zcta_index.values)
-            denom[idxs, date_idx] = denom_counts
-            counts[idxs[denom_counts == 0], ..., date_idx] = torch.nan  # Mask counts where denom is zero
+        return counts
 
+    def __load_denoms(self, min_year, max_year):
+        denoms = torch.zeros((max_year - min_year + 1, len(self.nodes)), dtype=torch.float32)
+        masked = torch.zeros(denoms.shape, dtype=torch.bool)
+        for year in range(min_year, max_year + 1):
+            if not self.files.exists("denom", f"denom__{year}.parquet"):
+                continue  # no denominators: counts stay unmasked and denom 0 (reported above)
+
+            file = f"{self.root_dir}/denom/denom__{year}.parquet"
+            with self.stats.time("open"):
+                parquet_file = pq.ParquetFile(file)
+            with self.stats.time("decode"):
+                table = parquet_file.read(columns=["zcta", "n_bene"])
+            self.stats.record_read(parquet_file.metadata, ["zcta", "n_bene"])
+
+            with self.stats.time("zcta_map"):
+                zcta_index = pc.index_in(table.column("zcta").cast(pa.string()), value_set=self.node_array)
+                found = pc.is_valid(zcta_index)  # nodes not in self.nodes are dropped
+                zcta_index = torch.from_numpy(zcta_index.filter(found).to_numpy().astype(np.int64))
+                n_bene = torch.from_numpy(table.column("n_bene").filter(found).to_numpy().astype(np.float32))
+            n_bene[n_bene < self.min_bene] = 0  # Mask out small counts
+            denoms[year - min_year, zcta_index] = n_bene
+            masked[year - min_year, zcta_index] = n_bene == 0
+        return denoms, masked
+
+    def __getdenom_and_mask_counts(self, dates, counts):
+        """(nodes, days) denominators of dates; counts are set to NaN in place where the denominator is zero."""
+        with self.stats.time("scatter"):
+            year_idx = torch.tensor([int(day[:4]) - self.min_year for day in dates])
+            denom = self.denoms[year_idx].T.contiguous()
+            mask = self.denom_masked[year_idx].T  # (nodes, days)
+            counts.masked_fill_(mask.view(mask.shape[:1] + (1,) * (counts.dim() - 2) + mask.shape[1:]), torch.nan)
         return denom
 
-    def __getitem__(self, idx):
-        if self.horizon_mode == "horizons":
-            counts = self.__getcounts_with_horizons(idx)
+    def __read_counts(self, file, horizons):
+        """(node positions, horizon positions, n) of the rows of a day file with a horizon in horizons.
+
+        Only the zcta, horizon and n columns are decoded. Zctas and horizons are matched with
+        pc.index_in and rows of other nodes or horizons dropped in the same pass; files are
+        sorted by (zcta, horizon), so row-group statistics could not skip any horizon anyway.
+        """
+        columns = ["zcta", "horizon", "n"]
+        with self.stats.time("open"):
+            parquet_file = pq.ParquetFile(file)
+        with self.stats.time("decode"):
+            table = parquet_file.read(columns=columns)
+        self.stats.record_read(parquet_file.metadata, columns)
+
+        with self.stats.time("zcta_map"):
+            zcta_index = pc.index_in(table.column("zcta").cast(pa.string()), value_set=self.node_array)
+            horizon_index = pc.index_in(
+                table.column("horizon").cast(pa.int64()), value_set=self.horizon_value_sets[tuple(horizons)]
+            )
+            keep = pc.and_(pc.is_valid(zcta_index), pc.is_valid(horizon_index))  # nodes not in self.nodes, other horizons
+            if not pc.all(keep).as_py():
+                table = table.filter(keep)
+                zcta_index, horizon_index = zcta_index.filter(keep), horizon_index.filter(keep)
+
+        with self.stats.time("convert"):
+            zcta_index = torch.from_numpy(zcta_index.to_numpy().astype(np.int64))
+            horizon_index = torch.from_numpy(horizon_index.to_numpy().astype(np.int64))
+            n = torch.from_numpy(table.column("n").to_numpy().astype(np.float32))
+        return zcta_index, horizon_index, n
+
+    def __getcounts_with_lead(self, dates, lead_positions):
+        """(nodes, vars, days) horizon-0 counts of dates and (nodes, vars, horizons, leads) counts of the lead days.
+
+        History days keep horizon 0 only and the lead days every horizon; the horizon 0 of a lead
+        day is taken from its horizon vector. Day files are still decoded whole for history days
+        (horizon-0 rows are spread through files sorted by (zcta, horizon)); count stores read
+        one daily CSR row instead.
+        """
+        lead_dates = [dates[i] for i in lead_positions]
+        history_positions = sorted(set(range(len(dates))) - set(lead_positions))
+        history_dates = [dates[i] for i in history_positions]
+        history = self.__getcounts_daily(history_dates)
+        if self.count_stores:
+            lead = self.__getcounts_from_stores(lead_dates, self.horizons)
         else:
-            counts = self.__getcounts_with_delta_t(idx)
-
-        denom = self.__getdenom_and_mask_counts(idx, counts)
+            lead = self.__getcounts_with_horizons(lead_dates, self.horizons)
+
+        counts = torch.empty((len(self.nodes), len(self.vars), len(dates)), dtype=torch.float32)
+        counts[..., history_positions] = history
+        counts[..., lead_positions] = lead[:, :, self.horizon_to_idx[0]]
+        return counts, lead
+
+    def __assemble(self, dates, node_idx=None, lead_positions=None):
+        """counts, denom and valid of dates, plus the counts and valid of the lead days with targets="lead"."""
+        lead = None
+        if self.targets == "lead":
+            counts, lead = self.__getcounts_with_lead(dates, lead_positions)
+        elif self.horizon_mode == "delta_t":
+            counts = self.__getcounts_daily(dates)
+        elif self.count_stores:
+            counts = self.__getcounts_from_stores(dates, self.horizons)
+        else:
+            counts = self.__getcounts_with_horizons(dates, self.horizons)
+
+        denom = self.__getdenom_and_mask_counts(dates, counts)
+        if lead is not None:
+            self.__getdenom_and_mask_counts([dates[i] for i in lead_positions], lead)
+        if node_idx is not None:
+            # count files only list nonzero rows and are matched on zcta, so the block is taken after reading
+            node_idx = torch.from_numpy(node_idx)
+            counts, denom = counts[node_idx], denom[node_idx]
+            lead = lead[node_idx] if lead is not None else None
+
+        counts, valid = self.__to_output(counts)
+        if lead is not None:
+            lead, lead_valid = self.__to_output(lead)
+            return counts, denom.to(self.denom_dtype), valid, lead, lead_valid
+        return counts, denom.to(self.denom_dtype), valid, None, None
+
+    def __to_output(self, counts):
+        valid = None
+        if self.return_mask:
+            valid = ~torch.isnan(counts)
+            counts = counts.masked_fill(~valid, 0)
+        return counts.to(self.dtype), valid
+
+    def __to_layout(self, counts):
+        # NaN (masked) slots are nonzero and kept as explicit entries
+        return counts.to_sparse() if self.sparse else counts
 
-        return {
-            "outcomes": counts,
+    def __getitem__(self, idx):
+        # idx, or (idx, node_idx) for a block of nodes (see node_blocks.NodeBlockSampler)
+        if self.compact_nodes and not isinstance(idx, tuple):
+            idx = self.compact_index([idx])[0]
+        node_mask = self.node_mask(idx)
+        idx, node_idx = split_sample_index(idx)
+
+        # Like this start_date[idx] == self.yyyymmdd[idx + window - 1]
+        dates = self.yyyymmdd[idx:idx + self.n_days]
+        counts, denom, valid, lead, lead_valid = self.__assemble(dates, node_idx, [self.n_days - 1])
+
+        item = {
+            "outcomes": self.__to_layout(counts),
             "denom": denom,
         }
+        if self.return_mask == "packed":
+            item["valid"], item["valid_count"] = pack_mask(valid), count_valid(valid)
+        elif self.return_mask:
+            item["valid"] = valid
+        if lead is not None:
+            item["lead_outcomes"] = self.__to_layout(lead[..., 0])
+            if self.return_mask == "packed":
+                item["lead_valid"], item["lead_valid_count"] = pack_mask(lead_valid[..., 0]), count_valid(lead_valid[..., 0])
+            elif self.return_mask:
+                item["lead_valid"] = lead_valid[..., 0]
+        if node_mask is not None:
+            item["node_mask"], item["node_index"] = node_mask, self.__node_index(node_idx)
+        return item
+
+    def __getitems__(self, indices):
+        # Called by DataLoader with the whole batch of indices
+        batch = self.get_batch(indices)
+        # sparse outcomes are split per sample with unbind
+        batch = {key: value.unbind(0) if value.is_sparse else value for key, value in batch.items()}
+        return [{key: value[i] for key, value in batch.items()} for i in range(len(indices))]
+
+    def get_batch(self, indices):
+        """Batched counterpart of __getitem__: {"outcomes": (batch, ...), "denom": (batch, ...)}.
+
+        Overlapping samples are assembled from one span of days so each day file
+        is read once per batch, then the per-sample days are unfolded out of it.
+        Indices may be (idx, node_idx) pairs, as for XDataset.get_batch; with compact_nodes,
+        plain indices keep the nodes of compact_index(indices).
+        """
+        if self.compact_nodes and not any(isinstance(index, tuple) for index in indices):
+            indices = self.compact_index(indices)
+        samples = [split_sample_index(index) for index in indices]
+        blocks = {}  # node block -> (node_idx, positions in the batch)
+        for pos, (_, node_idx) in enumerate(samples):
+            key = None if node_idx is None else node_idx.tobytes()
+            blocks.setdefault(key, (node_idx, []))[1].append(pos)
+
+        outcomes, denoms, valids, leads, lead_valids = None, None, None, None, None
+        for node_idx, block_positions in blocks.values():
+            block_indices = [samples[pos][0] for pos in block_positions]
+            for first, last, positions in get_window_spans(block_indices, self.n_days):
+                # lead day of each sample, as a position in the span
+                lead_positions = sorted({block_indices[pos] - first + self.n_days - 1 for pos in positions})
+                counts, denom, valid, lead, lead_valid = self.__assemble(
+                    self.yyyymmdd[first:last + self.n_days], node_idx, lead_positions,
+                )
+                if outcomes is None:
+                    outcomes = torch.empty((len(indices),) + counts.shape[:-1] + (self.n_days,), dtype=counts.dtype)
+                    denoms = torch.empty((len(indices),) + denom.shape[:-1] + (self.n_days,), dtype=denom.dtype)
+                    if self.return_mask:
+                        valids = torch.empty(outcomes.shape, dtype=torch.bool)
+                    if lead is not None:
+                        leads = torch.empty((len(indices),) + lead.shape[:-1], dtype=lead.dtype)
+                        if self.return_mask:
+                            lead_valids = torch.empty(leads.shape, dtype=torch.bool)
+                if counts.shape[0] != outcomes.shape[1]:
+                    raise ValueError(f"Node blocks of one batch differ in size: {counts.shape[0]} and {outcomes.shape[1]}.")
+
+                # time is the last dim: (..., span) -> (..., n_samples, n_days) -> (n_samples, ..., n_days)
+                offsets = torch.tensor([block_indices[pos] - first for pos in positions])
+                batch_positions = [block_positions[pos] for pos in positions]
+                outcomes[batch_positions] = counts.unfold(-1, self.n_days, 1)[..., offsets, :].movedim(-2, 0)
+                denoms[batch_positions] = denom.unfold(-1, self.n_days, 1)[..., offsets, :].movedim(-2, 0)
+                if valids is not None:
+                    valids[batch_positions] = valid.unfold(-1, self.n_days, 1)[..., offsets, :].movedim(-2, 0)
+                if leads is not None:
+                    lead_idx = torch.tensor([lead_positions.index(offset + self.n_days - 1) for offset in offsets.tolist()])
+                    leads[batch_positions] = lead[..., lead_idx].movedim(-1, 0)
+                    if lead_valids is not None:
+                        lead_valids[batch_positions] = lead_valid[..., lead_idx].movedim(-1, 0)
+
+        batch = {
+            "outcomes": self.__to_layout(outcomes),
+            "denom": denoms,
+        }
+        if self.return_mask == "packed":
+            batch["valid"], batch["valid_count"] = pack_mask(valids), count_valid(valids, batched=True)
+        elif self.return_mask:
+            batch["valid"] = valids
+        if leads is not None:
+            batch["lead_outcomes"] = self.__to_layout(leads)
+            if self.return_mask == "packed":
+                batch["lead_valid"], batch["lead_valid_count"] = pack_mask(lead_valids), count_valid(lead_valids, batched=True)
+            elif self.return_mask:
+                batch["lead_valid"] = lead_valids
+        if self.node_validity is not None:
+            batch["node_mask"] = torch.stack([self.node_mask(index) for index in indices])
+            batch["node_index"] = torch.stack([self.__node_index(node_idx) for _, node_idx in samples])
+        return batch
+
+    def node_mask(self, idx):
+        """(nodes,) bool of the nodes valid in some year of the days of sample idx; None without node_years."""
+        if self.node_validity is None:
+            return None
+        idx, node_idx = split_sample_index(idx)
+        return self.node_validity.mask(self.yyyymmdd[idx:idx + self.n_days], node_idx)
+
+    def compact_index(self, indices):
+        """Plain indices as (idx, node_idx) pairs over the nodes valid in any of the samples."""
+        node_idx = self.node_validity.compact([self.node_mask(idx) for idx in indices])
+        return [(idx, node_idx) for idx in indices]
+
+    def __node_index(self, node_idx):
+        # positions in self.nodes of the returned nodes
+        return torch.arange(len(self.nodes)) if node_idx is None else torch.as_tensor(node_idx, dtype=torch.long)
 
 def main():
     root_dir = "data/health"
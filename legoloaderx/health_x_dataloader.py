@@ -2,9 +2,15 @@ import torch
 from torch.utils.data import DataLoader, Dataset
 from legoloaderx.x_dataloader import XDataset
 from legoloaderx.health_dataloader import HealthDataset
+from legoloaderx.cache import SharedColumnCache
+from legoloaderx.manifest import FileManifest
+from legoloaderx.node_blocks import NodeValidity
+from legoloaderx.profiling import NULL_STATS
+from legoloaderx.utils import split_sample_index
 import hydra
 import json
 import os
+from concurrent.futures import ThreadPoolExecutor
 from omegaconf import DictConfig
 
 
@@ -20,7 +26,15 @@ class HealthXDataset(Dataset):
             delta_t=None, 
             normalize=False,
             min_year=2000, 
-            max_year=2020):
+            max_year=2020,
+            return_mask=False,  # True or "packed": add "*_valid" (and packed, "*_valid_count") per stream
+            node_years=None,  # {year: [nodes]} (node_lst_dict of get_unique_ids): adds a "node_mask" per item
+            compact_nodes=False,  # Only read and return the nodes valid in some year of the sample (or batch)
+            targets="window",  # "lead": horizon-0 "outcomes" plus "lead_outcomes" of the lead day (see HealthDataset)
+            sparse=False,  # Sparse COO outcomes; batch items with collate.sparse_collate
+            concurrent_streams=False,  # Fetch the three streams of an item (or batch) on three threads
+            cache_bytes=64 << 20,  # Per-worker LRU budget of the column cache the confounders and treatments share; 0 keeps no columns
+            stats=None):  # profiling.StageStats shared by the three streams, with per-stream latency; None records nothing
 
         self.root_dir = root_dir
         self.var_dict = var_dict
@@ -29,6 +43,14 @@ class HealthXDataset(Dataset):
         self.window = window
         self.min_year = min_year
         self.max_year = max_year
+        self.return_mask = return_mask
+        self.stats = stats
+
+        # The streams read independent files and pyarrow releases the GIL while decoding, so an
+        # item costs the slowest stream instead of the sum; the pool is started lazily per process
+        self.concurrent_streams = concurrent_streams
+        self._stream_pool = None
+        self._stream_pool_pid = None
 
         # load normalization json if normalize is True
         # if self.normalize:
@@ -50,11 +72,21 @@ class HealthXDataset(Dataset):
             horizons=horizons,
             delta_t=delta_t,
             min_year=self.min_year,
-            max_year=self.max_year
+            max_year=self.max_year,
+            return_mask=self.return_mask,
+            targets=targets,
+            sparse=sparse,
+            stats=self.stats,
         )
         self.horizons = self.outcomes_dataset.horizons
         self.delta_t = self.outcomes_dataset.delta_t
        
+        # The confounders and treatments are views of one covars tree: they share its file listing and
+        # zcta mapping and one column cache, so a group in both is read once per process (with cache_bytes=0,
+        # once per concurrent read)
+        covars_files = FileManifest(f"{self.root_dir}/covars", {})
+        self.column_cache = SharedColumnCache(cache_bytes, self.nodes)
+
         self.confounders_dataset = XDataset(
             root_dir=f"{self.root_dir}/covars",
             var_dict=self.var_dict["confounders"],
@@ -62,7 +94,11 @@ class HealthXDataset(Dataset):
             window=self.window,
             normalize=self.normalize,
             min_year=self.min_year,
-            max_year=self.max_year
+            max_year=self.max_year,
+            return_mask=self.return_mask,
+            file_manifest=covars_files,
+            cache=self.column_cache,
+            stats=self.stats,
         )
         self.treatments_dataset = XDataset(
             root_dir=f"{self.root_dir}/covars",
@@ -71,7 +107,11 @@ class HealthXDataset(Dataset):
             window=self.window,
             normalize=self.normalize,
             min_year=self.min_year,
-            max_year=self.max_year
+            max_year=self.max_year,
+            return_mask=self.return_mask,
+            file_manifest=covars_files,
+            cache=self.column_cache,
+            stats=self.stats,
         )
 
         self.vars = {
@@ -83,13 +123,87 @@ class HealthXDataset(Dataset):
         self.lead_dates = self.outcomes_dataset.lead_dates
         self.yyyymmdd = self.outcomes_dataset.yyyymmdd
 
+        # Nodes present in each year, over every day an item covers (window plus delta_t); with
+        # compact_nodes, plain indices become node blocks that all three streams read
+        self.node_validity = NodeValidity(self.nodes, node_years, min_year, max_year) if node_years is not None else None
+        if compact_nodes and self.node_validity is None:
+            raise ValueError("compact_nodes needs node_years.")
+        self.compact_nodes = compact_nodes
+
     def __len__(self):
         return len(self.outcomes_dataset.lead_dates)
     
     def __getitem__(self, idx):
-        confounders = self.confounders_dataset[idx]
-        treatments = self.treatments_dataset[idx]
-        outcomes = self.outcomes_dataset[idx]
+        # idx, or (idx, node_idx) for a block of nodes (see node_blocks.NodeBlockSampler)
+        if self.compact_nodes and not isinstance(idx, tuple):
+            idx = self.compact_index([idx])[0]
+        confounders, treatments, outcomes = self.__fetch(lambda dataset: dataset[idx])
+
+        return self.__make_item(idx, confounders, treatments, outcomes)
+
+    def __getitems__(self, indices):
+        # Called by DataLoader with the whole batch: each stream reads the batch's span of days once
+        if self.compact_nodes and not any(isinstance(index, tuple) for index in indices):
+            indices = self.compact_index(indices)
+        confounders, treatments, outcomes = self.__fetch(lambda dataset: dataset.get_batch(indices))
+
+        return [
+            self.__make_item(
+                idx,
+                self.__select(confounders, i),
+                self.__select(treatments, i),
+                {key: value[i] for key, value in outcomes.items()},
+            )
+            for i, idx in enumerate(indices)
+        ]
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state["_stream_pool"] = None  # executors do not survive pickling to spawned workers
+        return state
+
+    def __fetch(self, get):
+        """get(dataset) of the confounders, treatments and outcomes streams, each timed as a stream in stats."""
+        stats = self.stats if self.stats is not None else NULL_STATS
+        streams = (
+            ("confounders", self.confounders_dataset),
+            ("treatments", self.treatments_dataset),
+            ("outcomes", self.outcomes_dataset),
+        )
+
+        def fetch(name, dataset):
+            with stats.time(name):
+                return get(dataset)
+
+        if not self.concurrent_streams:
+            return [fetch(name, dataset) for name, dataset in streams]
+        if self._stream_pool is None or self._stream_pool_pid != os.getpid():
+            # forked workers inherit the parent's pool object but not its threads
+            self._stream_pool = ThreadPoolExecutor(max_workers=len(streams), thread_name_prefix="legoloaderx-streams")
+            self._stream_pool_pid = os.getpid()
+        futures = [self._stream_pool.submit(fetch, name, dataset) for name, dataset in streams]
+        return [future.result() for future in futures]
+
+    def node_mask(self, idx):
+        """(nodes,) bool of the nodes valid in some year of the days of sample idx; None without node_years."""
+        if self.node_validity is None:
+            return None
+        idx, node_idx = split_sample_index(idx)
+        return self.node_validity.mask(self.yyyymmdd[idx:idx + self.outcomes_dataset.n_days], node_idx)
+
+    def compact_index(self, indices):
+        """Plain indices as (idx, node_idx) pairs over the nodes valid in any of the samples."""
+        node_idx = self.node_validity.compact([self.node_mask(idx) for idx in indices])
+        return [(idx, node_idx) for idx in indices]
+
+    @staticmethod
+    def __select(batch, i):
+        # a batch is a tensor, or a tuple (tensor, valid[, valid_count]) with return_mask
+        return tuple(tensor[i] for tensor in batch) if isinstance(batch, tuple) else batch[i]
+
+    def __make_item(self, idx, confounders, treatments, outcomes):
+        node_mask = self.node_mask(idx)
+        idx, node_idx = split_sample_index(idx)
 
         # extract year, month, date for each date in the window
         dates = self.yyyymmdd[idx:idx + self.window]
@@ -97,7 +211,24 @@ class HealthXDataset(Dataset):
         month = [int(date[4:6]) for date in dates]
         day = [int(date[6:8]) for date in dates]
 
-        return {
+        masks = {}
+        if self.return_mask:
+            # X streams come as (tensor, valid[, valid_count]), outcomes as a dict with the same entries
+            (confounders, *confounders_mask), (treatments, *treatments_mask) = confounders, treatments
+            streams = {
+                "confounders": confounders_mask,
+                "treatments": treatments_mask,
+                "outcomes": [outcomes[key] for key in ("valid", "valid_count") if key in outcomes],
+                "lead_outcomes": [outcomes[key] for key in ("lead_valid", "lead_valid_count") if key in outcomes],
+            }
+            for key, mask in streams.items():
+                if not mask:
+                    continue  # no lead outcomes with targets="window"
+                masks[f"{key}_valid"] = mask[0]
+                if len(mask) > 1:
+                    masks[f"{key}_valid_count"] = mask[1]
+
+        item = {
             "confounders": confounders,
             "treatments": treatments,
             "outcomes": outcomes["outcomes"],
@@ -107,6 +238,15 @@ class HealthXDataset(Dataset):
             "month": torch.tensor(month, dtype=torch.long),
             "day": torch.tensor(day, dtype=torch.long)
         }
+        if "lead_outcomes" in outcomes:
+            item["lead_outcomes"] = outcomes["lead_outcomes"]
+        item.update(masks)
+        if node_mask is not None:
+            item["node_mask"] = node_mask
+        if node_mask is not None or node_idx is not None:
+            # positions in self.nodes of the returned nodes
+            item["node_index"] = torch.arange(len(self.nodes)) if node_idx is None else torch.as_tensor(node_idx, dtype=torch.long)
+        return item
 
 @hydra.main(config_path="../conf/dataloader", config_name="config", version_base=None)
 def main(cfg: DictConfig):
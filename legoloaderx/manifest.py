@@ -0,0 +1,107 @@
+"""Index of which feature-store files exist, built once per dataset.
+
+On network filesystems every ``os.path.exists`` is a metadata round trip, and
+the datasets used to make one or two per (var, day) of every sample. A
+``FileManifest`` lists each directory a dataset reads from once (one
+``scandir`` per directory), keeps ``{reldir: {filename: size}}``, and answers
+existence checks from memory. It can be cached as JSON next to the data and
+shared between datasets over the same root.
+"""
+
+import json
+import logging
+import os
+
+
+class FileManifest:
+    def __init__(self, root_dir, entries):
+        self.root_dir = root_dir
+        self.entries = entries  # {reldir: {filename: size_in_bytes}}
+
+    @classmethod
+    def scan(cls, root_dir, reldirs):
+        """List every ``*.parquet`` file in ``{root_dir}/{reldir}`` for each reldir."""
+        entries = {}
+        for reldir in reldirs:
+            files = {}
+            path = os.path.join(root_dir, reldir)
+            if os.path.isdir(path):
+                with os.scandir(path) as it:
+                    for entry in it:
+                        if entry.name.endswith(".parquet") and entry.is_file():
+                            files[entry.name] = entry.stat().st_size
+            entries[reldir] = files
+        return cls(root_dir, entries)
+
+    @classmethod
+    def load(cls, path):
+        with open(path, "r") as f:
+            blob = json.load(f)
+        return cls(blob["root_dir"], blob["entries"])
+
+    def save(self, path):
+        tmp_path = f"{path}.{os.getpid()}.tmp"
+        with open(tmp_path, "w") as f:
+            json.dump({"root_dir": self.root_dir, "entries": self.entries}, f)
+        os.replace(tmp_path, path)
+
+    @classmethod
+    def load_or_scan(cls, root_dir, reldirs, cache_path=None):
+        """Load ``cache_path`` if it covers every reldir, else scan and (re)write it.
+
+        Delete the cache file after adding files to the feature store.
+        """
+        if cache_path is not None and os.path.exists(cache_path):
+            manifest = cls.load(cache_path)
+            if all(reldir in manifest.entries for reldir in reldirs):
+                return manifest
+            scanned = cls.scan(root_dir, [r for r in reldirs if r not in manifest.entries])
+            manifest.entries.update(scanned.entries)
+        else:
+            manifest = cls.scan(root_dir, reldirs)
+        if cache_path is not None:
+            manifest.save(cache_path)
+        return manifest
+
+    def exists(self, reldir, filename):
+        return filename in self.entries.get(reldir, ())
+
+    def size(self, reldir, filename):
+        return self.entries.get(reldir, {}).get(filename, 0)
+
+    def report(self, expected):
+        """Log one coverage line per directory for ``{reldir: [expected filenames]}``.
+
+        Returns ``{reldir: [missing filenames]}``.
+        """
+        missing = {}
+        for reldir, filenames in expected.items():
+            present = self.entries.get(reldir, {})
+            missing[reldir] = [name for name in filenames if name not in present]
+            n_bytes = sum(present.get(name, 0) for name in filenames)
+            msg = (
+                f"{reldir}: {len(filenames) - len(missing[reldir])}/{len(filenames)} files present "
+                f"({n_bytes / 1e6:.1f} MB)"
+            )
+            if missing[reldir]:
+                shown = ", ".join(missing[reldir][:5]) + (", ..." if len(missing[reldir]) > 5 else "")
+                logging.warning(f"{msg}; missing files are filled with NaNs/zeros: {shown}")
+            else:
+                logging.info(msg)
+        return missing
+
+
+def get_file_manifest(root_dir, reldirs, file_manifest=None):
+    """Resolve a dataset's ``file_manifest`` argument.
+
+    None scans the directories, a string is a JSON cache path (see
+    ``FileManifest.load_or_scan``), and a ``FileManifest`` over the same root
+    is shared as is, after scanning any directories it does not list yet.
+    """
+    if isinstance(file_manifest, FileManifest):
+        if os.path.abspath(file_manifest.root_dir) != os.path.abspath(root_dir):
+            raise ValueError(f"File manifest is for {file_manifest.root_dir}, not {root_dir}.")
+        missing = [reldir for reldir in reldirs if reldir not in file_manifest.entries]
+        file_manifest.entries.update(FileManifest.scan(root_dir, missing).entries)
+        return file_manifest
+    return FileManifest.load_or_scan(root_dir, reldirs, cache_path=file_manifest)
@@ -0,0 +1,106 @@
+"""Spatial node-block sampling: samples are (date index, node block) pairs.
+
+A full sample covers every node of the dataset, which for ~32k ZCTAs and a
+large var set makes a batch hundreds of MB. ``NodeBlockSampler`` yields
+``(idx, node_idx)`` pairs instead, where ``node_idx`` holds the positions of a
+block of nodes in ``dataset.nodes``; ``XDataset``, ``HealthDataset`` and
+``HealthXDataset`` accept these pairs wherever they accept an index and return
+``(block_size, ...)`` tensors. Batch size can then be traded against node count.
+
+Blocks are either contiguous tiles of the (sorted, so roughly regional) node
+list or random node subsets. With node-sorted files (a ``_nodes.json``
+manifest) or a cube, only the parquet row groups or cube rows a block needs
+are read.
+
+``NodeValidity`` holds which nodes exist in each year (the ``node_lst_dict``
+of ``utils.get_unique_ids``); datasets built with ``node_years`` use it for a
+per-sample node mask and, with ``compact_nodes``, turn plain indices into
+node blocks of the nodes that are valid somewhere in the sample or batch.
+"""
+
+import math
+
+import numpy as np
+import pandas as pd
+import torch
+from torch.utils.data import Sampler
+
+
+def get_node_tiles(n_nodes, block_size):
+    """Contiguous blocks of ``block_size`` node positions covering ``range(n_nodes)``.
+
+    The last tile is shifted back to end at ``n_nodes``, overlapping its
+    neighbour, so that every tile has the same size and batches stack.
+    """
+    block_size = min(block_size, n_nodes)
+    starts = list(range(0, n_nodes - block_size, block_size)) + [n_nodes - block_size]
+    return [np.arange(start, start + block_size, dtype=np.int64) for start in starts]
+
+
+class NodeBlockSampler(Sampler):
+    """Yield ``(idx, node_idx)`` pairs over the samples of ``dataset``.
+
+    mode="tiles" pairs every sample with every tile; unshuffled, consecutive
+    samples of one tile come together so a batch reads one span of days.
+    mode="random" pairs every sample with ``blocks_per_sample`` random subsets
+    of ``block_size`` nodes (sorted, drawn without replacement), by default
+    as many as it takes to cover the nodes once on average.
+    """
+
+    def __init__(self, dataset, block_size, mode="tiles", blocks_per_sample=None, shuffle=True, generator=None):
+        assert mode in ("tiles", "random"), f"Unknown node block mode '{mode}'."
+        self.n_samples = len(dataset)
+        self.n_nodes = len(dataset.nodes)
+        self.block_size = min(block_size, self.n_nodes)
+        self.mode = mode
+        self.shuffle = shuffle
+        self.generator = generator
+
+        if mode == "tiles":
+            self.tiles = get_node_tiles(self.n_nodes, self.block_size)
+            self.blocks_per_sample = len(self.tiles)
+        else:
+            self.tiles = None
+            self.blocks_per_sample = blocks_per_sample or math.ceil(self.n_nodes / self.block_size)
+
+    def __len__(self):
+        return self.n_samples * self.blocks_per_sample
+
+    def __iter__(self):
+        if self.shuffle:
+            order = torch.randperm(len(self), generator=self.generator).tolist()
+        else:
+            order = range(len(self))
+
+        for i in order:
+            block, idx = divmod(i, self.n_samples)
+            if self.mode == "tiles":
+                yield idx, self.tiles[block]
+            else:
+                subset = torch.randperm(self.n_nodes, generator=self.generator)[:self.block_size]
+                yield idx, np.sort(subset.numpy())
+
+
+class NodeValidity:
+    """Per-year node validity over a dataset's node list; years not in ``node_years`` count as all valid."""
+
+    def __init__(self, nodes, node_years, min_year, max_year):
+        self.min_year = min_year
+        self.by_year = torch.ones((max_year - min_year + 1, len(nodes)), dtype=torch.bool)
+        node_index = pd.Index(nodes)
+        for year, year_nodes in node_years.items():
+            year = int(year)
+            if min_year <= year <= max_year:
+                rows = node_index.get_indexer(list(year_nodes))
+                self.by_year[year - min_year] = False
+                self.by_year[year - min_year, torch.from_numpy(rows[rows != -1])] = True
+
+    def mask(self, dates, node_idx=None):
+        """(nodes,) bool of the nodes valid in at least one year the consecutive ``dates`` touch."""
+        first, last = int(dates[0][:4]) - self.min_year, int(dates[-1][:4]) - self.min_year
+        mask = self.by_year[first:last + 1].any(dim=0)
+        return mask if node_idx is None else mask[torch.from_numpy(node_idx)]
+
+    def compact(self, masks):
+        """Positions of the nodes valid in any of ``masks``: the nodes a compacted batch keeps."""
+        return np.flatnonzero(torch.stack(masks).any(dim=0).numpy())
@@ -0,0 +1,131 @@
+"""Thread-pool prefetch of parquet reads for XDataset.
+
+pyarrow releases the GIL while decoding, so reading the files of a sample on
+a few threads overlaps their I/O even with ``num_workers=0``. The dataset
+submits one task per (var_group, timestep) block for the current sample and
+speculatively for the next ``ahead`` samples; ``take`` hands a finished block
+back to the main thread, which is the only one touching the column cache.
+
+Each DataLoader worker lazily starts its own pool after fork/spawn. Blocks that
+are never taken (a wrong guess about the next sample) are dropped oldest-first
+once more than ``max_inflight`` are held.
+"""
+
+import os
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+from torch.utils.data import Sampler
+
+
+class Prefetcher:
+    def __init__(self, num_threads, max_inflight=1024):
+        self.num_threads = int(num_threads)
+        self.max_inflight = int(max_inflight)
+        self._reset()
+
+    def _reset(self):
+        self._pool = None
+        self._pid = os.getpid()
+        self._inflight = OrderedDict()  # key -> (future, nbytes), oldest first
+        self._lock = threading.Lock()
+        self.stall_seconds = 0.0
+        self.stalls = 0
+        self.submitted = 0
+        self.used = 0
+        self.inflight_bytes = 0
+        self.peak_inflight_bytes = 0
+        self.dropped = 0
+
+    def __getstate__(self):
+        # executors and futures do not survive pickling to spawned workers
+        return {"num_threads": self.num_threads, "max_inflight": self.max_inflight}
+
+    def __setstate__(self, state):
+        self.num_threads = state["num_threads"]
+        self.max_inflight = state["max_inflight"]
+        self._reset()
+
+    def _check_pid(self):
+        if self._pid != os.getpid():
+            self._reset()  # forked worker: the parent's threads and futures do not exist here
+
+    def _executor(self):
+        if self._pool is None:
+            self._pool = ThreadPoolExecutor(max_workers=self.num_threads, thread_name_prefix="legoloaderx-prefetch")
+        return self._pool
+
+    def __contains__(self, key):
+        self._check_pid()
+        return key in self._inflight
+
+    def submit(self, key, fn, nbytes=0):
+        """Run ``fn()`` on the pool unless ``key`` is already in flight."""
+        self._check_pid()
+        if key in self._inflight:
+            return
+        future = self._executor().submit(fn)
+        with self._lock:
+            self._inflight[key] = (future, nbytes)
+            self.submitted += 1
+            self.inflight_bytes += nbytes
+            self.peak_inflight_bytes = max(self.peak_inflight_bytes, self.inflight_bytes)
+            while len(self._inflight) > self.max_inflight:
+                _, (stale, stale_nbytes) = self._inflight.popitem(last=False)
+                stale.cancel()
+                self.inflight_bytes -= stale_nbytes
+                self.dropped += 1
+
+    def take(self, key):
+        """Return the result for ``key`` (waiting if still running), or None if it was never submitted."""
+        self._check_pid()
+        with self._lock:
+            entry = self._inflight.pop(key, None)
+        if entry is None:
+            return None
+        future, nbytes = entry
+        if not future.done():
+            start = time.perf_counter()
+            future.result()
+            self.stall_seconds += time.perf_counter() - start
+            self.stalls += 1
+        with self._lock:
+            self.inflight_bytes -= nbytes
+            self.used += 1
+        return future.result()
+
+    def info(self):
+        return {
+            "threads": self.num_threads,
+            "submitted": self.submitted,
+            "used": self.used,
+            "dropped": self.dropped,
+            "stalls": self.stalls,
+            "stall_seconds": self.stall_seconds,
+            "inflight": len(self._inflight),
+            "inflight_bytes": self.inflight_bytes,
+            "peak_inflight_bytes": self.peak_inflight_bytes,
+        }
+
+
+class PrefetchSampler(Sampler):
+    """Wrap a sampler and tell the dataset the order it will draw indices in.
+
+    Without it the prefetcher guesses that idx + 1, idx + 2, ... come next, which
+    is wasted work under shuffling. The order is only visible to a dataset in the
+    same process, i.e. with ``num_workers=0``.
+    """
+
+    def __init__(self, sampler, dataset):
+        self.sampler = sampler
+        self.dataset = dataset
+
+    def __iter__(self):
+        order = list(self.sampler)
+        self.dataset.set_prefetch_order(order)
+        return iter(order)
+
+    def __len__(self):
+        return len(self.sampler)
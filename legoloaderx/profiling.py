@@ -0,0 +1,163 @@
+"""Per-stage timing and I/O counters for the dataset classes.
+
+Pass one ``StageStats`` as ``stats=`` to ``XDataset``, ``HealthDataset`` or
+``HealthXDataset`` (which hands it to its three streams) and the readers
+record, per stage, wall time and number of calls:
+
+- ``open``: opening a parquet file and reading its footer
+- ``decode``: decoding parquet column chunks (or reading cube rows)
+- ``convert``: arrow to numpy / pandas conversion
+- ``zcta_map``: matching file rows to nodes on the zcta column
+- ``scatter``: writing decoded values into the sample tensors
+- ``normalize``: the fused normalization
+
+plus the compressed bytes of the column chunks read, the number of files read
+and column cache hits and misses. Stages run on prefetch threads are timed
+there, so with ``prefetch_threads`` stage seconds add up to more than wall time.
+``HealthXDataset`` also records the latency of each of its streams
+(``confounders``, ``treatments``, ``outcomes``) per item or batch, which shows
+the stream to blame when they are fetched concurrently.
+
+The counters live in one float64 tensor in shared memory with a row per
+process (row 0 for the main process, ``worker_id + 1`` for DataLoader
+workers), so after an epoch the parent sees every worker's numbers without
+any gathering step: ``stats.summary()`` or ``stats.dump(path)``.
+
+Datasets built without ``stats`` use ``NULL_STATS``, whose methods do nothing.
+"""
+
+import json
+import threading
+import time
+
+import torch
+from torch.utils.data import get_worker_info
+
+STAGES = ("open", "decode", "convert", "zcta_map", "scatter", "normalize")
+STREAMS = ("confounders", "treatments", "outcomes")
+COUNTERS = ("bytes_read", "files", "cache_hits", "cache_misses")
+FIELDS = (
+    [f"{name}_seconds" for name in STAGES + STREAMS] + [f"{name}_calls" for name in STAGES + STREAMS] + list(COUNTERS)
+)
+_FIELD_INDEX = {field: i for i, field in enumerate(FIELDS)}
+
+
+def get_read_bytes(metadata, columns, row_groups=None):
+    """Compressed size of the chunks of ``columns`` in ``row_groups`` (all by default) of a parquet file."""
+    columns = set(columns)
+    total = 0
+    for i in range(metadata.num_row_groups) if row_groups is None else row_groups:
+        row_group = metadata.row_group(i)
+        for j in range(row_group.num_columns):
+            chunk = row_group.column(j)
+            if chunk.path_in_schema in columns:
+                total += chunk.total_compressed_size
+    return total
+
+
+class _Timer:
+    __slots__ = ("stats", "stage", "start")
+
+    def __init__(self, stats, stage):
+        self.stats = stats
+        self.stage = stage
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+
+    def __exit__(self, *exc):
+        self.stats.add(f"{self.stage}_seconds", time.perf_counter() - self.start)
+        self.stats.add(f"{self.stage}_calls")
+
+
+class StageStats:
+    enabled = True
+
+    def __init__(self, max_workers=32):
+        self.max_workers = int(max_workers)
+        self.table = torch.zeros((self.max_workers + 1, len(FIELDS)), dtype=torch.float64).share_memory_()
+        self._lock = threading.Lock()
+
+    def __getstate__(self):
+        return {"max_workers": self.max_workers, "table": self.table}
+
+    def __setstate__(self, state):
+        self.max_workers = state["max_workers"]
+        self.table = state["table"]  # still the shared tensor when pickled to a spawned worker
+        self._lock = threading.Lock()
+
+    def _row(self):
+        info = get_worker_info()
+        if info is None:
+            return 0
+        if info.id >= self.max_workers:
+            raise ValueError(f"StageStats(max_workers={self.max_workers}) used by DataLoader worker {info.id}.")
+        return info.id + 1
+
+    def time(self, stage):
+        """Context manager adding its wall time to ``stage`` (a stage or a stream)."""
+        return _Timer(self, stage)
+
+    def add(self, field, value=1):
+        with self._lock:
+            self.table[self._row(), _FIELD_INDEX[field]] += value
+
+    def record_read(self, metadata, columns, row_groups=None):
+        """Count one file read and the bytes of its chunks (see get_read_bytes)."""
+        self.add("files")
+        self.add("bytes_read", get_read_bytes(metadata, columns, row_groups))
+
+    def reset(self):
+        self.table.zero_()
+
+    @staticmethod
+    def _to_dict(values):
+        values = values.tolist()
+        out = {
+            key: {
+                name: {"seconds": values[_FIELD_INDEX[f"{name}_seconds"]], "calls": int(values[_FIELD_INDEX[f"{name}_calls"]])}
+                for name in names
+            }
+            for key, names in (("stages", STAGES), ("streams", STREAMS))
+        }
+        out.update({counter: int(values[_FIELD_INDEX[counter]]) for counter in COUNTERS})
+        return out
+
+    def summary(self):
+        """Totals over every process, and the numbers of each process that recorded anything."""
+        workers = {}
+        for row, values in enumerate(self.table):
+            if values.any():
+                workers["main" if row == 0 else f"worker_{row - 1}"] = self._to_dict(values)
+        return {"total": self._to_dict(self.table.sum(dim=0)), "workers": workers}
+
+    def dump(self, path):
+        with open(path, "w") as f:
+            json.dump(self.summary(), f, indent=2)
+
+
+class _NullTimer:
+    __slots__ = ()
+
+    def __enter__(self):
+        pass
+
+    def __exit__(self, *exc):
+        pass
+
+
+class _NullStats:
+    enabled = False
+    _timer = _NullTimer()
+
+    def time(self, stage):
+        return self._timer
+
+    def add(self, field, value=1):
+        pass
+
+    def record_read(self, metadata, columns, row_groups=None):
+        pass
+
+
+NULL_STATS = _NullStats()
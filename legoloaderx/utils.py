@@ -1,7 +1,9 @@
 import json
 import os
 import logging
+import hashlib
 import duckdb
+import numpy as np
 import pandas as pd
 import json
 import os
@@ -40,6 +42,10 @@ def compute_summary(loader, output_dir=None, output_nm=None):
             var_to_group[var] = var_group_name
     
     var_lst = [var for source in var_dict.values() for var in source['vars']]
+    # integer outputs hold round(value * scale) per var group
+    var_scale = torch.tensor(
+        [source.get("scale", 1) for source in var_dict.values() for _ in source["vars"]], dtype=torch.float32
+    ).view(1, 1, -1, 1)
     
     totals_nan = torch.zeros(len(var_lst))
     totals_sum = torch.zeros(len(var_lst))
@@ -51,12 +57,26 @@ def compute_summary(loader, output_dir=None, output_nm=None):
 
     # count = 0
     # iterate through
+    # datasets with node_years end their outputs with (node_mask, node_index)
+    has_nodes = getattr(loader.dataset, "node_validity", None) is not None
+
     for batch in tqdm(loader):
+        if has_nodes:
+            batch = batch[:-2] if len(batch) > 3 else batch[0]
         # Shape: (batch_size, n_nodes, n_vars, window)
         # Sum over batch, nodes, and window dimensions
-        totals_nan += torch.isnan(batch).sum(dim=(0, 1, 3))
-        totals_n += (~torch.isnan(batch)).sum(dim=(0, 1, 3))
-        x = torch.nan_to_num(batch, nan=0.0)
+        if isinstance(batch, (list, tuple)):
+            # return_mask datasets: missing slots are already 0 and come with their valid counts
+            x, valid = batch[0].to(torch.float32), batch[1]
+            if not batch[0].dtype.is_floating_point:
+                x = x / var_scale
+            n_valid = batch[2].sum(dim=0) if len(batch) > 2 else valid.sum(dim=(0, 1, 3))
+            totals_n += n_valid
+            totals_nan += x.shape[0] * x.shape[1] * x.shape[3] - n_valid
+        else:
+            totals_nan += torch.isnan(batch).sum(dim=(0, 1, 3))
+            totals_n += (~torch.isnan(batch)).sum(dim=(0, 1, 3))
+            x = torch.nan_to_num(batch, nan=0.0)
         totals_sum += x.sum(dim=(0, 1, 3))
         totals_ss += (x**2).sum(dim=(0, 1, 3))
 
@@ -152,6 +172,151 @@ def get_var_summy(summary_stats, var_group_name, var_name):
     return mean, std
 
 
+# Map a YYYYMMDD date onto the timestring used in a var group's filenames
+def get_file_date_str(date_str, temporal_res):
+    """Return the file timestring (YYYY, YYYYMM or YYYYMMDD) for a date."""
+    if temporal_res == "yearly":
+        return date_str[:4]
+    elif temporal_res == "monthly":
+        return date_str[:6]
+    return date_str  # daily
+
+
+# All file timestrings of a var group over a year range
+def get_group_timesteps(temporal_res, min_year, max_year):
+    """Ordered, de-duplicated file timestrings of a var group over a year range."""
+    all_dates = pd.date_range(f"{min_year}-01-01", f"{max_year}-12-31", freq="D")
+    timesteps = [get_file_date_str(f"{d.year}{d.month:02d}{d.day:02d}", temporal_res) for d in all_dates]
+    return list(dict.fromkeys(timesteps))
+
+
+# Collapse a window of consecutive YYYYMMDD dates into the distinct files it needs
+def get_timestep_runs(dates, temporal_res):
+    """Return [(file_date_str, start, stop), ...] with dates[start:stop] sharing one file.
+
+    A 30-day window of a yearly group is one or two runs instead of 30 reads.
+    """
+    runs = []
+    for date_idx, date_str in enumerate(dates):
+        file_date_str = get_file_date_str(date_str, temporal_res)
+        if runs and runs[-1][0] == file_date_str:
+            runs[-1][2] = date_idx + 1
+        else:
+            runs.append([file_date_str, date_idx, date_idx + 1])
+    return [tuple(run) for run in runs]
+
+
+# Group the sample indices of a batch into spans of overlapping (or touching) windows
+def get_window_spans(indices, window):
+    """Return [(first, last, positions), ...] for a batch of sample indices.
+
+    Each span covers samples first..last, so their days are dates[first:last + window];
+    positions are the batch positions of the samples in the span, sorted by index.
+    Windows further apart than ``window`` start a new span, so a shuffled batch
+    never assembles the days in between.
+    """
+    order = sorted(range(len(indices)), key=lambda pos: indices[pos])
+    spans = []
+    for pos in order:
+        idx = indices[pos]
+        if spans and idx - spans[-1][1] <= window:
+            spans[-1][1] = idx
+            spans[-1][2].append(pos)
+        else:
+            spans.append([idx, idx, [pos]])
+    return [tuple(span) for span in spans]
+
+
+# Sidecar manifest with the canonical node order of every file in a var group
+NODE_MANIFEST = "_nodes.json"
+
+
+def node_list_hash(nodes):
+    """Stable hash of an ordered node list."""
+    return hashlib.sha1("\n".join(nodes).encode("utf-8")).hexdigest()
+
+
+def write_node_manifest(group_dir, nodes):
+    """Write {group_dir}/_nodes.json atomically (parallel preprocessing jobs write the same file)."""
+    os.makedirs(group_dir, exist_ok=True)
+    path = os.path.join(group_dir, NODE_MANIFEST)
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    with open(tmp_path, "w") as f:
+        json.dump({"nodes": list(nodes), "hash": node_list_hash(nodes)}, f)
+    os.replace(tmp_path, path)
+    return path
+
+
+def load_node_manifest(group_dir):
+    """Return the canonical node list of a var group, or None if it has no manifest.
+
+    Raises ValueError if the node list does not match its recorded hash.
+    """
+    path = os.path.join(group_dir, NODE_MANIFEST)
+    if not os.path.exists(path):
+        return None
+    with open(path, "r") as f:
+        manifest = json.load(f)
+    if node_list_hash(manifest["nodes"]) != manifest["hash"]:
+        raise ValueError(f"Node manifest {path} does not match its hash; re-run preprocessing.")
+    return manifest["nodes"]
+
+
+# Align rows stored in one node order onto a dataset's node list
+def get_node_alignment(source_nodes, nodes):
+    """Return (node_sel, rows) such that ``out[node_sel] = source[rows]``.
+
+    Both are ``slice(None)`` when the lists are identical, so aligned data is a
+    plain copy; otherwise they are index tensors over the nodes present in both.
+    """
+    rows = pd.Index(source_nodes).get_indexer(nodes)
+    if len(rows) == len(source_nodes) and (rows == np.arange(len(rows))).all():
+        return slice(None), slice(None)
+    found = rows != -1
+    return torch.from_numpy(np.flatnonzero(found)), torch.from_numpy(rows[found])
+
+
+def get_block_alignment(node_rows, node_idx):
+    """Return numpy (node_sel, rows) such that ``block[node_sel] = source[rows]``.
+
+    ``node_rows`` holds the source row of every node (-1 if absent), as from
+    ``pd.Index(source_nodes).get_indexer(nodes)``; ``node_idx`` are the positions
+    of a block's nodes in that node list.
+    """
+    rows = node_rows[node_idx]
+    found = rows != -1
+    return np.flatnonzero(found), rows[found]
+
+
+def get_row_group_selection(metadata, rows):
+    """Return (row_groups, local) for reading ``rows`` of a parquet file.
+
+    ``row_groups`` lists the row groups holding ``rows`` (file row numbers);
+    after ``ParquetFile.read_row_groups(row_groups)``, ``local`` is the position
+    of each requested row in the table read.
+    """
+    sizes = np.array([metadata.row_group(i).num_rows for i in range(metadata.num_row_groups)], dtype=np.int64)
+    offsets = np.concatenate([[0], np.cumsum(sizes)])
+    group_of = np.searchsorted(offsets, rows, side="right") - 1
+    row_groups = np.unique(group_of)
+    read_offsets = np.concatenate([[0], np.cumsum(sizes[row_groups])[:-1]])
+    local = rows - offsets[group_of] + read_offsets[np.searchsorted(row_groups, group_of)]
+    return row_groups.tolist(), local
+
+
+# Split a dataset index into its date index and optional node block
+def split_sample_index(index):
+    """Return (idx, node_idx) for ``idx`` or ``(idx, node_idx)`` (see node_blocks.NodeBlockSampler).
+
+    ``node_idx`` is an int64 array of positions in the dataset's node list, or
+    None for every node.
+    """
+    if isinstance(index, tuple):
+        idx, node_idx = index
+        return idx, np.asarray(node_idx, dtype=np.int64)
+    return index, None
+
+
 # Function to get unique IDs from zcta parquet files over a year range
 def get_unique_ids(unique_fpath, min_yr, max_yr):
     total_uniq = []
@@ -1,18 +1,30 @@
-import logging
 import os
 import time
 import json
+from functools import partial
 
 import hydra
 import torch
+import numpy as np
 import pandas as pd
 from omegaconf import DictConfig
-from torch.utils.data import DataLoader, Dataset
+from torch.utils.data import DataLoader, Dataset, RandomSampler
 from tqdm import tqdm
 import pyarrow.parquet as pq
-from legoloaderx.utils import compute_summary, load_summary_stats, get_var_summy, get_unique_ids
+from legoloaderx.utils import compute_summary, load_summary_stats, get_var_summy, get_unique_ids, get_timestep_runs, get_window_spans
+from legoloaderx.utils import get_node_alignment, load_node_manifest, get_group_timesteps
+from legoloaderx.utils import get_block_alignment, get_row_group_selection, split_sample_index
+from legoloaderx.manifest import get_file_manifest
+from legoloaderx.cube_store import CubeStore
+from legoloaderx.cache import LRUCache, SharedColumnCache
+from legoloaderx.dtypes import MASK_MODES, count_valid, decode, encode, get_dtype, get_var_dict_dtype, pack_mask
+from legoloaderx.node_blocks import NodeValidity
+from legoloaderx.prefetch import Prefetcher, PrefetchSampler
+from legoloaderx.profiling import NULL_STATS, StageStats
 
 
+_MISS = object()  # cache sentinel; None is a valid cached value (missing file)
+
 
 class XDataset(Dataset):
     def __init__(
@@ -24,17 +36,36 @@ class XDataset(Dataset):
         transform=None, # not implemented right now
         min_year = 2000,
         max_year = 2020,
-        normalize=False,  # Optional path or dict of summary stats
+        normalize=False,  # True (root_dir/summary_statistics/summary_statistics.json), or a path or dict of summary stats
+        normalize_inplace=True,  # Normalize in the output buffer instead of allocating a new tensor
+        backend="parquet",  # "parquet" (one file per var/timestep), "wide" (one file per group/timestep) or "cube"
+        cache_bytes=0,  # Per-worker LRU budget for decoded columns (parquet/wide backends); 0 disables
+        cache=None,  # A cache.SharedColumnCache shared with other XDatasets over the same nodes, in place of cache_bytes
+        prefetch_threads=0,  # Threads reading files in parallel (parquet/wide backends); 0 disables
+        prefetch_ahead=0,  # Upcoming samples whose files are read speculatively
+        file_manifest=None,  # None (scan once), path of a JSON cache, or a shared FileManifest
+        shared_memory=False,  # Load every group once into torch shared memory that DataLoader workers attach to
+        dtype=None,  # Output dtype; None uses the dtype every var group declares (float32 if they differ)
+        return_mask=False,  # True: (tensor, valid bools); "packed": (tensor, packed valid, per-var valid counts)
+        node_years=None,  # {year: [nodes]} (node_lst_dict of get_unique_ids): outputs end with (node_mask, node_index)
+        compact_nodes=False,  # Only read and return the nodes valid in some year of the sample (or batch)
+        stats=None,  # profiling.StageStats recording per-stage time and I/O across workers; None records nothing
     ):
+        assert backend in ("parquet", "wide", "cube"), f"Unknown backend '{backend}'."
         self.root_dir = root_dir
+        self.backend = backend
         self.transform = transform
         self.var_dict = var_dict
         self.window = window
+        self.stats = stats if stats is not None else NULL_STATS
     
         if not normalize:
             self.summary_stats = None
-        else:
+        elif normalize is True:
             self.summary_stats = load_summary_stats(os.path.join(self.root_dir, "summary_statistics/summary_statistics.json"))
+        else:
+            self.summary_stats = load_summary_stats(normalize)
+        self.normalize_inplace = normalize_inplace
 
         # Pull the vars for each var_group in var_dict
         self.vars = [f"{var_group_name}_{var}" for var_group_name, var_group in var_dict.items() for var in var_group["vars"]]
@@ -43,7 +74,42 @@ class XDataset(Dataset):
         # Handle nodes (zctas)
         self.nodes = nodes
         self.node_to_idx = {node: i for i, node in enumerate(self.nodes)}
+
+        # Output dtype, and per group the (dtype, scale) its cached columns are held in (see dtypes.py)
+        self.dtype = get_dtype(dtype) if dtype is not None else get_var_dict_dtype(var_dict)
+        assert return_mask in MASK_MODES, f"Unknown return_mask '{return_mask}'."
+        self.return_mask = return_mask
+        if not self.dtype.is_floating_point and not return_mask:
+            raise ValueError(f"Integer output dtype {self.dtype} cannot hold NaN, pass return_mask=True.")
+        if not self.dtype.is_floating_point and self.summary_stats is not None:
+            raise ValueError(f"Normalized outputs need a float dtype, not {self.dtype}.")
+        self.storage = {
+            var_group_name: (get_dtype(var_group.get("dtype", "float32")), var_group.get("scale", 1))
+            for var_group_name, var_group in var_dict.items()
+        }
+        self.out_scale = torch.tensor(
+            [var_group.get("scale", 1) for var_group in var_dict.values() for _ in var_group["vars"]],
+            dtype=torch.float32,
+        ).unsqueeze(-1)
+
+        # Summary stats compiled into (vars, 1) tensors: normalization is one fused
+        # x * inv_std - mean * inv_std over the assembled tensor; NaN stays NaN
+        self.norm_scale, self.norm_shift = None, None
+        if self.summary_stats is not None:
+            stats = [get_var_summy(self.summary_stats, var_group_name, var)
+                     for var_group_name, var_group in var_dict.items() for var in var_group["vars"]]
+            mean = torch.tensor([m for m, _ in stats], dtype=torch.float32)
+            inv_std = 1.0 / torch.tensor([s for _, s in stats], dtype=torch.float32)
+            self.norm_scale = inv_std.unsqueeze(-1)
+            self.norm_shift = (-mean * inv_std).unsqueeze(-1)
         
+        # Nodes present in each year: with compact_nodes, plain indices become node blocks of the
+        # nodes valid in some sample of the batch, so never-present nodes are neither read nor returned
+        self.node_validity = NodeValidity(self.nodes, node_years, min_year, max_year) if node_years is not None else None
+        if compact_nodes and self.node_validity is None:
+            raise ValueError("compact_nodes needs node_years.")
+        self.compact_nodes = compact_nodes
+
         all_dates = pd.date_range(f"{min_year}-01-01", f"{max_year}-12-31", freq="D")
         self.yyyymmdd = [f"{d.year}{d.month:02d}{d.day:02d}"  for d in all_dates]
         
@@ -53,69 +119,509 @@ class XDataset(Dataset):
         # For node assignment after reading parquet
         self.row_to_zcta_assignments = {}
 
+        # Which files exist, listed once per directory instead of os.path.exists per (var, day),
+        # with one aggregated coverage report in place of a warning per missing file
+        self.files = None
+        if backend != "cube":
+            expected = {}
+            for var_group_name, var_group in var_dict.items():
+                timesteps = get_group_timesteps(var_group["temporal_res"], min_year, max_year)
+                if backend == "wide":
+                    expected[var_group_name] = [f"{var_group_name}__{t}.parquet" for t in timesteps]
+                else:
+                    for var in var_group["vars"]:
+                        expected[f"{var_group_name}/{var}"] = [f"{var}__{t}.parquet" for t in timesteps]
+            self.files = get_file_manifest(root_dir, list(expected), file_manifest)
+            self.files.report(expected)
+
+        # Decoded (nodes,) columns keyed by (var_group, var, file_date_str); raw values, as
+        # normalization runs once over the assembled tensor.
+        # Overlapping windows share window-1 days, so sequential access mostly hits.
+        self.cache = LRUCache(cache_bytes) if cache_bytes and backend != "cube" and not shared_memory else None
+        if cache is not None and backend != "cube" and not shared_memory:
+            # raw values are independent of normalization, so datasets differing only in it can share
+            # entries; with max_bytes=0 it keeps no columns but still shares the zcta assignments and
+            # reads in flight
+            cache.register(self.nodes, self.storage)
+            self.row_to_zcta_assignments = cache.zcta_assignments
+            self.cache = cache
+
+        # Opt-in parallel reads of a sample's files plus speculative reads of the next samples
+        self.prefetcher = Prefetcher(prefetch_threads) if prefetch_threads and backend != "cube" and not shared_memory else None
+        self.prefetch_ahead = prefetch_ahead
+        self.prefetch_order = None
+        self.prefetch_position = {}
+
+        # Vars of a group are contiguous in self.vars
+        self.var_slices = {}
+        for var_group_name, var_group in var_dict.items():
+            start = self.var_to_idx[f"{var_group_name}_{var_group['vars'][0]}"]
+            self.var_slices[var_group_name] = slice(start, start + len(var_group["vars"]))
+
+        # For the cube backend: open each group's memmap and align it to self.nodes once
+        self.cubes = {}
+        # Source row of every node (-1 if absent), to align node blocks (see node_blocks.py)
+        self.node_rows = {}
+        if backend == "cube":
+            for var_group_name, var_group in var_dict.items():
+                cube = CubeStore(root_dir, var_group_name)
+                missing = [var for var in var_group["vars"] if var not in cube.var_to_idx]
+                if missing:
+                    raise ValueError(f"Vars {missing} are not in the '{var_group_name}' cube.")
+                cols = [cube.var_to_idx[var] for var in var_group["vars"]]
+                node_sel, rows = get_node_alignment(cube.nodes, self.nodes)
+                self.cubes[var_group_name] = (cube, rows, cols, node_sel)
+                self.node_rows[var_group_name] = cube.node_rows(self.nodes)
+
+        # Canonical node order written by preprocessing (_nodes.json per group): the hash is
+        # verified once here, then files are sliced into place without reading their zcta column.
+        # Groups without a manifest fall back to joining on the zcta column of the first file read.
+        self.node_alignment = {}
+        if backend != "cube":
+            for var_group_name in var_dict:
+                file_nodes = load_node_manifest(os.path.join(root_dir, var_group_name))
+                if file_nodes is not None:
+                    node_sel, rows = get_node_alignment(file_nodes, self.nodes)
+                    self.node_alignment[var_group_name] = (len(file_nodes), node_sel, rows)
+                    self.node_rows[var_group_name] = pd.Index(file_nodes).get_indexer(self.nodes)
+
+        # Opt-in: each group consolidated once, here in the parent process, into a cube in torch
+        # shared memory (a copy of the disk cube, or every file of the group read into memory).
+        # Workers receive a handle to that memory instead of decoding and caching their own copy.
+        self.shared_memory = shared_memory
+        if shared_memory:
+            for var_group_name, var_group in var_dict.items():
+                if backend == "cube":
+                    self.cubes[var_group_name][0].share_memory()
+                else:
+                    cube = self.__load_group(var_group_name, var_group, min_year, max_year)
+                    self.cubes[var_group_name] = (cube, slice(None), list(range(len(cube.vars))), slice(None))
+                    self.node_rows[var_group_name] = np.arange(len(self.nodes))
+
     def __len__(self):
         return len(self.lead_dates)
 
     def __getitem__(self, idx):
+        # idx, or (idx, node_idx) for a block of nodes (see node_blocks.NodeBlockSampler)
+        if self.compact_nodes and not isinstance(idx, tuple):
+            idx = self.compact_index([idx])[0]
+        node_mask = self.node_mask(idx)
+        idx, node_idx = split_sample_index(idx)
+
         # Get the date range for the window
         # end_dates[idx] corresponds to yyyymmdd[idx + window - 1]
         dates = self.yyyymmdd[idx:idx + self.window]  # Get the last 'window' dates
-        
-        # Initialize tensor for this variable across the window
-        tensor = torch.full((len(self.nodes), len(self.vars), self.window), fill_value=torch.nan, dtype=torch.float32)
 
-        for var_group_name, var_group in self.var_dict.items():
-            temporal_res = var_group["temporal_res"]
-            
-            for var in var_group["vars"]:
-                # Get the index for the variable
-                var_index = self.var_to_idx[f"{var_group_name}_{var}"]
-
-                for date_idx, date_str in enumerate(dates):
-                    # Adjust date string based on temporal resolution
-                    if temporal_res == "yearly":
-                        file_date_str = date_str[:4]
-                    elif temporal_res == "monthly":
-                        file_date_str = date_str[:6]
-                    else:  # daily
-                        file_date_str = date_str
-                    
-                    filename = f"{self.root_dir}/{var_group_name}/{var}/{var}__{file_date_str}.parquet"
-            
-                    # # Read the parquet file
-                    if var_group_name not in self.row_to_zcta_assignments:
-                        if not os.path.exists(filename):
-                            logging.warning(f"File {filename} does not exist. Filling with NaNs.")
-                            continue
-
-                        table = pq.read_table(filename, columns=["zcta"]).to_pandas()
-                        table["zcta_index"] = table["zcta"].apply(lambda z: self.node_to_idx.get(z, -1))
-                        # Filter out rows where zcta is not in node_to_idx
-                        row_filter = (table["zcta_index"] != -1).values
-                        zcta_index = torch.tensor(table["zcta_index"][row_filter].values, dtype=torch.long)
-                        self.row_to_zcta_assignments[var_group_name] = (zcta_index, row_filter)
-                    else:
-                        zcta_index, row_filter = self.row_to_zcta_assignments[var_group_name]
-
-                    if os.path.exists(filename):
-                        table = pq.read_table(filename, columns=[var]).to_pandas()
-                    else:
-                        logging.warning(f"File {filename} does not exist. Filling with NaNs.")
-                        table = pd.DataFrame(columns=[var])
-                        
-                    if not table.empty:
-                        values = torch.tensor(table[var][row_filter].values, dtype=torch.float32)
-                        # apply normalization if stats available
-                        mean, std = get_var_summy(self.summary_stats, var_group_name, var)
-                        mask = ~torch.isnan(values)
-                        values[mask] = (values[mask] - mean) / std
-                        tensor[zcta_index, var_index, date_idx] = values
+        if self.prefetcher is not None:
+            self.__prefetch(dates)
+            for next_idx in self.__upcoming([idx]):
+                self.__prefetch(self.yyyymmdd[next_idx:next_idx + self.window])
+
+        tensor = self.__assemble(dates, node_idx)
 
         if self.transform:
             tensor = self.transform(tensor)
 
+        return self.__with_nodes(self.to_output(tensor), node_mask, self.__node_index(node_idx))
+
+    def __getitems__(self, indices):
+        # Called by DataLoader with the whole batch of indices; the default collate stacks the views
+        batch = self.get_batch(indices)
+        if isinstance(batch, tuple):
+            return list(zip(*(tensor.unbind(0) for tensor in batch)))
+        return list(batch.unbind(0))
+
+    def get_batch(self, indices):
+        """Build a (batch, nodes, vars, window) tensor for a list of sample indices.
+
+        Samples whose windows overlap are assembled from one span of days, so each
+        file in the span is read once and the windows are unfolded out of it.
+        Indices may be (idx, node_idx) pairs; samples of the same node block are
+        assembled together, and every block of a batch must have the same size.
+        With return_mask, returns (batch, valid) or, packed, (batch, packed valid, valid counts).
+        With node_years, (batch, node_mask) and (batch, nodes) node positions follow (see __getitem__).
+        With compact_nodes, plain indices keep the nodes of compact_index(indices).
+        """
+        if self.compact_nodes and not any(isinstance(index, tuple) for index in indices):
+            indices = self.compact_index(indices)
+        samples = [split_sample_index(index) for index in indices]
+        blocks = {}  # node block -> (node_idx, positions in the batch)
+        for pos, (_, node_idx) in enumerate(samples):
+            key = None if node_idx is None else node_idx.tobytes()
+            blocks.setdefault(key, (node_idx, []))[1].append(pos)
+        n_nodes = {len(self.nodes) if node_idx is None else len(node_idx) for node_idx, _ in blocks.values()}
+        if len(n_nodes) > 1:
+            raise ValueError(f"Node blocks of one batch differ in size: {sorted(n_nodes)}.")
+
+        batch = torch.empty((len(indices), n_nodes.pop(), len(self.vars), self.window), dtype=self.dtype)
+        valid = torch.empty(batch.shape, dtype=torch.bool) if self.return_mask else None
+        date_indices = [idx for idx, _ in samples]
+
+        if self.prefetcher is not None:
+            for first, last, _ in get_window_spans(date_indices, self.window):
+                self.__prefetch(self.yyyymmdd[first:last + self.window])
+            for next_idx in self.__upcoming(date_indices):
+                self.__prefetch(self.yyyymmdd[next_idx:next_idx + self.window])
+
+        for node_idx, block_positions in blocks.values():
+            block_indices = [date_indices[pos] for pos in block_positions]
+            for first, last, positions in get_window_spans(block_indices, self.window):
+                span = self.__assemble(self.yyyymmdd[first:last + self.window], node_idx)
+                # (nodes, vars, span) -> (nodes, vars, n_windows, window)
+                windows = span.unfold(2, self.window, 1)
+                offsets = torch.tensor([block_indices[pos] - first for pos in positions])
+                windows = windows[:, :, offsets].permute(2, 0, 1, 3)
+                if self.transform:
+                    windows = torch.stack([self.transform(tensor) for tensor in windows])
+
+                batch_positions = [block_positions[pos] for pos in positions]
+                values, window_valid = self.__cast(windows)
+                batch[batch_positions] = values
+                if valid is not None:
+                    valid[batch_positions] = window_valid
+
+        if valid is None:
+            output = batch
+        elif self.return_mask == "packed":
+            output = batch, pack_mask(valid), count_valid(valid, batched=True)
+        else:
+            output = batch, valid
+        if self.node_validity is None:
+            return output
+        node_masks = torch.stack([self.node_mask(index) for index in indices])
+        node_index = torch.stack([self.__node_index(node_idx) for _, node_idx in samples])
+        return self.__with_nodes(output, node_masks, node_index)
+
+    def __node_index(self, node_idx):
+        # positions in self.nodes of the returned nodes
+        return torch.arange(len(self.nodes)) if node_idx is None else torch.as_tensor(node_idx, dtype=torch.long)
+
+    def __with_nodes(self, output, node_mask, node_index):
+        """With node_years, output followed by the node mask and node positions of the returned nodes."""
+        if self.node_validity is None:
+            return output
+        return (output if isinstance(output, tuple) else (output,)) + (node_mask, node_index)
+
+    def to_output(self, tensor):
+        """Cast an assembled float32 tensor to the output dtype (see return_mask for the layout)."""
+        tensor, valid = self.__cast(tensor)
+        if not self.return_mask:
+            return tensor
+        if self.return_mask == "packed":
+            return tensor, pack_mask(valid), count_valid(valid)
+        return tensor, valid
+
+    def __cast(self, tensor):
+        """(values in the output dtype, valid bools or None); with a mask, missing slots are 0."""
+        if self.dtype.is_floating_point:
+            if not self.return_mask:
+                return tensor.to(self.dtype), None
+            valid = ~torch.isnan(tensor)
+            return tensor.masked_fill(~valid, 0).to(self.dtype), valid
+        return encode(tensor, self.dtype, self.out_scale)
+
+    def node_mask(self, idx):
+        """(nodes,) bool of the nodes valid in some year of sample idx (or (idx, node_idx)); None without node_years."""
+        if self.node_validity is None:
+            return None
+        idx, node_idx = split_sample_index(idx)
+        return self.node_validity.mask(self.yyyymmdd[idx:idx + self.window], node_idx)
+
+    def compact_index(self, indices):
+        """Plain indices as (idx, node_idx) pairs over the nodes valid in any of the samples."""
+        node_idx = self.node_validity.compact([self.node_mask(idx) for idx in indices])
+        return [(idx, node_idx) for idx in indices]
+
+    def read_days(self, dates, node_idx=None):
+        """(nodes, vars, len(dates)) tensor for consecutive dates, each file read once.
+
+        The building block of get_batch, public for sequential readers (see x_stream_dataloader).
+        """
+        if self.prefetcher is not None:
+            self.__prefetch(dates)
+        return self.__assemble(dates, node_idx)
+
+    def __assemble(self, dates, node_idx=None):
+        """(nodes, vars, len(dates)) tensor for consecutive dates, NaN where data is missing.
+
+        With ``node_idx`` only that block of nodes is read and returned.
+        """
+        n_nodes = len(self.nodes) if node_idx is None else len(node_idx)
+        tensor = torch.full((n_nodes, len(self.vars), len(dates)), fill_value=torch.nan, dtype=torch.float32)
+
+        if self.cubes:
+            self.__fill_from_cubes(tensor, dates, node_idx)
+        else:
+            self.__fill_from_parquet(tensor, dates, node_idx)
+
+        if self.norm_scale is not None:
+            with self.stats.time("normalize"):
+                if self.normalize_inplace:
+                    torch.addcmul(self.norm_shift, tensor, self.norm_scale, out=tensor)
+                else:
+                    tensor = torch.addcmul(self.norm_shift, tensor, self.norm_scale)
+
         return tensor
 
+    def __fill_from_cubes(self, tensor, dates, node_idx=None):
+        for var_group_name, var_group in self.var_dict.items():
+            cube, rows, cols, node_sel = self.cubes[var_group_name]
+            var_slice = self.var_slices[var_group_name]
+
+            # One cube row per distinct timestep: (runs, cube_nodes, cube_vars) -> (nodes, vars, runs)
+            runs = get_timestep_runs(dates, var_group["temporal_res"])
+            time_idx = cube.timestep_indices([t for t, _, _ in runs])
+            with self.stats.time("decode"):
+                if node_idx is None:
+                    block = cube.read_window(time_idx)
+                    values = torch.from_numpy(block[:, :, cols])[:, rows].permute(1, 2, 0)
+                else:
+                    # only the block's rows of the memmap are touched
+                    node_sel, rows = get_block_alignment(self.node_rows[var_group_name], node_idx)
+                    node_sel = torch.from_numpy(node_sel)
+                    block = cube.read_window(time_idx, rows)
+                    values = torch.from_numpy(block[:, :, cols]).permute(1, 2, 0)
+            self.stats.add("bytes_read", block.nbytes)
+            with self.stats.time("scatter"):
+                if len(runs) == len(dates):
+                    tensor[node_sel, var_slice, :] = values
+                else:
+                    for run_idx, (_, start, stop) in enumerate(runs):
+                        tensor[node_sel, var_slice, start:stop] = values[..., run_idx:run_idx + 1].expand(-1, -1, stop - start)
+
+    def __fill_from_parquet(self, tensor, dates, node_idx=None):
+        for var_group_name, var_group in self.var_dict.items():
+            var_slice = self.var_slices[var_group_name]
+
+            # Each distinct file (one per day, month or year) is read once per window
+            for file_date_str, start, stop in get_timestep_runs(dates, var_group["temporal_res"]):
+                if node_idx is not None and self.cache is None and self.prefetcher is None:
+                    # read only the block's rows
+                    columns = self.__read_columns(var_group_name, var_group["vars"], file_date_str, node_idx)
+                else:
+                    # full columns are cached and prefetched, then shared by every block
+                    columns = self.__get_columns(var_group_name, var_group["vars"], file_date_str)
+                    if node_idx is not None:
+                        columns = [None if column is None else column[node_idx] for column in columns]
+
+                with self.stats.time("scatter"):
+                    for var_index, column in enumerate(columns, start=var_slice.start):
+                        if column is not None:
+                            # the file is read once; its column is copied into each day it covers
+                            tensor[:, var_index, start:stop] = column.unsqueeze(-1).expand(-1, stop - start)
+
+    def __get_columns(self, var_group_name, vars, file_date_str):
+        """Decoded (nodes,) vectors for vars at one timestep, from the cache, a prefetched read, or disk."""
+        if self.cache is None and self.prefetcher is None:
+            return self.__read_columns(var_group_name, vars, file_date_str)
+
+        if self.cache is not None:
+            columns = [
+                self.__unpack_column(var_group_name, self.cache.get((var_group_name, var, file_date_str), _MISS))
+                for var in vars
+            ]
+        else:
+            columns = [_MISS] * len(vars)
+        missing = [var for var, column in zip(vars, columns) if column is _MISS]
+        if self.cache is not None:
+            self.stats.add("cache_hits", len(vars) - len(missing))
+            self.stats.add("cache_misses", len(missing))
+        if not missing:
+            return columns
+
+        # a shared cache may have another stream reading some of these files: wait for it instead
+        waiting = {}
+        if isinstance(self.cache, SharedColumnCache):
+            for var in missing:
+                future, owner = self.cache.reserve((var_group_name, var, file_date_str))
+                if not owner:
+                    waiting[var] = future
+            missing = [var for var in missing if var not in waiting]
+
+        read = {}
+        try:
+            if self.prefetcher is not None:
+                read = self.prefetcher.take((var_group_name, file_date_str)) or {}
+            not_prefetched = [var for var in missing if var not in read]
+            if not_prefetched:
+                read.update(zip(not_prefetched, self.__read_columns(var_group_name, not_prefetched, file_date_str)))
+        except BaseException as e:
+            if isinstance(self.cache, SharedColumnCache):
+                for var in missing:
+                    self.cache.release((var_group_name, var, file_date_str), e)
+            raise
+
+        if self.cache is not None:
+            for var in missing:
+                self.cache.put((var_group_name, var, file_date_str), self.__pack_column(var_group_name, read[var]))
+        for var, future in waiting.items():
+            read[var] = self.__unpack_column(var_group_name, future.result())
+        return [read[var] if column is _MISS else column for var, column in zip(vars, columns)]
+
+    def __pack_column(self, var_group_name, column):
+        """Cache entry for a decoded column in its group's storage dtype."""
+        if column is None:
+            return None
+        dtype, scale = self.storage[var_group_name]
+        encoded, valid = encode(column, dtype, scale)
+        return encoded if valid is None else (encoded, valid)
+
+    def __unpack_column(self, var_group_name, entry):
+        if entry is None or entry is _MISS:
+            return entry
+        if isinstance(entry, tuple):
+            return decode(*entry, scale=self.storage[var_group_name][1])
+        return decode(entry)
+
+    def __prefetch(self, dates):
+        """Submit reads of every (var_group, timestep) block of dates not already cached or in flight."""
+        for var_group_name, var_group in self.var_dict.items():
+            for file_date_str, _, _ in get_timestep_runs(dates, var_group["temporal_res"]):
+                if (var_group_name, file_date_str) in self.prefetcher:
+                    continue
+                vars = [
+                    var for var in var_group["vars"]
+                    if self.cache is None or (var_group_name, var, file_date_str) not in self.cache
+                ]
+                if vars:
+                    self.prefetcher.submit(
+                        (var_group_name, file_date_str),
+                        partial(self.__read_block, var_group_name, vars, file_date_str),
+                        nbytes=4 * len(self.nodes) * len(vars),
+                    )
+
+    def __load_group(self, var_group_name, var_group, min_year, max_year):
+        """Read every file of a var group once into a (timesteps, nodes, vars) cube in shared memory."""
+        timesteps = get_group_timesteps(var_group["temporal_res"], min_year, max_year)
+        data = torch.empty((len(timesteps), len(self.nodes), len(var_group["vars"])), dtype=torch.float32)
+        data = data.share_memory_().fill_(torch.nan)
+        for t, file_date_str in enumerate(timesteps):
+            for v, column in enumerate(self.__read_columns(var_group_name, var_group["vars"], file_date_str)):
+                if column is not None:
+                    data[t, :, v] = column
+        return CubeStore.from_array(var_group_name, var_group["temporal_res"], var_group["vars"], timesteps, self.nodes, data)
+
+    def __read_block(self, var_group_name, vars, file_date_str):
+        return dict(zip(vars, self.__read_columns(var_group_name, vars, file_date_str)))
+
+    def __upcoming(self, indices):
+        """Indices the sampler will most likely ask for after ``indices``."""
+        if self.prefetch_order is not None and indices[-1] in self.prefetch_position:
+            pos = self.prefetch_position[indices[-1]] + 1
+            return self.prefetch_order[pos:pos + self.prefetch_ahead]
+        last = max(indices)
+        return list(range(last + 1, min(last + 1 + self.prefetch_ahead, len(self))))
+
+    def set_prefetch_order(self, indices):
+        """Tell the prefetcher the order samples will be requested in (see prefetch.PrefetchSampler)."""
+        self.prefetch_order = [split_sample_index(index)[0] for index in indices]
+        self.prefetch_position = {idx: pos for pos, idx in enumerate(self.prefetch_order)}
+
+    def prefetch_info(self):
+        """Stall time and bytes in flight of this worker's prefetcher (None when disabled)."""
+        return None if self.prefetcher is None else self.prefetcher.info()
+
+    def __read_columns(self, var_group_name, vars, file_date_str, node_idx=None):
+        """Read vars at one timestep into decoded (nodes,) vectors; None for missing files.
+
+        The long layout has one file per var; the wide layout holds every var of the
+        group in {var_group}/{var_group}__{timestr}.parquet and is read in one call.
+        Values go through the group's storage dtype, so a column read from disk is the
+        same as the column later served from the cache, with or without a cache.
+        """
+        if self.backend == "parquet":
+            columns = [self.__read_column(var_group_name, var, file_date_str, node_idx) for var in vars]
+        elif not self.files.exists(var_group_name, f"{var_group_name}__{file_date_str}.parquet"):
+            return [None] * len(vars)  # reported once at init
+        else:
+            filename = f"{self.root_dir}/{var_group_name}/{var_group_name}__{file_date_str}.parquet"
+            columns = self.__read_file(var_group_name, filename, vars, node_idx)
+
+        if self.storage[var_group_name][0] == torch.float32:
+            return columns
+        return [self.__unpack_column(var_group_name, self.__pack_column(var_group_name, column)) for column in columns]
+
+    def __read_column(self, var_group_name, var, file_date_str, node_idx=None):
+        """Read one file into a decoded (nodes,) vector; None if the file is missing."""
+        if not self.files.exists(f"{var_group_name}/{var}", f"{var}__{file_date_str}.parquet"):
+            return None  # reported once at init
+        filename = f"{self.root_dir}/{var_group_name}/{var}/{var}__{file_date_str}.parquet"
+
+        return self.__read_file(var_group_name, filename, [var], node_idx)[0]
+
+    def __read_file(self, var_group_name, filename, vars, node_idx=None):
+        """Read vars from one existing file into decoded (nodes,) vectors, or (block,) with node_idx."""
+        with self.stats.time("open"):
+            parquet_file = pq.ParquetFile(filename)
+
+        if var_group_name not in self.node_alignment:
+            # rows are matched on the zcta column, so the whole file is read
+            with self.stats.time("decode"):
+                table = parquet_file.read(columns=list(vars))
+            self.stats.record_read(parquet_file.metadata, vars)
+            node_sel, rows = self.__get_zcta_assignment(var_group_name, filename)
+            columns = self.__to_columns(table, vars, node_sel, rows, len(self.nodes))
+            return columns if node_idx is None else [column[node_idx] for column in columns]
+
+        n_rows, node_sel, rows = self.node_alignment[var_group_name]
+        if parquet_file.metadata.num_rows != n_rows:
+            raise ValueError(
+                f"{filename} has {parquet_file.metadata.num_rows} rows but the '{var_group_name}' node manifest lists {n_rows}."
+            )
+
+        if node_idx is None:
+            with self.stats.time("decode"):
+                table = parquet_file.read(columns=list(vars))
+            self.stats.record_read(parquet_file.metadata, vars)
+            n_nodes = len(self.nodes)
+        else:
+            # node-sorted file: read only the row groups holding the block's rows
+            node_sel, file_rows = get_block_alignment(self.node_rows[var_group_name], node_idx)
+            row_groups, rows = get_row_group_selection(parquet_file.metadata, file_rows)
+            if not row_groups:
+                return [torch.full((len(node_idx),), fill_value=torch.nan, dtype=torch.float32) for _ in vars]
+            with self.stats.time("decode"):
+                table = parquet_file.read_row_groups(row_groups, columns=list(vars))
+            self.stats.record_read(parquet_file.metadata, vars, row_groups)
+            node_sel, rows = torch.from_numpy(node_sel), torch.from_numpy(rows)
+            n_nodes = len(node_idx)
+
+        return self.__to_columns(table, vars, node_sel, rows, n_nodes)
+
+    def __get_zcta_assignment(self, var_group_name, filename):
+        if var_group_name not in self.row_to_zcta_assignments:
+            if isinstance(self.cache, SharedColumnCache):
+                # computed once for every dataset sharing the cache, also across stream threads
+                return self.cache.zcta_assignment(var_group_name, partial(self.__load_zcta_assignment, filename))
+            self.row_to_zcta_assignments[var_group_name] = self.__load_zcta_assignment(filename)
+        return self.row_to_zcta_assignments[var_group_name]
+
+    def __load_zcta_assignment(self, filename):
+        # # Read the parquet file
+        with self.stats.time("zcta_map"):
+            table = pq.read_table(filename, columns=["zcta"]).to_pandas()
+            table["zcta_index"] = table["zcta"].apply(lambda z: self.node_to_idx.get(z, -1))
+            # Filter out rows where zcta is not in node_to_idx
+            row_filter = (table["zcta_index"] != -1).values
+            zcta_index = torch.tensor(table["zcta_index"][row_filter].values, dtype=torch.long)
+        return zcta_index, torch.tensor(row_filter)
+
+    def __to_columns(self, table, vars, node_sel, rows, n_nodes):
+        with self.stats.time("convert"):
+            values = [table.column(var).to_numpy(zero_copy_only=False) for var in vars]
+        with self.stats.time("scatter"):
+            return [self.__to_column(var_values, node_sel, rows, n_nodes) for var_values in values]
+
+    def __to_column(self, values, node_sel, rows, n_nodes):
+        column = torch.full((n_nodes,), fill_value=torch.nan, dtype=torch.float32)
+        if len(values):
+            column[node_sel] = torch.tensor(values, dtype=torch.float32)[rows]
+        return column
+
+    def cache_info(self):
+        """Hit/miss counters of this worker's column cache (None when disabled)."""
+        return None if self.cache is None else self.cache.info()
+
 
 @hydra.main(config_path="../conf/dataloader", config_name="config", version_base=None)
 def main(cfg: DictConfig):
@@ -136,7 +642,9 @@ def main(cfg: DictConfig):
 
     root_dir = cfg.data_dir
     zcta_dir = f"{cfg.data_dir}/lego/geoboundaries/us_geoboundaries__census/us_uniqueid__census/zcta_yearly"
-    unique_zctas, _ = get_unique_ids(zcta_dir, cfg.min_year, cfg.max_year)
+    unique_zctas, node_years = get_unique_ids(zcta_dir, cfg.min_year, cfg.max_year)
+
+    stats = StageStats() if getattr(cfg, "stats_path", None) else None
 
     # initialize dataset
     dataset = XDataset(
@@ -147,20 +655,28 @@ def main(cfg: DictConfig):
         normalize = cfg.normalize if hasattr(cfg, 'normalize') else False,
         window=cfg.window if hasattr(cfg, 'window') else 7,  # Default window if not specified
         min_year = cfg.min_year, 
-        max_year = cfg.max_year
+        max_year = cfg.max_year,
+        prefetch_threads=cfg.prefetch_threads if hasattr(cfg, 'prefetch_threads') else 0,
+        prefetch_ahead=cfg.prefetch_ahead if hasattr(cfg, 'prefetch_ahead') else 0,
+        backend=cfg.backend if hasattr(cfg, 'backend') else "parquet",
+        shared_memory=cfg.shared_memory if hasattr(cfg, 'shared_memory') else False,
+        node_years=node_years,
+        stats=stats,
     )
 
     # adapt to dataloader
     dataloader = DataLoader(
         dataset,
         batch_size=1,
-        shuffle=True,
+        sampler=PrefetchSampler(RandomSampler(dataset), dataset),  # shuffled, order visible to the prefetcher
         num_workers=0,
         # pin_memory=True,
         # persistent_workers=True,
     )
 
     compute_summary(dataloader, output_dir=f"{cfg.data_dir}/{cfg.summary_stats_dir}")
+    if stats is not None:
+        stats.dump(cfg.stats_path)
 
 
 if __name__ == "__main__":
@@ -0,0 +1,95 @@
+"""Sequential streaming counterpart of XDataset.
+
+Consumers that walk every lead date in order (summary statistics, full-period
+inference, exporting predictions) pay ``window`` reads per day with random
+access. ``XStreamDataset`` instead reads the days in order, ``chunk_days`` at
+a time (so each daily file is read once and yearly/monthly files once per
+chunk), keeps the last ``window`` days in a ring buffer and yields each window
+as a view of it.
+
+The ring has a period of ``window + batch_size - 1`` days and holds every day
+twice, at ``t % period`` and ``t % period + period``, so any ``window``
+consecutive days are one contiguous slice of it. A yielded window stays valid
+while the next ``batch_size - 1`` windows are produced, which is what a
+DataLoader with the same ``batch_size`` needs to collect and stack a batch;
+anything that keeps windows longer must clone them or pass ``copy=True``.
+
+Under a DataLoader with workers, each worker streams a contiguous range of
+lead dates and re-reads the ``window - 1`` days before its range to fill its
+ring, so consecutive shards overlap by one window.
+"""
+
+import math
+
+import torch
+from torch.utils.data import IterableDataset, get_worker_info
+
+
+class XStreamDataset(IterableDataset):
+    def __init__(
+        self,
+        dataset,  # XDataset to stream; its window, nodes, normalization and transform are used
+        batch_size=1,  # Batch size of the DataLoader; yielded views stay valid for this many windows
+        chunk_days=32,  # Days read per call to dataset.read_days
+        return_index=False,  # Yield (idx, window) with idx the XDataset index of the window
+        copy=False,  # Yield a copy of each window instead of a view of the ring buffer
+    ):
+        self.dataset = dataset
+        self.window = dataset.window
+        self.period = dataset.window + max(1, int(batch_size)) - 1
+        self.chunk_days = max(1, int(chunk_days))
+        self.return_index = return_index
+        self.copy = copy
+
+        # For code written against XDataset (e.g. utils.compute_summary)
+        self.var_dict = dataset.var_dict
+        self.vars = dataset.vars
+        self.nodes = dataset.nodes
+
+    def __len__(self):
+        return len(self.dataset)
+
+    def shard(self):
+        """Lead index range [start, stop) streamed by this process."""
+        n = len(self.dataset)
+        info = get_worker_info()
+        if info is None:
+            return 0, n
+        per_worker = math.ceil(n / info.num_workers)
+        start = min(info.id * per_worker, n)
+        return start, min(start + per_worker, n)
+
+    def __iter__(self):
+        start, stop = self.shard()
+        if start >= stop:
+            return
+
+        dataset, window, period = self.dataset, self.window, self.period
+        ring = torch.empty((2 * period, len(dataset.nodes), len(dataset.vars)), dtype=torch.float32)
+
+        # Lead index idx covers days idx .. idx + window - 1
+        first_day, end_day = start, stop + window - 1
+        n_read = 0
+        for chunk_start in range(first_day, end_day, self.chunk_days):
+            chunk = dataset.read_days(dataset.yyyymmdd[chunk_start:min(chunk_start + self.chunk_days, end_day)])
+
+            for day in chunk.permute(2, 0, 1):  # (nodes, vars) per day
+                slot = n_read % period
+                ring[slot] = day
+                ring[slot + period] = day
+                n_read += 1
+                if n_read < window:
+                    continue
+
+                head = (n_read - window) % period  # slot of the oldest day of the window
+                tensor = ring[head:head + window].permute(1, 2, 0)  # (nodes, vars, window) view
+                if self.copy:
+                    tensor = tensor.clone()
+                if dataset.transform:
+                    tensor = dataset.transform(tensor)
+                tensor = dataset.to_output(tensor)  # still a view for float32 without a mask
+
+                if self.return_index:
+                    yield start + n_read - window, tensor
+                else:
+                    yield tensor
@@ -10,6 +10,17 @@ import math
 configfile: "conf/snakemake.yaml"
 min_year = config["min_year"]
 max_year = config["max_year"]
+layout = config.get("layout", "long")
+
+wildcard_constraints:
+    var_group="[^/]+",
+    var="[^/]+"
+
+def output_pattern(timefmt):
+    # long: one file per var and timestep; wide: one file per var group and timestep
+    if layout == "wide":
+        return "data/output/{var_group}/{var_group}__" + timefmt + ".parquet"
+    return "data/output/{var_group}/{var}/{var}__" + timefmt + ".parquet"
 
 output_file_lst = []
 var_map = {}
@@ -40,7 +51,7 @@ for vg in config["var_groups"]:
                 var_map[vg]["date_range"] = var_map[vg]["date_range"][:int(config["max_days"])]
             # iterate through valid y/m/d combos, expand vars within each
             for y,m,d in var_map[vg]["date_range"]:
-                output_file_lst += expand("data/output/{var_group}/{var}/{var}__{year}{month:02d}{day:02d}.parquet",
+                output_file_lst += expand(output_pattern("{year}{month:02d}{day:02d}"),
                                             var_group=vg,
                                             var=[v for v in vg_cfg["vars"]],
                                             year=y,
@@ -48,19 +59,22 @@ for vg in config["var_groups"]:
                                             day=d)
         elif var_map[vg]["temporal_res"] == "monthly":
             var_map[vg]["date_range"] = [(y, m) for y in range(min_year_curr, max_year_curr + 1) for m in range(1, 13)]
-            output_file_lst += expand("data/output/{var_group}/{var}/{var}__{year}{month:02d}.parquet",
+            output_file_lst += expand(output_pattern("{year}{month:02d}"),
                             var_group=vg,
                             var=[v for v in vg_cfg["vars"]],
                             year=[y for y, m in var_map[vg]["date_range"]],
                             month=[m for y, m in var_map[vg]["date_range"]])
         else:
             var_map[vg]["date_range"] = [y for y in range(min_year_curr, max_year_curr + 1)]
-            output_file_lst += expand("data/output/{var_group}/{var}/{var}__{year}.parquet",
+            output_file_lst += expand(output_pattern("{year}"),
                 var_group=vg,
                 var=[v for v in vg_cfg["vars"]],
                 year=[y for y in var_map[vg]["date_range"]])
         f.close()
 
+# the wide layout expands to the same file once per var
+output_file_lst = list(dict.fromkeys(output_file_lst))
+
 # Expand over all valid combinations of variable groups, variables, and dates
 rule all:
     input:
@@ -81,3 +95,18 @@ rule preprocess:
               f"spatial_res={spatial_res} "
               f"temporal_res={temporal_res} "
               f"timestr={timestring}")
+
+rule preprocess_wide:
+    output:
+        "data/output/{var_group}/{var_group}__{timestring}.parquet"
+    params:
+        script="src/preprocessing.py"
+    run:
+        spatial_res = var_map[wildcards.var_group]["spatial_res"]
+        temporal_res = var_map[wildcards.var_group]["temporal_res"]
+        timestring = str(wildcards.timestring)
+        shell(f"python {params.script} var_group={wildcards.var_group} "
+              f"layout=wide "
+              f"spatial_res={spatial_res} "
+              f"temporal_res={temporal_res} "
+              f"timestr={timestring}")
@@ -58,3 +58,26 @@ rule preprocess_denom:
             year={wildcards.year} \
             lego_dir={params.lego_dir} \
         """
+
+# Optional: daily count stores for HealthDataset(backend="counts"), any horizon without rerunning
+# preprocess_health (run with `snakemake -s snakefile_health.smk count_stores`)
+rule count_stores:
+    input:
+        expand(f"data/health/ccw/_counts/{{var}}/meta.json", var=vars)
+
+rule build_count_store:
+    output:
+        f"data/health/ccw/_counts/{{var}}/meta.json"
+    params:
+        lego_dir = lego_dir,
+        min_year = min(years),
+        max_year = max(years),
+    shell:
+        """
+        python src/build_count_store.py \
+            hydra.run.dir=. \
+            var={wildcards.var} \
+            lego_dir={params.lego_dir} \
+            min_year={params.min_year} \
+            max_year={params.max_year} \
+        """
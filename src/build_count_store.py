@@ -0,0 +1,47 @@
+import logging
+import hydra
+import yaml
+from omegaconf import DictConfig
+from legoloaderx.count_store import build_count_store
+from legoloaderx.utils import get_unique_ids
+
+
+# Configure logging
+LOGGER = logging.getLogger(__name__)
+logging.basicConfig(
+    level=logging.INFO,
+    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+)
+
+@hydra.main(config_path="../conf/health", config_name="config", version_base=None)
+def main(cfg: DictConfig):
+    """
+    Build the daily count store of one health var (CSR per year plus per-node running counts)
+    for HealthDataset(backend="counts"), from the same lego inputs as preprocessing_health.py.
+    Horizons are summed in the loader, so cfg.horizons is not used.
+    """
+    # load unique id dir from global config
+    with open(f"conf/conf.yaml", "r") as f:
+        cfg_all = yaml.safe_load(f)
+        zcta_uniq_dir = f"{cfg_all['input_dir']}/{cfg_all['uniqid_dir']}/{cfg_all['uniqid_nm']}/zcta_yearly/"
+
+    unique_zctas, _ = get_unique_ids(zcta_uniq_dir, cfg.min_year, cfg.max_year)
+
+    resolution = f"{cfg.min_spatial_res}_{cfg.min_temporal_res}"
+    input_files = f"{cfg.input_dir}/{cfg.lego_dir}/medpar_outcomes/{cfg.vg_name}/{resolution}/{cfg.lego_prefix}_*.parquet"
+
+    LOGGER.info(f"Building count store for {cfg.vg_name}/{cfg.var} ({len(unique_zctas)} nodes, {cfg.min_year}-{cfg.max_year})")
+    out_dir = build_count_store(
+        root_dir=cfg.output_dir,
+        var_group_name=cfg.vg_name,
+        var=cfg.var,
+        nodes=unique_zctas,
+        source=input_files,
+        min_year=cfg.min_year,
+        max_year=cfg.max_year,
+    )
+    LOGGER.info(f"Saved count store to {out_dir}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,50 @@
+import logging
+import hydra
+import yaml
+from omegaconf import DictConfig
+from legoloaderx.cube_store import build_cube_store
+from legoloaderx.utils import get_unique_ids
+
+
+# Configure logging
+LOGGER = logging.getLogger(__name__)
+logging.basicConfig(
+    level=logging.INFO,
+    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+)
+
+@hydra.main(config_path="../conf/dataloader", config_name="config", version_base=None)
+def main(cfg: DictConfig):
+    """
+    Consolidate each var group under data_dir into a memory-mapped (timesteps, nodes, vars) cube
+    for XDataset(backend="cube").
+    """
+    # load unique id dir from global config
+    with open(f"conf/conf.yaml", "r") as f:
+        cfg_all = yaml.safe_load(f)
+        data_in_dir = cfg_all["input_dir"]
+        zcta_uniq_dir = f"{data_in_dir}/{cfg_all['uniqid_dir']}/{cfg_all['uniqid_nm']}/zcta_yearly/"
+        layout = cfg_all.get("layout", "long")
+
+    unique_zctas, _ = get_unique_ids(zcta_uniq_dir, cfg.min_year, cfg.max_year)
+
+    for vg in cfg.var_groups:
+        with open(f"conf/var_group/{vg}.yaml", "r") as f:
+            vg_cfg = yaml.safe_load(f)
+
+        LOGGER.info(f"Building cube for {vg} ({len(vg_cfg['vars'])} vars, {len(unique_zctas)} nodes)")
+        out_dir = build_cube_store(
+            root_dir=cfg.data_dir,
+            var_group_name=vg,
+            vars=vg_cfg["vars"],
+            temporal_res=vg_cfg["min_temporal_res"],
+            nodes=unique_zctas,
+            min_year=cfg.min_year,
+            max_year=cfg.max_year,
+            layout=layout,
+        )
+        LOGGER.info(f"Saved cube to {out_dir}")
+
+
+if __name__ == "__main__":
+    main()
@@ -2,6 +2,7 @@ import duckdb
 import hydra
 import os
 import pandas as pd
+from legoloaderx.utils import write_node_manifest
 
 
 @hydra.main(config_path="../conf", config_name="conf", version_base=None)
@@ -17,7 +18,7 @@ def main(cfg):
     elif cfg.temporal_res == "monthly":
         month = timestr[4:6]
         time_col = "year, month"
-        time_query = f"""SELECT {cfg.spatial_res}, '{year}', '{month}' AS year, month"""
+        time_query = f"""SELECT {cfg.spatial_res}, '{year}' AS year, '{month}' AS month"""
         match_query = f"""ON (i.{cfg.spatial_res} = d.{cfg.spatial_res} AND 
                               i.year = d.year AND
                               i.month = d.month)"""
@@ -32,38 +33,53 @@ def main(cfg):
     cfg_vg = cfg.var_group
     input_fname = f"{cfg.input_dir}/{cfg_vg.lego_dir}/{cfg_vg.lego_nm}__{year}.parquet"
 
-    # setting output filepath
-    out_dir = f"{cfg.output_dir}/{cfg.vg_name}/{cfg.var}/"
+    # setting output filepath and columns
+    # long layout: one file per var and timestep; wide layout: all vars of the group in one file
+    if cfg.layout == "wide":
+        out_vars = list(cfg_vg.vars)
+        out_dir = f"{cfg.output_dir}/{cfg.vg_name}/"
+        output_fname = f"{out_dir}/{cfg.vg_name}__{year}"
+    else:
+        out_vars = [cfg.var]
+        out_dir = f"{cfg.output_dir}/{cfg.vg_name}/{cfg.var}/"
+        output_fname = f"{out_dir}/{cfg.var}__{year}"
     os.makedirs(out_dir, exist_ok=True)
 
-    output_fname = f"{out_dir}/{cfg.var}__{year}"
     if month:
         output_fname += str(month).zfill(2)
     if day:
         output_fname += str(day).zfill(2)
     output_fname += ".parquet"
 
-    # getting unique id list
-    uniq_path = f"{cfg.input_dir}/{cfg.uniqid_dir}/{cfg.uniqid_nm}/{cfg.spatial_res}_yearly/{cfg.uniqid_nm}__{cfg.spatial_res}_yearly__{year}.parquet"
+    # getting the canonical node list: every continental id over all years, sorted.
+    # Every output file of every year has exactly these rows in this order (NaN where
+    # a node has no data), so the loader can slice values without reading the id column.
+    uniq_glob = f"{cfg.input_dir}/{cfg.uniqid_dir}/{cfg.uniqid_nm}/{cfg.spatial_res}_yearly/{cfg.uniqid_nm}__{cfg.spatial_res}_yearly__*.parquet"
 
     duckdb.execute(f"""
         CREATE TABLE index AS 
         {time_query}
-        FROM read_parquet('{uniq_path}') 
-        WHERE continental_us = TRUE
+        FROM (
+            SELECT DISTINCT {cfg.spatial_res} FROM read_parquet('{uniq_glob}')
+            WHERE continental_us = TRUE
+        )
         ORDER BY {cfg.spatial_res}
     """)
+    nodes = [row[0] for row in duckdb.execute(f"SELECT {cfg.spatial_res} FROM index ORDER BY {cfg.spatial_res}").fetchall()]
+    write_node_manifest(f"{cfg.output_dir}/{cfg.vg_name}", nodes)
 
     # Optimized query: Apply filtering *before* joining
+    out_cols = ", ".join(out_vars)
     query = f"""
         COPY (
-            SELECT i.{cfg.spatial_res}, d.{cfg.var}
+            SELECT i.{cfg.spatial_res}, {", ".join(f"d.{v}" for v in out_vars)}
             FROM index AS i
             LEFT JOIN (
-                SELECT {cfg.spatial_res}, {time_col}, {cfg.var} FROM read_parquet('{input_fname}')
+                SELECT {cfg.spatial_res}, {time_col}, {out_cols} FROM read_parquet('{input_fname}')
             ) AS d
             {match_query}
-        ) TO '{output_fname}' (FORMAT 'parquet');
+            ORDER BY i.{cfg.spatial_res}
+        ) TO '{output_fname}' (FORMAT 'parquet', ROW_GROUP_SIZE {cfg.row_group_size});
     """
 
     duckdb.execute(query)
@@ -0,0 +1,105 @@
+"""Shared fixtures: tiny on-disk trees in the layout the preprocessing scripts write."""
+
+from __future__ import annotations
+
+import numpy as np
+import pandas as pd
+import pytest
+
+
+NODES = ["00003", "00001", "00002", "00004"]
+YEAR = 2000
+
+
+def _dates(year=YEAR):
+    return [f"{d.year}{d.month:02d}{d.day:02d}" for d in pd.date_range(f"{year}-01-01", f"{year}-12-31")]
+
+
+@pytest.fixture(scope="session")
+def covars_dir(tmp_path_factory):
+    """``{var_group}/{var}/{var}__{timestr}.parquet`` files for one daily and one yearly group.
+
+    Rows are written in an order different from ``NODES`` and include a zcta that
+    is not in ``NODES``; ``00004`` is never present. Files for 2000-01-05 are missing.
+    """
+    tmp_path = tmp_path_factory.mktemp("covars")
+    rng = np.random.default_rng(0)
+    file_zctas = ["00002", "00001", "99999", "00003"]
+
+    def write(group, var, timestr, values):
+        path = tmp_path / group / var
+        path.mkdir(parents=True, exist_ok=True)
+        pd.DataFrame({"zcta": file_zctas, var: values}).to_parquet(path / f"{var}__{timestr}.parquet")
+
+    for day in _dates():
+        if day == "20000105":
+            continue
+        for var in ("tmmx", "pr"):
+            values = rng.normal(size=len(file_zctas)).astype("float32")
+            values[0] = np.nan if day == "20000110" else values[0]
+            write("gridmet", var, day, values)
+    write("census", "population", str(YEAR), np.array([20.0, 10.0, 99.0, 30.0], dtype="float32"))
+    return tmp_path
+
+
+@pytest.fixture(scope="session")
+def var_dict():
+    return {
+        "gridmet": {"vars": ["tmmx", "pr"], "temporal_res": "daily"},
+        "census": {"vars": ["population"], "temporal_res": "yearly"},
+    }
+
+
+@pytest.fixture(scope="session")
+def nodes():
+    return list(NODES)
+
+
+HORIZONS = [0, 7, 30]
+
+
+@pytest.fixture(scope="session")
+def daily_counts():
+    """Daily outcome counts ``{var: (len(file_zctas), days)}`` behind ``health_dir``."""
+    rng = np.random.default_rng(1)
+    return {var: rng.poisson(0.7, size=(4, len(_dates()))) for var in ("anemia", "asthma")}
+
+
+@pytest.fixture(scope="session")
+def health_dir(tmp_path_factory, daily_counts, covars_dir):
+    """Root with ``health/`` in the preprocessing_health.py layout and ``covars/`` linked in.
+
+    Day files hold (zcta, horizon, n) rows with n > 0, sorted by (zcta, horizon);
+    ``asthma`` has no file for 2000-03-01.
+    """
+    root = tmp_path_factory.mktemp("data")
+    (root / "covars").symlink_to(covars_dir)
+    health = root / "health"
+    file_zctas = ["00002", "00001", "99999", "00003"]
+    dates = _dates()
+
+    for var, daily in daily_counts.items():
+        path = health / "ccw" / var
+        path.mkdir(parents=True)
+        for t, day in enumerate(dates):
+            if var == "asthma" and day == "20000301":
+                continue
+            rows = []
+            for z, zcta in enumerate(file_zctas):
+                for h in HORIZONS:
+                    n = int(daily[z, t:t + h + 1].sum())
+                    if n > 0:
+                        rows.append((zcta, h, n))
+            df = pd.DataFrame(rows, columns=["zcta", "horizon", "n"]).sort_values(["zcta", "horizon"])
+            df.to_parquet(path / f"{var}__{day}.parquet", index=False)
+
+    (health / "denom").mkdir()
+    pd.DataFrame({"zcta": file_zctas, "n_bene": [50, 5, 100, 40]}).to_parquet(
+        health / "denom" / f"denom__{YEAR}.parquet"
+    )
+    return root
+
+
+@pytest.fixture(scope="session")
+def health_var_dict():
+    return {"ccw": {"vars": ["anemia", "asthma"], "temporal_res": "daily"}}
@@ -0,0 +1,29 @@
+"""Smoke tests for the benchmark harness in ``benchmarks/``."""
+
+from __future__ import annotations
+
+from pathlib import Path
+
+import pytest
+from omegaconf import OmegaConf
+
+from benchmarks.run_benchmarks import run_case, write_tree
+
+
+@pytest.fixture(scope="module")
+def bench(tmp_path_factory):
+    cfg = OmegaConf.load(Path(__file__).parents[1] / "conf" / "benchmarks" / "config.yaml")
+    cfg.merge_with({"n_nodes": 50, "daily_vars": 2, "yearly_vars": 1, "health_vars": 1, "n_samples": 8, "batch_size": 4})
+    data_dir = tmp_path_factory.mktemp("bench")
+    write_tree(cfg, data_dir)
+    settings = OmegaConf.to_container(cfg)
+    settings.pop("output")  # interpolates ${now:...}, only resolvable under hydra
+    return settings, str(data_dir)
+
+
+@pytest.mark.parametrize("loader", ["XDataset", "HealthDataset", "HealthXDataset", "compute_summary"])
+def test_run_case(bench, loader):
+    settings, data_dir = bench
+    result = run_case(loader, 3, 0, settings, data_dir)
+    assert result["samples"] == 8 and result["samples_per_sec"] > 0
+    assert result["files_opened"] > 0 and result["bytes_read"] > 0
@@ -0,0 +1,80 @@
+"""Tests for ``legoloaderx.cache.LRUCache``."""
+
+from __future__ import annotations
+
+import pickle
+
+import pytest
+import torch
+
+from legoloaderx.cache import LRUCache, SharedColumnCache
+
+
+def test_evicts_least_recently_used_by_bytes():
+    cache = LRUCache(max_bytes=3 * 16)  # three float32 vectors of length 4
+    for i in range(3):
+        cache.put(i, torch.zeros(4))
+    cache.get(0)                        # 0 becomes most recently used
+    cache.put(3, torch.zeros(4))        # evicts 1
+    assert 1 not in cache and 0 in cache and 3 in cache
+    assert cache.nbytes == 48
+
+
+def test_counters_and_missing_entries():
+    cache = LRUCache(max_bytes=64)
+    cache.put("missing", None)
+    assert cache.get("missing", "sentinel") is None
+    assert cache.get("absent", "sentinel") == "sentinel"
+    assert cache.info()["hits"] == 1 and cache.info()["misses"] == 1
+
+
+def test_oversized_value_not_cached():
+    cache = LRUCache(max_bytes=8)
+    cache.put("big", torch.zeros(16))
+    assert len(cache) == 0
+
+
+def test_shared_cache_checks_nodes_and_storage():
+    cache = SharedColumnCache(max_bytes=64, nodes=["a", "b"])
+    cache.register(["a", "b"], {"census": (torch.float32, 1)})
+    cache.register(["a", "b"], {"census": (torch.float32, 1), "gridmet": (torch.uint8, 255)})
+    with pytest.raises(ValueError):
+        cache.register(["b", "a"], {})
+    with pytest.raises(ValueError):
+        cache.register(["a", "b"], {"census": (torch.float16, 1)})
+
+    cache.put("x", torch.zeros(4))
+    copy = pickle.loads(pickle.dumps(cache))  # the lock is recreated, not pickled
+    assert "x" in copy and copy.storage == cache.storage
+
+
+def test_shared_cache_waits_for_reads_in_flight():
+    cache = SharedColumnCache(max_bytes=1 << 10, nodes=["a"])
+    future, owner = cache.reserve("k")
+    waiter, waiter_owns = cache.reserve("k")
+    assert owner and not waiter_owns and waiter is future and not waiter.done()
+    cache.put("k", torch.ones(2))
+    assert waiter.result().tolist() == [1.0, 1.0]
+    assert not cache.reserve("k")[1]  # cached since: served without a read
+
+    cache.reserve("failed")
+    waiter, _ = cache.reserve("failed")
+    cache.release("failed", OSError("unreadable"))
+    with pytest.raises(OSError):
+        waiter.result()
+    assert cache.reserve("failed")[1]  # the next caller reads again
+
+
+def test_shared_cache_reads_once_across_threads():
+    from concurrent.futures import ThreadPoolExecutor
+
+    cache = SharedColumnCache(max_bytes=0, nodes=["a"])  # holds no columns
+    loads = []
+
+    def load():
+        loads.append(1)
+        return "assignment"
+
+    with ThreadPoolExecutor(max_workers=4) as pool:
+        results = list(pool.map(lambda _: cache.zcta_assignment("census", load), range(8)))
+    assert results == ["assignment"] * 8 and len(loads) == 1
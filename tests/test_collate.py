@@ -0,0 +1,58 @@
+"""Tests for sparse outcomes and ``legoloaderx.collate``."""
+
+from __future__ import annotations
+
+import pytest
+import torch
+from torch.utils.data import DataLoader
+
+from legoloaderx import HealthDataset, HealthXDataset
+from legoloaderx.collate import densify, sparse_collate
+
+
+def make_dataset(health_dir, health_var_dict, nodes, **kwargs):
+    return HealthDataset(
+        root_dir=str(health_dir / "health"), var_dict=health_var_dict, nodes=nodes, window=5,
+        horizons=[7, 30], min_year=2000, max_year=2000, **kwargs,
+    )
+
+
+@pytest.mark.parametrize("num_workers", [0, 2])
+def test_sparse_outcomes_collate(health_dir, health_var_dict, nodes, num_workers):
+    dense = make_dataset(health_dir, health_var_dict, nodes, targets="lead", return_mask=True)
+    ds = make_dataset(health_dir, health_var_dict, nodes, targets="lead", return_mask=True, sparse=True)
+    assert ds[10]["outcomes"].is_sparse and not ds[10]["valid"].is_sparse
+
+    indices = [3, 20, 4, 200]
+    loader = DataLoader(ds, batch_size=2, sampler=indices, num_workers=num_workers, collate_fn=sparse_collate)
+    batches = list(loader)
+    assert batches[0]["outcomes"].is_sparse and batches[0]["outcomes"].shape == (2, 4, 2, 5)
+    for i, batch in enumerate(batches):
+        batch = densify(batch)
+        expected = dense.get_batch(indices[2 * i:2 * i + 2])
+        assert batch.keys() == expected.keys()
+        for key in batch:
+            torch.testing.assert_close(batch[key], expected[key])
+
+
+def test_sparse_keeps_nan(health_dir, health_var_dict, nodes):
+    dense = make_dataset(health_dir, health_var_dict, nodes)[10]["outcomes"]
+    outcomes = make_dataset(health_dir, health_var_dict, nodes, sparse=True)[10]["outcomes"]
+    assert outcomes._nnz() < dense.numel()
+    torch.testing.assert_close(outcomes.to_dense(), dense, equal_nan=True)
+
+
+def test_health_x_sparse(health_dir, var_dict, health_var_dict, nodes):
+    ds = HealthXDataset(
+        root_dir=str(health_dir),
+        var_dict={
+            "confounders": {"census": var_dict["census"]},
+            "treatments": {"gridmet": var_dict["gridmet"]},
+            "outcomes": health_var_dict,
+        },
+        nodes=nodes, window=5, horizons=[7], min_year=2000, max_year=2000, sparse=True,
+    )
+    items = ds.__getitems__([9, 2])
+    batch = sparse_collate(items)
+    assert batch["outcomes"].is_sparse and not batch["confounders"].is_sparse
+    torch.testing.assert_close(densify(batch)["outcomes"][1], ds[2]["outcomes"].to_dense(), equal_nan=True)
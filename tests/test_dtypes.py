@@ -0,0 +1,52 @@
+"""Tests for ``legoloaderx.dtypes``."""
+
+from __future__ import annotations
+
+import pytest
+import torch
+
+from legoloaderx.dtypes import count_valid, decode, encode, get_dtype, get_var_dict_dtype, pack_mask, unpack_mask
+
+
+def test_get_dtype():
+    assert get_dtype("bfloat16") is torch.bfloat16
+    assert get_dtype(torch.uint8) is torch.uint8
+    with pytest.raises(ValueError):
+        get_dtype("float64")
+
+
+def test_var_dict_dtype_needs_agreement():
+    assert get_var_dict_dtype({"a": {"dtype": "float16"}, "b": {"dtype": "float16"}}) is torch.float16
+    assert get_var_dict_dtype({"a": {"dtype": "float16"}, "b": {}}) is torch.float32
+
+
+def test_float_keeps_nan():
+    values = torch.tensor([1.5, float("nan"), -2.0])
+    encoded, valid = encode(values, torch.float16)
+    assert encoded.dtype == torch.float16 and valid is None
+    torch.testing.assert_close(decode(encoded), values, equal_nan=True)
+
+
+def test_integer_round_trip_with_mask():
+    values = torch.tensor([0.0, 0.5, float("nan"), 1.0, 2.0])
+    encoded, valid = encode(values, torch.uint8, scale=255)
+    assert encoded.tolist() == [0, 128, 0, 255, 255]  # clamped to the dtype's range
+    assert valid.tolist() == [True, True, False, True, True]
+    decoded = decode(encoded, valid, scale=255)
+    assert torch.isnan(decoded[2])
+    torch.testing.assert_close(decoded[[0, 1, 3]], torch.tensor([0.0, 128 / 255, 1.0]))
+
+
+@pytest.mark.parametrize("n", [1, 7, 8, 13])
+def test_pack_mask_round_trip(n):
+    valid = torch.rand(3, 2, n) > 0.5
+    packed = pack_mask(valid)
+    assert packed.dtype == torch.uint8 and packed.shape == (3, 2, (n + 7) // 8)
+    assert torch.equal(unpack_mask(packed, n), valid)
+
+
+def test_count_valid():
+    valid = torch.ones(2, 4, 3, 5, dtype=torch.bool)
+    valid[1, :, 2] = False
+    assert count_valid(valid[0]).tolist() == [20, 20, 20]
+    assert count_valid(valid, batched=True).tolist() == [[20, 20, 20], [20, 20, 0]]
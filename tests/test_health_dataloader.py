@@ -0,0 +1,421 @@
+"""Tests for ``legoloaderx.HealthDataset`` and ``HealthXDataset`` over a synthetic tree."""
+
+from __future__ import annotations
+
+import numpy as np
+import pytest
+import torch
+from torch.utils.data import DataLoader
+
+from legoloaderx import HealthDataset, HealthXDataset, StageStats
+
+# dataset node order -> row of the synthetic files' zcta list (00004 is never present)
+NODE_ROWS = {"00003": 3, "00001": 1, "00002": 0}
+
+
+def make_dataset(health_dir, health_var_dict, nodes, **kwargs):
+    return HealthDataset(
+        root_dir=str(health_dir / "health"), var_dict=health_var_dict, nodes=nodes, window=5,
+        min_year=2000, max_year=2000, **kwargs,
+    )
+
+
+@pytest.fixture
+def horizon_ds(health_dir, health_var_dict, nodes):
+    return make_dataset(health_dir, health_var_dict, nodes, horizons=[7, 30])
+
+
+@pytest.fixture
+def delta_t_ds(health_dir, health_var_dict, nodes):
+    return make_dataset(health_dir, health_var_dict, nodes, delta_t=3)
+
+
+def expected_counts(daily, nodes, t, h):
+    return [float(daily[NODE_ROWS[n], t:t + h + 1].sum()) if n in NODE_ROWS else 0.0 for n in nodes]
+
+
+def test_horizons_values(horizon_ds, daily_counts, nodes):
+    item = horizon_ds[10]
+    assert horizon_ds.horizons == [0, 7, 30]
+    assert item["outcomes"].shape == (4, 2, 3, 5)
+    assert item["denom"].shape == (4, 5)
+    anemia = item["outcomes"][:, 0]
+    for h_idx, h in enumerate(horizon_ds.horizons):
+        got = anemia[:, h_idx, 2].nan_to_num(-1).tolist()
+        want = expected_counts(daily_counts["anemia"], nodes, 12, h)
+        want[1] = -1.0  # 00001 has n_bene below min_bene and is masked
+        assert got == want
+
+
+def test_horizons_from_duckdb_schema(tmp_path):
+    # preprocessing_health.py writes int32 horizons; zctas may come dictionary-encoded
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+
+    (tmp_path / "ccw" / "asthma").mkdir(parents=True)
+    (tmp_path / "denom").mkdir()
+    table = pa.table({
+        "zcta": pa.array(["00001", "00001", "00002", "00009"]).dictionary_encode(),
+        "horizon": pa.array([0, 7, 14, 7], type=pa.int32()),
+        "n": pa.array([1, 3, 5, 9], type=pa.int64()),
+    })
+    pq.write_table(table, tmp_path / "ccw" / "asthma" / "asthma__20000101.parquet")
+    pq.write_table(pa.table({"zcta": ["00001", "00002"], "n_bene": [50, 50]}), tmp_path / "denom" / "denom__2000.parquet")
+
+    ds = HealthDataset(
+        root_dir=str(tmp_path), var_dict={"ccw": {"vars": ["asthma"], "temporal_res": "daily"}},
+        nodes=["00002", "00001"], window=1, horizons=[7], min_year=2000, max_year=2000,
+    )
+    counts = ds[0]["outcomes"][:, 0, :, 0]  # (nodes, horizons [0, 7])
+    assert counts.tolist() == [[0.0, 0.0], [1.0, 3.0]]
+
+
+@pytest.fixture(scope="module")
+def counts_dir(tmp_path_factory, health_dir, daily_counts):
+    """health_dir's denominators plus count stores built from the long-format daily counts behind it."""
+    import pandas as pd
+
+    from legoloaderx.count_store import build_count_store
+
+    root = tmp_path_factory.mktemp("counts")
+    (root / "denom").symlink_to(health_dir / "health" / "denom")
+    file_zctas = ["00002", "00001", "99999", "00003"]
+    dates = pd.date_range("2000-01-01", "2000-12-31").date
+    rows = [
+        (zcta, var, dates[t], int(daily[z, t]))
+        for var, daily in daily_counts.items()
+        for z, zcta in enumerate(file_zctas)
+        for t in range(len(dates))
+        if daily[z, t] > 0
+    ]
+    pd.DataFrame(rows, columns=["zcta", "var", "date", "n"]).to_parquet(root / "sparse_counts_2000.parquet")
+    for var in daily_counts:
+        build_count_store(str(root), "ccw", var, NODES_SORTED, str(root / "sparse_counts_*.parquet"), 2000, 2000)
+    return root
+
+
+NODES_SORTED = ["00001", "00002", "00003", "00004", "00005"]
+
+
+def test_count_store_horizon_sums_across_years(tmp_path):
+    import pandas as pd
+
+    from legoloaderx.count_store import CountStore, build_count_store
+
+    rng = np.random.default_rng(0)
+    dates = pd.date_range("2000-01-01", "2001-12-31")
+    daily = rng.poisson(0.2, size=(len(dates), len(NODES_SORTED)))
+    days, cols = np.nonzero(daily)
+    pd.DataFrame({
+        "zcta": np.array(NODES_SORTED)[cols], "date": dates[days].date, "n": daily[days, cols],
+    }).to_parquet(tmp_path / "counts.parquet")
+    build_count_store(str(tmp_path), "ccw", "anemia", NODES_SORTED, str(tmp_path / "counts.parquet"), 2000, 2001)
+    assert not list((tmp_path / "ccw" / "_counts" / "anemia").glob("*.npy"))  # no dense arrays
+
+    store = CountStore(str(tmp_path), "ccw", "anemia")
+    prefix = np.concatenate([np.zeros((1, len(NODES_SORTED)), dtype=np.int64), daily.cumsum(axis=0)])
+    t = np.array([0, 200, 360, 365, 700, len(dates) - 3])  # spans into 2001 and past the period end
+    horizons = [0, 7, 30]
+    got = store.horizon_sums([store.days[i] for i in t], horizons)
+    for i, day in enumerate(t):
+        for j, h in enumerate(horizons):
+            assert got[i, j].tolist() == (prefix[min(day + h + 1, len(dates))] - prefix[day]).tolist()
+
+
+def test_count_store_matches_day_files(counts_dir, health_var_dict, nodes, horizon_ds, delta_t_ds, daily_counts):
+    ds = HealthDataset(
+        root_dir=str(counts_dir), var_dict=health_var_dict, nodes=nodes, window=5,
+        horizons=[7, 30], min_year=2000, max_year=2000, backend="counts",
+    )
+    for idx in (0, 100, len(ds) - 1):  # asthma's missing 2000-03-01 file is outside these windows
+        for key in ("outcomes", "denom"):
+            torch.testing.assert_close(ds[idx][key], horizon_ds[idx][key], equal_nan=True)
+
+    # lead targets: daily CSRs for the history, prefix sums for the lead day
+    ds.targets = horizon_ds.targets = "lead"
+    for key in ("outcomes", "lead_outcomes"):
+        torch.testing.assert_close(ds[100][key], horizon_ds[100][key], equal_nan=True)
+
+    ds = HealthDataset(
+        root_dir=str(counts_dir), var_dict=health_var_dict, nodes=nodes, window=5,
+        delta_t=3, min_year=2000, max_year=2000, backend="counts",
+    )
+    torch.testing.assert_close(ds[10]["outcomes"], delta_t_ds[10]["outcomes"], equal_nan=True)
+
+    # a horizon that was never preprocessed
+    ds = HealthDataset(
+        root_dir=str(counts_dir), var_dict=health_var_dict, nodes=nodes, window=5,
+        horizons=[3], min_year=2000, max_year=2000, backend="counts",
+    )
+    outcomes = ds[20]["outcomes"]  # horizons [0, 3]; 00001 (small denom) and 00004 (no denom) are NaN
+    for d in range(5):
+        expected = expected_counts(daily_counts["anemia"], nodes, 20 + d, 3)
+        assert outcomes[[0, 2], 0, 1, d].tolist() == [expected[0], expected[2]]
+
+
+def test_denoms_loaded_once(horizon_ds, monkeypatch):
+    # nodes 00003, 00001 (5 < min_bene), 00002, 00004 (not in the denom file)
+    assert horizon_ds.denoms.tolist() == [[40.0, 0.0, 50.0, 0.0]]
+    assert horizon_ds.denom_masked.tolist() == [[False, True, False, False]]
+    monkeypatch.setattr(horizon_ds, "root_dir", "/nonexistent")  # nothing is read per sample
+    horizon_ds.files.exists = lambda reldir, name: False
+    item = horizon_ds[3]
+    assert item["denom"][:, 0].tolist() == [40.0, 0.0, 50.0, 0.0]
+    assert item["outcomes"][1].isnan().all() and not item["outcomes"][3].isnan().any()
+
+
+def test_delta_t_shape_and_denom(delta_t_ds):
+    item = delta_t_ds[0]
+    assert item["outcomes"].shape == (4, 2, 8)
+    assert item["denom"][:, 0].tolist() == [40.0, 0.0, 50.0, 0.0]
+    assert torch.isnan(item["outcomes"][1]).all()
+
+
+def test_delta_t_reads_horizon_zero(delta_t_ds, daily_counts, nodes):
+    # 2000-03-01 (day 60) has no asthma file: zeros for that day, anemia still read
+    item = delta_t_ds[57]
+    assert item["outcomes"][[0, 2], 1, 3].tolist() == [0.0, 0.0]
+    for d in range(8):
+        expected = expected_counts(daily_counts["anemia"], nodes, 57 + d, 0)
+        assert item["outcomes"][[0, 2], 0, d].tolist() == [expected[0], expected[2]]
+
+
+@pytest.mark.parametrize("mode", ["horizon_ds", "delta_t_ds"])
+def test_get_batch_matches_getitem(mode, request):
+    ds = request.getfixturevalue(mode)
+    indices = [20, 3, 4, 200, 6]
+    batch = ds.get_batch(indices)
+    for i, idx in enumerate(indices):
+        item = ds[idx]
+        for key in ("outcomes", "denom"):
+            torch.testing.assert_close(batch[key][i], item[key], equal_nan=True)
+
+
+@pytest.mark.parametrize("return_mask", [False, "packed"])
+def test_lead_targets(health_dir, health_var_dict, nodes, horizon_ds, return_mask):
+    ds = make_dataset(health_dir, health_var_dict, nodes, horizons=[7, 30], targets="lead", return_mask=return_mask)
+    item, full = ds[10], horizon_ds[10]
+    assert item["outcomes"].shape == (4, 2, 5) and item["lead_outcomes"].shape == (4, 2, 3)
+    valid = ~full["outcomes"].isnan()
+    torch.testing.assert_close(item["outcomes"], full["outcomes"][:, :, 0].nan_to_num(0) if return_mask else full["outcomes"][:, :, 0], equal_nan=True)
+    torch.testing.assert_close(item["lead_outcomes"], full["outcomes"][..., -1].nan_to_num(0) if return_mask else full["outcomes"][..., -1], equal_nan=True)
+    if return_mask:
+        assert item["lead_valid_count"].tolist() == valid[..., -1].sum(dim=[0, 2]).tolist()
+
+    indices = [20, 3, 4, 200, 6]
+    batch = ds.get_batch(indices)
+    for i, idx in enumerate(indices):
+        item = ds[idx]
+        for key in item:
+            torch.testing.assert_close(batch[key][i], item[key], equal_nan=True)
+
+    with pytest.raises(ValueError):
+        make_dataset(health_dir, health_var_dict, nodes, delta_t=3, targets="lead")
+
+
+@pytest.mark.parametrize("targets", ["window", "lead"])
+def test_health_x_getitems_matches_getitem(health_dir, var_dict, health_var_dict, nodes, targets):
+    ds = HealthXDataset(
+        root_dir=str(health_dir),
+        var_dict={
+            "confounders": {"census": var_dict["census"]},
+            "treatments": {"gridmet": var_dict["gridmet"]},
+            "outcomes": health_var_dict,
+        },
+        nodes=nodes, window=5, horizons=[7], min_year=2000, max_year=2000, targets=targets,
+    )
+    indices = [9, 2, 3]
+    for item, idx in zip(ds.__getitems__(indices), indices):
+        expected = ds[idx]
+        assert item.keys() == expected.keys()
+        for key in item:
+            torch.testing.assert_close(item[key], expected[key], equal_nan=True)
+
+
+def test_health_x_node_block(health_dir, var_dict, health_var_dict, nodes):
+    ds = HealthXDataset(
+        root_dir=str(health_dir),
+        var_dict={
+            "confounders": {"census": var_dict["census"]},
+            "treatments": {"gridmet": var_dict["gridmet"]},
+            "outcomes": health_var_dict,
+        },
+        nodes=nodes, window=5, horizons=[7], min_year=2000, max_year=2000,
+    )
+    node_idx = np.array([2, 0])
+    full = ds[4]
+    items = ds.__getitems__([(4, node_idx), (5, node_idx)])
+    assert items[0]["node_index"].tolist() == [2, 0]
+    for key in ("confounders", "treatments", "outcomes", "denom"):
+        torch.testing.assert_close(items[0][key], full[key][node_idx], equal_nan=True)
+        torch.testing.assert_close(ds[(4, node_idx)][key], full[key][node_idx], equal_nan=True)
+
+
+def test_compact_nodes(health_dir, health_var_dict, nodes, horizon_ds):
+    with pytest.raises(ValueError):
+        make_dataset(health_dir, health_var_dict, nodes, horizons=[7, 30], compact_nodes=True)
+    ds = make_dataset(health_dir, health_var_dict, nodes, horizons=[7, 30], node_years={2000: ["00002", "00003"]}, compact_nodes=True)
+    assert ds.node_mask(4).tolist() == [True, False, True, False]
+    for item in (ds[4], ds.__getitems__([4, 5])[0]):
+        assert item["node_index"].tolist() == [0, 2] and item["node_mask"].all()
+        for key in ("outcomes", "denom"):
+            torch.testing.assert_close(item[key], horizon_ds[4][key][[0, 2]], equal_nan=True)
+    assert ds.get_batch([4, 5])["node_index"].shape == (2, 2)
+
+    # without compaction every node is returned, with its mask
+    item = make_dataset(health_dir, health_var_dict, nodes, horizons=[7, 30], node_years={2000: ["00002"]})[4]
+    assert item["node_mask"].tolist() == [False, False, True, False] and item["node_index"].tolist() == [0, 1, 2, 3]
+
+
+def test_health_x_compact_nodes(health_dir, var_dict, health_var_dict, nodes):
+    kwargs = dict(
+        root_dir=str(health_dir),
+        var_dict={
+            "confounders": {"census": var_dict["census"]},
+            "treatments": {"gridmet": var_dict["gridmet"]},
+            "outcomes": health_var_dict,
+        },
+        nodes=nodes, window=5, horizons=[7], min_year=2000, max_year=2000,
+    )
+    full = HealthXDataset(**kwargs)[4]
+    ds = HealthXDataset(**kwargs, node_years={2000: ["00002", "00003"]}, compact_nodes=True)
+    for item in (ds[4], ds.__getitems__([4, 5])[0]):
+        assert item["node_index"].tolist() == [0, 2] and item["node_mask"].all()
+        for key in ("confounders", "treatments", "outcomes", "denom"):
+            torch.testing.assert_close(item[key], full[key][[0, 2]], equal_nan=True)
+
+    # without compaction every node is returned, with its mask
+    item = HealthXDataset(**kwargs, node_years={2000: ["00002"]})[4]
+    assert item["node_mask"].tolist() == [False, False, True, False] and item["node_index"].tolist() == [0, 1, 2, 3]
+
+
+def test_integer_counts_with_mask(health_dir, health_var_dict, nodes, horizon_ds):
+    with pytest.raises(ValueError):
+        make_dataset(health_dir, health_var_dict, nodes, horizons=[7, 30], dtype="int16")
+    ds = make_dataset(health_dir, health_var_dict, nodes, horizons=[7, 30], dtype="int16", return_mask=True)
+    item, expected = ds[3], horizon_ds[3]
+    assert item["outcomes"].dtype == torch.int16 and item["denom"].dtype == torch.int32
+    valid = ~torch.isnan(expected["outcomes"])
+    assert torch.equal(item["valid"], valid)
+    assert torch.equal(item["outcomes"][valid], expected["outcomes"][valid].to(torch.int16))
+    assert (item["outcomes"][~valid] == 0).all()
+    batch = ds.get_batch([3, 4])
+    assert torch.equal(batch["valid"][0], valid) and torch.equal(batch["outcomes"][0], item["outcomes"])
+
+
+def test_health_x_masks_follow_group_dtypes(health_dir, var_dict, health_var_dict, nodes):
+    ds = HealthXDataset(
+        root_dir=str(health_dir),
+        var_dict={
+            "confounders": {"census": dict(var_dict["census"], dtype="int32")},
+            "treatments": {"gridmet": dict(var_dict["gridmet"], dtype="bfloat16")},
+            "outcomes": {"ccw": dict(health_var_dict["ccw"], dtype="int16")},
+        },
+        nodes=nodes, window=5, horizons=[7], min_year=2000, max_year=2000, return_mask=True,
+    )
+    item = ds.__getitems__([2])[0]
+    assert item["confounders"].dtype == torch.int32 and item["treatments"].dtype == torch.bfloat16
+    assert item["outcomes"].dtype == torch.int16
+    for key in ("confounders", "treatments", "outcomes"):
+        assert item[f"{key}_valid"].shape == item[key].shape
+        assert torch.equal(item[f"{key}_valid"], ds[2][f"{key}_valid"])
+
+
+@pytest.mark.parametrize("num_workers", [0, 2])
+def test_health_x_concurrent_streams(health_dir, var_dict, health_var_dict, nodes, num_workers):
+    def make(**kwargs):
+        return HealthXDataset(
+            root_dir=str(health_dir),
+            var_dict={
+                "confounders": {"census": var_dict["census"]},
+                "treatments": {"gridmet": var_dict["gridmet"]},
+                "outcomes": health_var_dict,
+            },
+            nodes=nodes, window=5, horizons=[7], min_year=2000, max_year=2000, **kwargs,
+        )
+
+    batches = list(DataLoader(make(concurrent_streams=True), batch_size=2, sampler=[9, 2, 3, 40], num_workers=num_workers))
+    expected = list(DataLoader(make(), batch_size=2, sampler=[9, 2, 3, 40]))
+    for batch, expected_batch in zip(batches, expected):
+        assert batch.keys() == expected_batch.keys()
+        for key in expected_batch:
+            torch.testing.assert_close(batch[key], expected_batch[key], equal_nan=True)
+
+
+def test_health_x_shared_cache(health_dir, var_dict, health_var_dict, nodes):
+    def make(**kwargs):
+        # census is both a confounder and a treatment
+        return HealthXDataset(
+            root_dir=str(health_dir),
+            var_dict={
+                "confounders": {"census": var_dict["census"]},
+                "treatments": {"census": var_dict["census"], "gridmet": var_dict["gridmet"]},
+                "outcomes": health_var_dict,
+            },
+            nodes=nodes, window=5, horizons=[7], min_year=2000, max_year=2000, **kwargs,
+        )
+
+    shared_stats, stats = StageStats(max_workers=0), StageStats(max_workers=0)
+    shared, separate = make(stats=shared_stats), make(cache_bytes=0, stats=stats)
+    assert shared.confounders_dataset.cache is shared.treatments_dataset.cache
+    assert shared.confounders_dataset.files is shared.treatments_dataset.files
+    item, expected = shared[10], separate[10]
+    for key in expected:
+        torch.testing.assert_close(item[key], expected[key], equal_nan=True)
+    # the census file of the window is read once instead of once per stream
+    assert stats.summary()["total"]["files"] - shared_stats.summary()["total"]["files"] == 1
+
+
+def test_health_x_shares_zcta_mapping_and_waits_for_reads(health_dir, var_dict, health_var_dict, nodes, monkeypatch):
+    import legoloaderx.x_dataloader
+
+    kwargs = dict(
+        root_dir=str(health_dir),
+        var_dict={
+            "confounders": {"census": var_dict["census"]},  # census is both a confounder and a treatment
+            "treatments": {"census": var_dict["census"], "gridmet": var_dict["gridmet"]},
+            "outcomes": health_var_dict,
+        },
+        nodes=nodes, window=5, horizons=[7], min_year=2000, max_year=2000,
+    )
+    # with cache_bytes=0 no columns are cached, but the zcta mapping is still computed once per group
+    zcta_reads = []
+    read_table = legoloaderx.x_dataloader.pq.read_table
+    monkeypatch.setattr(
+        legoloaderx.x_dataloader.pq, "read_table", lambda path, **kw: zcta_reads.append(path) or read_table(path, **kw),
+    )
+    ds = HealthXDataset(**kwargs, cache_bytes=0)
+    assert ds.confounders_dataset.cache is ds.treatments_dataset.cache is ds.column_cache
+    assert ds.confounders_dataset.row_to_zcta_assignments is ds.treatments_dataset.row_to_zcta_assignments
+    ds[10]
+    assert len(zcta_reads) == 2 and len(ds.column_cache) == 0  # census and gridmet
+    monkeypatch.undo()
+
+    # and a stream missing on a file the other stream is reading waits for that read
+    import threading
+    from concurrent.futures import ThreadPoolExecutor
+
+    key, waiting = ("census", "population", "2000"), threading.Event()
+    reserve = ds.column_cache.reserve
+
+    def reserve_and_signal(k):
+        future, owner = reserve(k)
+        if k == key and not owner:
+            waiting.set()
+        return future, owner
+
+    monkeypatch.setattr(ds.column_cache, "reserve", reserve_and_signal)
+    assert reserve(key)[1]  # "the other stream" starts reading
+    with ThreadPoolExecutor(max_workers=1) as pool:
+        confounders = pool.submit(ds.confounders_dataset.__getitem__, 10)
+        assert waiting.wait(timeout=10)
+        ds.column_cache.put(key, torch.full((len(nodes),), 7.0))
+        assert (confounders.result() == 7.0).all()
+    assert len(ds.column_cache) == 0
+    monkeypatch.undo()
+
+    # concurrent streams missing on the same census file read it once
+    sequential_stats, concurrent_stats = StageStats(max_workers=0), StageStats(max_workers=0)
+    HealthXDataset(**kwargs, cache_bytes=1 << 20, stats=sequential_stats).__getitems__([10, 40])
+    HealthXDataset(**kwargs, cache_bytes=1 << 20, concurrent_streams=True, stats=concurrent_stats).__getitems__([10, 40])
+    assert concurrent_stats.summary()["total"]["files"] == sequential_stats.summary()["total"]["files"]
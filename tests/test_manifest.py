@@ -0,0 +1,51 @@
+"""Tests for ``legoloaderx.manifest.FileManifest``."""
+
+from __future__ import annotations
+
+import logging
+import os
+
+import pytest
+
+from legoloaderx import XDataset
+from legoloaderx.manifest import FileManifest, get_file_manifest
+
+
+def test_scan_and_lookup(covars_dir):
+    manifest = FileManifest.scan(str(covars_dir), ["gridmet/tmmx", "census/population", "nope"])
+    assert manifest.exists("gridmet/tmmx", "tmmx__20000101.parquet")
+    assert not manifest.exists("gridmet/tmmx", "tmmx__20000105.parquet")
+    assert manifest.size("census/population", "population__2000.parquet") > 0
+    assert manifest.entries["nope"] == {}
+
+
+def test_json_cache_round_trip(covars_dir, tmp_path):
+    cache = str(tmp_path / "files.json")
+    first = FileManifest.load_or_scan(str(covars_dir), ["gridmet/pr"], cache_path=cache)
+    assert os.path.exists(cache)
+    # a second call with an extra directory only scans the new one
+    second = FileManifest.load_or_scan(str(covars_dir), ["gridmet/pr", "gridmet/tmmx"], cache_path=cache)
+    assert second.entries["gridmet/pr"] == first.entries["gridmet/pr"]
+    assert "gridmet/tmmx" in FileManifest.load(cache).entries
+
+
+def test_shared_manifest_must_match_root(covars_dir, tmp_path):
+    manifest = FileManifest.scan(str(covars_dir), [])
+    with pytest.raises(ValueError):
+        get_file_manifest(str(tmp_path), ["gridmet/pr"], manifest)
+
+
+def test_single_coverage_report_and_no_stat_calls(covars_dir, var_dict, nodes, monkeypatch, caplog):
+    with caplog.at_level(logging.INFO):
+        ds = XDataset(root_dir=str(covars_dir), var_dict=var_dict, nodes=nodes, window=7,
+                      min_year=2000, max_year=2000)
+    warnings = [r.message for r in caplog.records if r.levelno == logging.WARNING]
+    assert len(warnings) == 2 and all("365/366" in w and "20000105" in w for w in warnings)
+
+    def no_stat(path):
+        raise AssertionError(f"os.path.exists({path}) called per item")
+
+    monkeypatch.setattr(os.path, "exists", no_stat)
+    caplog.clear()
+    ds[0]
+    assert not [r for r in caplog.records if r.levelno == logging.WARNING]
@@ -0,0 +1,87 @@
+"""Tests for ``legoloaderx.profiling.StageStats`` instrumentation of the datasets."""
+
+from __future__ import annotations
+
+import json
+
+import pytest
+import torch
+
+from legoloaderx import HealthDataset, HealthXDataset, StageStats, XDataset
+from legoloaderx.profiling import NULL_STATS
+
+
+def make_dataset(covars_dir, var_dict, nodes, **kwargs):
+    return XDataset(
+        root_dir=str(covars_dir), var_dict=var_dict, nodes=nodes, window=7,
+        min_year=2000, max_year=2000, **kwargs,
+    )
+
+
+def test_disabled_by_default(covars_dir, var_dict, nodes):
+    assert make_dataset(covars_dir, var_dict, nodes).stats is NULL_STATS
+
+
+def test_stages_and_counters(covars_dir, var_dict, nodes):
+    stats = StageStats(max_workers=0)
+    ds = make_dataset(covars_dir, var_dict, nodes, stats=stats, cache_bytes=1 << 20)
+    ds[0]
+    ds[1]
+    total = stats.summary()["total"]
+    for stage in ("open", "decode", "convert", "zcta_map", "scatter"):
+        assert total["stages"][stage]["calls"] > 0
+    assert total["stages"]["normalize"]["calls"] == 0
+    # gridmet: 2 vars x 8 days with 20000105 missing; census: one yearly file
+    assert total["files"] == 2 * 7 + 1
+    assert total["bytes_read"] > 0
+    # ds[1] shares 6 days and the census year with ds[0]
+    assert total["cache_misses"] == 2 * 8 + 1 and total["cache_hits"] == 2 * 6 + 1
+
+
+def test_aggregated_across_workers(covars_dir, var_dict, nodes, tmp_path):
+    stats = StageStats(max_workers=2)
+    ds = make_dataset(covars_dir, var_dict, nodes, stats=stats)
+    loader = torch.utils.data.DataLoader(ds, batch_size=None, sampler=range(4), num_workers=2)
+    for _ in loader:
+        pass
+    summary = stats.summary()
+    assert set(summary["workers"]) == {"worker_0", "worker_1"}
+    assert summary["total"]["files"] == sum(worker["files"] for worker in summary["workers"].values()) > 0
+
+    stats.dump(tmp_path / "stats.json")
+    assert json.loads((tmp_path / "stats.json").read_text()) == summary
+    stats.reset()
+    assert stats.summary()["workers"] == {}
+
+
+def test_health_dataset_stages(health_dir, health_var_dict, nodes):
+    stats = StageStats(max_workers=0)
+    ds = HealthDataset(
+        root_dir=str(health_dir / "health"), var_dict=health_var_dict, nodes=nodes, window=5,
+        horizons=[7], min_year=2000, max_year=2000, stats=stats,
+    )
+    ds[0]
+    total = stats.summary()["total"]
+    assert total["files"] > 0 and total["bytes_read"] > 0
+    for stage in ("open", "decode", "convert", "zcta_map", "scatter"):
+        assert total["stages"][stage]["calls"] > 0
+
+
+@pytest.mark.parametrize("concurrent_streams", [False, True])
+def test_health_x_stream_latency(health_dir, var_dict, health_var_dict, nodes, concurrent_streams):
+    stats = StageStats(max_workers=0)
+    ds = HealthXDataset(
+        root_dir=str(health_dir),
+        var_dict={
+            "confounders": {"census": var_dict["census"]},
+            "treatments": {"gridmet": var_dict["gridmet"]},
+            "outcomes": health_var_dict,
+        },
+        nodes=nodes, window=5, horizons=[7], min_year=2000, max_year=2000,
+        concurrent_streams=concurrent_streams, stats=stats,
+    )
+    ds[9]
+    ds.__getitems__([2, 3])
+    streams = stats.summary()["total"]["streams"]
+    for stream in ("confounders", "treatments", "outcomes"):
+        assert streams[stream]["calls"] == 2 and streams[stream]["seconds"] > 0
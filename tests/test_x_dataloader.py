@@ -0,0 +1,431 @@
+"""Tests for ``legoloaderx.XDataset`` over a synthetic covariate tree."""
+
+from __future__ import annotations
+
+import numpy as np
+import pandas as pd
+import pyarrow.parquet as pq
+import pytest
+import torch
+
+from legoloaderx import NodeBlockSampler, XDataset, build_cube_store
+from legoloaderx.dtypes import unpack_mask
+from legoloaderx.node_blocks import NodeValidity, get_node_tiles
+from legoloaderx.utils import get_row_group_selection, write_node_manifest
+
+
+def make_dataset(covars_dir, var_dict, nodes, **kwargs):
+    return XDataset(
+        root_dir=str(covars_dir), var_dict=var_dict, nodes=nodes, window=7,
+        min_year=2000, max_year=2000, **kwargs,
+    )
+
+
+@pytest.fixture(scope="session")
+def cube_dir(covars_dir, var_dict, nodes):
+    for var_group_name, var_group in var_dict.items():
+        build_cube_store(str(covars_dir), var_group_name, var_group["vars"], var_group["temporal_res"],
+                         nodes=sorted(nodes), min_year=2000, max_year=2000)
+    return covars_dir
+
+
+@pytest.fixture(scope="session")
+def wide_dir(covars_dir, var_dict, tmp_path_factory):
+    """The same tree rewritten in the wide layout: {var_group}/{var_group}__{timestr}.parquet."""
+    root = tmp_path_factory.mktemp("wide")
+    for var_group_name, var_group in var_dict.items():
+        (root / var_group_name).mkdir()
+        first = var_group["vars"][0]
+        for path in (covars_dir / var_group_name / first).glob("*.parquet"):
+            timestr = path.stem.split("__")[1]
+            df = pd.concat(
+                [pd.read_parquet(covars_dir / var_group_name / var / f"{var}__{timestr}.parquet").set_index("zcta")
+                 for var in var_group["vars"]],
+                axis=1,
+            ).reset_index()
+            df.to_parquet(root / var_group_name / f"{var_group_name}__{timestr}.parquet")
+    return root
+
+
+@pytest.fixture(scope="session")
+def canonical_dir(covars_dir, var_dict, tmp_path_factory):
+    """The same tree with every file in one sorted node order plus a _nodes.json manifest."""
+    root = tmp_path_factory.mktemp("canonical")
+    file_nodes = ["00001", "00002", "00003", "99999"]
+    for var_group_name, var_group in var_dict.items():
+        write_node_manifest(str(root / var_group_name), file_nodes)
+        for var in var_group["vars"]:
+            (root / var_group_name / var).mkdir()
+            for path in (covars_dir / var_group_name / var).glob("*.parquet"):
+                df = pd.read_parquet(path).set_index("zcta").reindex(file_nodes).reset_index()
+                df.to_parquet(root / var_group_name / var / path.name, row_group_size=2)
+    return root
+
+
+# --------------------------------------------------------------- parquet backend
+
+def test_parquet_sample_shape_and_alignment(covars_dir, var_dict, nodes):
+    ds = make_dataset(covars_dir, var_dict, nodes)
+    x = ds[0]
+    assert x.shape == (4, 3, 7)
+    # census population is yearly: the same value on every day, aligned by zcta
+    pop = x[:, ds.var_to_idx["census_population"], :]
+    torch.testing.assert_close(pop[:3, 0], torch.tensor([30.0, 10.0, 20.0]))
+    assert torch.isnan(pop[3]).all()
+    assert (pop[:3] == pop[:3, :1]).all()
+
+
+def test_parquet_missing_day_is_nan(covars_dir, var_dict, nodes):
+    ds = make_dataset(covars_dir, var_dict, nodes)
+    x = ds[0]  # window 20000101..20000107; 20000105 is missing
+    gridmet = x[:3, ds.var_slices["gridmet"], :]
+    assert torch.isnan(gridmet[..., 4]).all()
+    assert not torch.isnan(gridmet[..., 3]).any()
+
+
+# --------------------------------------------------------------- cube backend
+
+def test_cube_matches_parquet(cube_dir, var_dict, nodes):
+    parquet = make_dataset(cube_dir, var_dict, nodes)
+    cube = make_dataset(cube_dir, var_dict, nodes, backend="cube")
+    for idx in (0, 3, 100, len(parquet) - 1):
+        torch.testing.assert_close(cube[idx], parquet[idx], equal_nan=True)
+
+
+def test_cube_missing_var_raises(cube_dir, var_dict, nodes):
+    var_dict = dict(var_dict, census={"vars": ["median_age"], "temporal_res": "yearly"})
+    with pytest.raises(ValueError):
+        make_dataset(cube_dir, var_dict, nodes, backend="cube")
+
+
+# --------------------------------------------------------------- normalization
+
+STATS = {
+    "gridmet": {"tmmx": {"mean": 290.0, "std": 4.0}, "pr": {"mean": 1.0, "std": 0.0}},
+    "census": {"population": {"mean": 20.0, "std": 10.0}},
+}
+
+
+@pytest.mark.parametrize("backend", ["parquet", "cube"])
+@pytest.mark.parametrize("normalize_inplace", [True, False])
+def test_normalize_matches_raw(cube_dir, var_dict, nodes, backend, normalize_inplace):
+    raw = make_dataset(cube_dir, var_dict, nodes, backend=backend)
+    norm = make_dataset(cube_dir, var_dict, nodes, backend=backend, normalize=STATS,
+                        normalize_inplace=normalize_inplace)
+    mean = torch.tensor([290.0, 1.0, 20.0]).view(1, 3, 1)
+    std = torch.tensor([4.0, 1.0, 10.0]).view(1, 3, 1)  # std 0 leaves the scale alone
+    for idx in (0, 3):
+        expected = (raw[idx] - mean) / std
+        torch.testing.assert_close(norm[idx], expected, equal_nan=True)
+    torch.testing.assert_close(norm.get_batch([0, 3])[1], norm[3], equal_nan=True)
+
+
+# --------------------------------------------------------------- dtypes
+
+def test_group_dtype_sets_output_and_cache(covars_dir, var_dict, nodes):
+    half = {name: dict(group, dtype="float16") for name, group in var_dict.items()}
+    full = make_dataset(covars_dir, var_dict, nodes, cache_bytes=1 << 20)
+    ds = make_dataset(covars_dir, half, nodes, cache_bytes=1 << 20)
+    x, expected = ds[0], full[0]
+    assert x.dtype == torch.float16
+    torch.testing.assert_close(x.float(), expected, equal_nan=True, rtol=1e-3, atol=1e-3)
+    assert ds.cache_info()["nbytes"] * 2 == full.cache_info()["nbytes"]
+    torch.testing.assert_close(ds[0], x, equal_nan=True)  # served from the float16 cache
+    assert make_dataset(covars_dir, dict(half, census=var_dict["census"]), nodes)[0].dtype == torch.float32
+
+
+def test_integer_dtype_with_mask(covars_dir, var_dict, nodes):
+    census = {"census": dict(var_dict["census"], dtype="uint8", scale=2)}
+    with pytest.raises(ValueError):
+        make_dataset(covars_dir, census, nodes)
+    ds = make_dataset(covars_dir, census, nodes, return_mask=True, cache_bytes=1 << 20)
+    for x, valid in (ds[0], ds[0]):  # read, then from the uint8 cache
+        assert x.dtype == torch.uint8 and valid.dtype == torch.bool
+        assert x[:3, 0, 0].tolist() == [60, 20, 40]  # population * 2
+        assert valid[:3].all() and not valid[3].any() and (x[3] == 0).all()
+    batch, valid = ds.get_batch([0, 1])
+    assert batch.shape == valid.shape == (2, 4, 1, 7)
+    torch.testing.assert_close(batch[1], ds[1][0])
+
+
+def test_storage_dtype_applies_with_and_without_cache(covars_dir, var_dict, nodes):
+    compact = {
+        "gridmet": dict(var_dict["gridmet"], dtype="float16"),
+        "census": dict(var_dict["census"], dtype="uint8", scale=0.15),  # population rounds lossily
+    }
+    plain = make_dataset(covars_dir, compact, nodes)
+    cached = make_dataset(covars_dir, compact, nodes, cache_bytes=1 << 20)
+    first = cached[3]
+    assert cached.cache_info()["nbytes"] > 0
+    for x in (plain[3], cached[3]):  # never cached, then served from the cache
+        assert torch.equal(x.nan_to_num(), first.nan_to_num())
+    assert first[:3, 2, 0].tolist() == pytest.approx([4 / 0.15, 2 / 0.15, 20.0])  # 30, 10, 20
+
+
+@pytest.mark.parametrize("dtype", [None, "float16"])
+def test_packed_mask(covars_dir, var_dict, nodes, dtype):
+    reference = make_dataset(covars_dir, var_dict, nodes)[0]
+    ds = make_dataset(covars_dir, var_dict, nodes, dtype=dtype, return_mask="packed")
+    x, packed, valid_count = ds[0]
+    valid = unpack_mask(packed, 7)
+    assert packed.shape == (4, 3, 1)
+    assert torch.equal(valid, ~torch.isnan(reference))
+    assert (x[~valid] == 0).all()
+    assert valid_count.tolist() == valid.sum(dim=(0, 2)).tolist()
+    batch = ds.get_batch([0, 1])
+    assert batch[2].shape == (2, 3)
+    for tensor, item in zip(ds.__getitems__([0, 1])[0], (x, packed, valid_count)):
+        assert torch.equal(tensor, item)
+
+
+# --------------------------------------------------------------- column cache
+
+def test_cache_reuses_overlapping_window(covars_dir, var_dict, nodes):
+    plain = make_dataset(covars_dir, var_dict, nodes)
+    cached = make_dataset(covars_dir, var_dict, nodes, cache_bytes=1 << 20)
+    torch.testing.assert_close(cached[10], plain[10], equal_nan=True)
+    misses = cached.cache_info()["misses"]
+    torch.testing.assert_close(cached[11], plain[11], equal_nan=True)
+    # only the new lead day of the two daily vars is read
+    assert cached.cache_info()["misses"] == misses + 2
+    assert plain.cache_info() is None
+
+
+def test_yearly_file_read_once_per_window(covars_dir, var_dict, nodes):
+    ds = make_dataset(covars_dir, var_dict, nodes, cache_bytes=1 << 20)
+    x = ds[0]
+    # 2 daily vars x 7 days + 1 yearly file, each requested exactly once
+    assert ds.cache_info()["misses"] == 15 and ds.cache_info()["hits"] == 0
+    pop = x[:, ds.var_to_idx["census_population"], :]
+    assert (pop[:3] == pop[:3, :1]).all()
+
+
+# --------------------------------------------------------------- batched fetch
+
+@pytest.mark.parametrize("backend", ["parquet", "cube"])
+def test_get_batch_matches_getitem(cube_dir, var_dict, nodes, backend):
+    ds = make_dataset(cube_dir, var_dict, nodes, backend=backend)
+    indices = [5, 1, 2, 300, 9]
+    batch = ds.get_batch(indices)
+    assert batch.shape == (5, 4, 3, 7)
+    for i, idx in enumerate(indices):
+        torch.testing.assert_close(batch[i], ds[idx], equal_nan=True)
+
+
+def test_dataloader_uses_getitems(covars_dir, var_dict, nodes):
+    ds = make_dataset(covars_dir, var_dict, nodes, cache_bytes=1 << 20)
+    loader = torch.utils.data.DataLoader(ds, batch_size=4, shuffle=False)
+    batch = next(iter(loader))
+    assert batch.shape == (4, 4, 3, 7)
+    # 4 consecutive windows of 7 days span 10 days (one missing): 2 vars x 10 + 1 census file
+    assert ds.cache_info()["misses"] == 21
+
+
+# --------------------------------------------------------------- wide layout
+
+def test_wide_matches_long(covars_dir, wide_dir, var_dict, nodes):
+    long = make_dataset(covars_dir, var_dict, nodes)
+    wide = make_dataset(wide_dir, var_dict, nodes, backend="wide", cache_bytes=1 << 20)
+    for idx in (0, 3, 200):
+        torch.testing.assert_close(wide[idx], long[idx], equal_nan=True)
+
+
+
+def test_cube_from_wide_layout(cube_dir, wide_dir, var_dict, nodes, tmp_path):
+    import shutil
+
+    root = shutil.copytree(wide_dir, tmp_path / "wide")
+    with pytest.raises(ValueError):
+        build_cube_store(str(root), "gridmet", ["tmmx", "pr"], "daily", nodes=sorted(nodes), min_year=2000, max_year=2000)
+    for var_group_name, var_group in var_dict.items():
+        build_cube_store(str(root), var_group_name, var_group["vars"], var_group["temporal_res"],
+                         nodes=sorted(nodes), min_year=2000, max_year=2000, layout="wide")
+    long = make_dataset(cube_dir, var_dict, nodes, backend="cube")
+    wide = make_dataset(root, var_dict, nodes, backend="cube")
+    for idx in (0, 3, 200):
+        torch.testing.assert_close(wide[idx], long[idx], equal_nan=True)
+
+
+# --------------------------------------------------------------- canonical node axis
+
+@pytest.mark.parametrize("ds_nodes", [None, ["00001", "00002", "00003", "99999"]])
+def test_canonical_matches_zcta_join(covars_dir, canonical_dir, var_dict, nodes, ds_nodes):
+    ds_nodes = ds_nodes or nodes
+    joined = make_dataset(covars_dir, var_dict, ds_nodes)
+    sliced = make_dataset(canonical_dir, var_dict, ds_nodes)
+    assert set(sliced.node_alignment) == {"gridmet", "census"}
+    for idx in (0, 8):
+        torch.testing.assert_close(sliced[idx], joined[idx], equal_nan=True)
+    assert sliced.row_to_zcta_assignments == {}
+
+
+def test_canonical_row_count_mismatch_raises(canonical_dir, var_dict, nodes, tmp_path):
+    write_node_manifest(str(tmp_path / "census"), ["00001", "00002"])
+    (tmp_path / "census" / "population").symlink_to(canonical_dir / "census" / "population")
+    ds = make_dataset(tmp_path, {"census": var_dict["census"]}, nodes)
+    with pytest.raises(ValueError):
+        ds[0]
+
+
+def test_tampered_manifest_raises(var_dict, nodes, tmp_path):
+    write_node_manifest(str(tmp_path / "census"), ["00001", "00002"])
+    manifest = tmp_path / "census" / "_nodes.json"
+    manifest.write_text(manifest.read_text().replace("00002", "00009"))
+    with pytest.raises(ValueError):
+        make_dataset(tmp_path, {"census": var_dict["census"]}, nodes)
+
+
+# --------------------------------------------------------------- node blocks
+
+def test_row_group_selection(canonical_dir):
+    meta = pq.ParquetFile(canonical_dir / "census" / "population" / "population__2000.parquet").metadata
+    assert meta.num_row_groups == 2
+    row_groups, local = get_row_group_selection(meta, np.array([3, 2]))
+    assert row_groups == [1] and local.tolist() == [1, 0]
+    row_groups, local = get_row_group_selection(meta, np.array([3, 0]))
+    assert row_groups == [0, 1] and local.tolist() == [3, 0]
+
+
+def test_node_tiles_have_equal_size():
+    tiles = get_node_tiles(10, 4)
+    assert [tile.tolist() for tile in tiles] == [[0, 1, 2, 3], [4, 5, 6, 7], [6, 7, 8, 9]]
+
+
+@pytest.mark.parametrize("root,backend,kwargs", [
+    ("canonical_dir", "parquet", {}),  # row groups of node-sorted files
+    ("canonical_dir", "parquet", {"cache_bytes": 1 << 20}),  # blocks of cached full columns
+    ("covars_dir", "parquet", {}),  # zcta join
+    ("cube_dir", "cube", {}),
+])
+def test_node_block_matches_full(request, var_dict, nodes, root, backend, kwargs):
+    ds = make_dataset(request.getfixturevalue(root), var_dict, nodes, backend=backend, **kwargs)
+    node_idx = np.array([3, 0])
+    torch.testing.assert_close(ds[(5, node_idx)], ds[5][node_idx], equal_nan=True)
+    batch = ds.get_batch([(5, node_idx), (6, node_idx), (5, np.array([1, 2]))])
+    assert batch.shape == (3, 2, 3, 7)
+    torch.testing.assert_close(batch[1], ds[6][node_idx], equal_nan=True)
+    torch.testing.assert_close(batch[2], ds[5][[1, 2]], equal_nan=True)
+
+
+def test_node_block_reads_only_needed_row_groups(canonical_dir, var_dict, nodes, monkeypatch):
+    ds = make_dataset(canonical_dir, var_dict, nodes)
+    read = []
+    original = pq.ParquetFile.read_row_groups
+    monkeypatch.setattr(pq.ParquetFile, "read_row_groups",
+                        lambda self, row_groups, **kw: read.append(list(row_groups)) or original(self, row_groups, **kw))
+    # nodes[0] = "00003" is row 2 of the file: only the second row group
+    x = ds[(0, np.array([0]))]
+    assert read and all(row_groups == [1] for row_groups in read)
+    torch.testing.assert_close(x, make_dataset(canonical_dir, var_dict, nodes)[0][:1], equal_nan=True)
+
+
+def test_node_block_sampler_with_dataloader(canonical_dir, var_dict, nodes):
+    ds = make_dataset(canonical_dir, var_dict, nodes)
+    sampler = NodeBlockSampler(ds, block_size=3, mode="tiles", shuffle=False)
+    assert len(sampler) == 2 * len(ds)
+    loader = torch.utils.data.DataLoader(ds, batch_size=4, sampler=sampler)
+    batch = next(iter(loader))
+    assert batch.shape == (4, 3, 3, 7)
+    torch.testing.assert_close(batch[2], ds[2][:3], equal_nan=True)
+
+    sampler = NodeBlockSampler(ds, block_size=2, mode="random", generator=torch.Generator().manual_seed(0))
+    idx, node_idx = next(iter(sampler))
+    assert len(sampler) == 2 * len(ds) and len(node_idx) == 2 and (np.diff(node_idx) > 0).all()
+
+
+def test_node_validity_spans_window_years():
+    validity = NodeValidity(["a", "b", "c"], {2000: ["a"], 2001: ["b", "z"]}, 2000, 2002)
+    assert validity.mask(["20001230", "20001231"]).tolist() == [True, False, False]
+    assert validity.mask(["20001231", "20010101"]).tolist() == [True, True, False]
+    assert validity.mask(["20020101"]).tolist() == [True, True, True]  # year without a node list
+    assert validity.mask(["20001231", "20010101"], np.array([2, 1])).tolist() == [False, True]
+
+
+def test_compact_nodes(canonical_dir, var_dict, nodes):
+    full = make_dataset(canonical_dir, var_dict, nodes)
+    with pytest.raises(ValueError):
+        make_dataset(canonical_dir, var_dict, nodes, compact_nodes=True)
+    ds = make_dataset(canonical_dir, var_dict, nodes, node_years={2000: ["00001", "00003"]}, compact_nodes=True)
+    assert ds.node_mask(5).tolist() == [True, True, False, False]
+    tensor, node_mask, node_index = ds[5]
+    torch.testing.assert_close(tensor, full[5][:2], equal_nan=True)
+    assert node_mask.tolist() == [True, True] and node_index.tolist() == [0, 1]
+    batch, node_masks, node_index = ds.get_batch([5, 6])
+    assert batch.shape == (2, 2, 3, 7) and node_index.tolist() == [[0, 1], [0, 1]] and node_masks.all()
+    torch.testing.assert_close(batch[1], full[6][:2], equal_nan=True)
+    # explicit node blocks are left alone
+    tensor, node_mask, node_index = ds[(5, np.array([2]))]
+    torch.testing.assert_close(tensor, full[5][[2]], equal_nan=True)
+    assert node_mask.tolist() == [False] and node_index.tolist() == [2]
+
+
+def test_node_entries_with_mask_and_workers(canonical_dir, var_dict, nodes):
+    ds = make_dataset(canonical_dir, var_dict, nodes, node_years={2000: ["00001", "00003"]}, return_mask="packed")
+    tensor, packed, valid_count, node_mask, node_index = ds[5]
+    assert node_mask.tolist() == [True, True, False, False] and node_index.tolist() == [0, 1, 2, 3]
+    loader = torch.utils.data.DataLoader(ds, batch_size=2, sampler=[5, 6], num_workers=2)
+    tensor, packed, valid_count, node_mask, node_index = next(iter(loader))
+    assert node_mask.shape == (2, 4) and node_index.tolist() == [[0, 1, 2, 3]] * 2
+
+
+# --------------------------------------------------------------- shared memory
+
+@pytest.mark.parametrize("root,backend", [("covars_dir", "parquet"), ("canonical_dir", "parquet"), ("cube_dir", "cube")])
+def test_shared_memory_matches_files(request, var_dict, nodes, root, backend):
+    root = request.getfixturevalue(root)
+    files = make_dataset(root, var_dict, nodes, backend=backend)
+    shared = make_dataset(root, var_dict, nodes, backend=backend, shared_memory=True)
+    assert all(cube.shared.is_shared() for cube, *_ in shared.cubes.values())
+    for idx in (0, 4, 200):
+        torch.testing.assert_close(shared[idx], files[idx], equal_nan=True)
+    torch.testing.assert_close(shared[(4, np.array([2, 0]))], files[4][[2, 0]], equal_nan=True)
+
+
+def test_shared_memory_is_attached_not_copied(covars_dir, var_dict, nodes):
+    import pickle
+    from multiprocessing.reduction import ForkingPickler
+
+    import torch.multiprocessing  # noqa: F401  registers the shared-memory reductions
+
+    ds = make_dataset(covars_dir, var_dict, nodes, shared_memory=True)
+    # what a spawned DataLoader worker receives: a handle to the same storage
+    clone = pickle.loads(ForkingPickler.dumps(ds))
+    assert clone.cubes["gridmet"][0].shared.data_ptr() == ds.cubes["gridmet"][0].shared.data_ptr()
+    loader = torch.utils.data.DataLoader(ds, batch_size=2, num_workers=1, multiprocessing_context="spawn")
+    batch = next(iter(loader))
+    torch.testing.assert_close(batch[1], ds[1], equal_nan=True)
+
+
+# --------------------------------------------------------------- prefetch
+
+@pytest.mark.parametrize("cache_bytes", [0, 1 << 20])
+def test_prefetch_matches_serial(covars_dir, var_dict, nodes, cache_bytes):
+    serial = make_dataset(covars_dir, var_dict, nodes)
+    prefetched = make_dataset(covars_dir, var_dict, nodes, cache_bytes=cache_bytes,
+                              prefetch_threads=3, prefetch_ahead=2)
+    for idx in (0, 1, 2, 50):
+        torch.testing.assert_close(prefetched[idx], serial[idx], equal_nan=True)
+    info = prefetched.prefetch_info()
+    assert info["used"] > 0 and info["submitted"] >= info["used"]
+    assert serial.prefetch_info() is None
+
+
+def test_prefetch_follows_sampler_order(covars_dir, var_dict, nodes):
+    from legoloaderx.prefetch import PrefetchSampler
+
+    ds = make_dataset(covars_dir, var_dict, nodes, cache_bytes=1 << 20, prefetch_threads=2, prefetch_ahead=1)
+    order = [40, 7, 300]
+    loader = torch.utils.data.DataLoader(ds, batch_size=1, sampler=PrefetchSampler(order, ds))
+    batches = list(loader)
+    assert ds.prefetch_order == order
+    torch.testing.assert_close(batches[1][0], make_dataset(covars_dir, var_dict, nodes)[7], equal_nan=True)
+    # every block read ahead of time was eventually consumed
+    assert ds.prefetch_info()["inflight"] == 0
+
+
+def test_prefetch_in_worker_process(covars_dir, var_dict, nodes):
+    ds = make_dataset(covars_dir, var_dict, nodes, prefetch_threads=2, prefetch_ahead=1)
+    ds[0]  # start the parent's pool before the worker forks
+    loader = torch.utils.data.DataLoader(ds, batch_size=2, num_workers=1)
+    batch = next(iter(loader))
+    torch.testing.assert_close(batch[1], ds[1], equal_nan=True)
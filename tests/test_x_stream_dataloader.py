@@ -0,0 +1,77 @@
+"""Tests for ``legoloaderx.XStreamDataset`` against random-access ``XDataset``."""
+
+from __future__ import annotations
+
+import pytest
+import torch
+
+from legoloaderx import XDataset, XStreamDataset
+
+
+@pytest.fixture(scope="module")
+def ds(covars_dir, var_dict, nodes):
+    return XDataset(
+        root_dir=str(covars_dir), var_dict=var_dict, nodes=nodes, window=7,
+        min_year=2000, max_year=2000,
+    )
+
+
+@pytest.fixture(scope="module")
+def expected(ds):
+    return ds.get_batch(list(range(len(ds))))
+
+
+@pytest.mark.parametrize("chunk_days", [1, 10, 1000])
+def test_stream_matches_getitem(ds, expected, chunk_days):
+    windows = [window.clone() for window in XStreamDataset(ds, chunk_days=chunk_days)]
+    assert len(windows) == len(ds)
+    torch.testing.assert_close(torch.stack(windows), expected, equal_nan=True)
+
+
+def test_stream_yields_ring_views(ds):
+    stream = iter(XStreamDataset(ds, return_index=True))
+    idx, first = next(stream)
+    assert idx == 0 and first.shape == (4, 3, 7)
+    second = next(stream)[1]
+    assert first.untyped_storage().data_ptr() == second.untyped_storage().data_ptr()
+
+
+def test_stream_shards_across_workers(ds, expected):
+    stream = XStreamDataset(ds, batch_size=16, return_index=True)
+    loader = torch.utils.data.DataLoader(stream, batch_size=16, num_workers=2)
+    seen = torch.zeros(len(ds), dtype=torch.long)
+    for indices, batch in loader:
+        seen[indices] += 1
+        torch.testing.assert_close(batch, expected[indices], equal_nan=True)
+    assert (seen == 1).all()
+
+
+def test_summary_from_packed_stream_matches_nan_scan(covars_dir, var_dict, nodes):
+    from legoloaderx.utils import compute_summary
+
+    summaries = []
+    for return_mask in (False, "packed"):
+        ds = XDataset(
+            root_dir=str(covars_dir), var_dict=var_dict, nodes=nodes, window=1,
+            min_year=2000, max_year=2000, return_mask=return_mask,
+        )
+        summaries.append(compute_summary(torch.utils.data.DataLoader(XStreamDataset(ds), batch_size=1)))
+    plain, packed = summaries
+    for var_group_name, var_group in var_dict.items():
+        for var in var_group["vars"]:
+            assert packed[var_group_name][var] == pytest.approx(plain[var_group_name][var])
+
+
+def test_summary_of_integer_outputs_is_unscaled(covars_dir, var_dict, nodes):
+    from legoloaderx.utils import compute_summary
+
+    summaries = []
+    for census in (var_dict["census"], dict(var_dict["census"], dtype="uint8", scale=2)):
+        ds = XDataset(
+            root_dir=str(covars_dir), var_dict={"census": census}, nodes=nodes, window=1,
+            min_year=2000, max_year=2000, return_mask=True,
+        )
+        summaries.append(compute_summary(torch.utils.data.DataLoader(ds, batch_size=16))["census"]["population"])
+    plain, scaled = summaries
+    assert scaled == pytest.approx(plain)
+    assert scaled["mean"] == pytest.approx(20.0)